@@ -0,0 +1,354 @@
+#-*- coding:utf-8 -*-
+
+'''in-process stand-ins of the db_conn and mc of past.store, the models run
+on them unchanged. picked up by past.store through
+PAST_STORE_FACTORY=bench.fakes:create_store
+
+    FakeDB          sqlite3, the mysql-isms the models use (%s params,
+                    backquoted names, replace into, limit m,n) are fine
+    FakeMemcache    dict, values pickled as memcached does, with expire,
+                    add/incr/gets/cas semantics of python-memcached
+'''
+
+import os
+import re
+import time
+import sqlite3
+import threading
+import contextlib
+import cPickle as pickle
+
+import MySQLdb
+
+from past.utils import profile
+
+SCHEMA = '''
+create table if not exists `user` (
+    `id` integer primary key autoincrement,
+    `uid` varchar(16) not null default '' unique,
+    `name` varchar(63) not null default '',
+    `session_id` varchar(16) default null,
+    `time` timestamp not null default current_timestamp
+);
+create table if not exists `user_alias` (
+    `id` integer primary key autoincrement,
+    `type` varchar(2) not null default '',
+    `user_id` integer not null default 0,
+    `alias` varchar(128) not null default '',
+    `time` timestamp not null default current_timestamp,
+    unique (`alias`, `type`)
+);
+create index if not exists idx_alias_uid on user_alias(`user_id`);
+create table if not exists `oauth2_token` (
+    `id` integer primary key autoincrement,
+    `alias_id` integer not null unique,
+    `access_token` varchar(128) not null default '',
+    `refresh_token` varchar(128) not null default '',
+    `expire_time` timestamp null default null,
+    `time` timestamp not null default current_timestamp
+);
+create table if not exists `passwd` (
+    `user_id` integer not null unique,
+    `email` varchar(63) not null unique,
+    `salt` varchar(8) not null default '',
+    `passwd` varchar(15) not null default '',
+    `time` timestamp not null default current_timestamp
+);
+create table if not exists `status` (
+    `id` integer primary key autoincrement,
+    `user_id` integer not null,
+    `origin_id` varchar(20) not null default '0',
+    `create_time` timestamp not null,
+    `site` varchar(2) not null,
+    `category` smallint not null,
+    `title` varchar(150) not null default '',
+    `time` timestamp not null default current_timestamp,
+    unique (`origin_id`, `site`, `category`)
+);
+create index if not exists idx_status_create_time on status(`create_time`);
+create index if not exists idx_status_uid on status(`user_id`);
+create table if not exists `raw_status` (
+    `status_id` integer primary key,
+    `text` text not null default '',
+    `raw` text not null default '',
+    `time` timestamp not null default current_timestamp
+);
+create table if not exists `note` (
+    `id` integer primary key autoincrement,
+    `user_id` integer not null,
+    `title` varchar(150) not null default '',
+    `content` text not null default '',
+    `create_time` timestamp not null,
+    `update_time` timestamp not null default current_timestamp,
+    `fmt` varchar(2) not null default 'P',
+    `privacy` varchar(2) default 'P'
+);
+create index if not exists idx_note_uid on note(`user_id`);
+create table if not exists `sync_task` (
+    `id` integer primary key autoincrement,
+    `category` smallint not null,
+    `user_id` integer not null,
+    `time` timestamp not null default current_timestamp,
+    unique (`user_id`, `category`)
+);
+create table if not exists `task_queue` (
+    `id` integer primary key autoincrement,
+    `task_id` integer not null,
+    `task_kind` smallint not null,
+    `time` timestamp not null default current_timestamp
+);
+create table if not exists `kv` (
+    `key` varchar(128) primary key,
+    `value` text not null default '',
+    `time` timestamp not null default current_timestamp
+);
+create table if not exists `user_profile` (
+    `user_id` integer primary key,
+    `profile` text not null default '',
+    `time` timestamp not null default current_timestamp
+);
+create table if not exists `user_profile_item` (
+    `user_id` integer not null,
+    `key` varchar(64) not null,
+    `value` text not null default '',
+    `time` timestamp not null default current_timestamp,
+    primary key (`user_id`, `key`)
+);
+create table if not exists `pdf_settings` (
+    `user_id` integer primary key,
+    `time` timestamp not null default current_timestamp
+);
+create table if not exists `pdf_file` (
+    `user_id` integer not null,
+    `month` char(6) not null,
+    `volume` integer not null default 1,
+    `filename` varchar(128) not null,
+    `size` integer not null default 0,
+    `digest` char(32) not null default '',
+    `time` timestamp not null default current_timestamp,
+    primary key (`user_id`, `month`, `volume`)
+);
+create table if not exists `confirmation` (
+    `id` integer primary key autoincrement,
+    `random_id` varchar(16) not null unique,
+    `text` varchar(128) not null,
+    `time` timestamp not null default current_timestamp
+);
+create table if not exists `token_health` (
+    `user_id` integer not null,
+    `provider` varchar(2) not null,
+    `status` varchar(16) not null default 'ok',
+    `msg` varchar(255) not null default '',
+    `since` timestamp not null default '0000-00-00 00:00:00',
+    `time` timestamp not null default current_timestamp,
+    primary key (`user_id`, `provider`)
+);
+create index if not exists idx_token_health_status on token_health(`status`);
+create table if not exists `user_tokens` (
+    `id` integer primary key autoincrement,
+    `user_id` integer not null,
+    `token` varchar(64) not null unique,
+    `device` varchar(128) not null default '',
+    `time` timestamp not null default current_timestamp
+);
+'''
+
+_ISO_TIME_RE = re.compile(r"^(\d{4}-\d\d-\d\d)T(\d\d:\d\d:\d\d)")
+
+def _param(x):
+    ## sqlite3 refuses non-ascii bytestrings, mysqldb takes them as utf8
+    if isinstance(x, str):
+        x = x.decode("utf8")
+    ## mysql cuts 2012-01-01T10:00:00+08:00 to a timestamp, as douban 
+    ## miniblog and note are stored
+    if isinstance(x, unicode):
+        m = _ISO_TIME_RE.match(x)
+        if m:
+            return u"%s %s" % m.groups()
+    return x
+
+class FakeDB(object):
+
+    def __init__(self, path=":memory:"):
+        self.path = path
+        self._local = threading.local()
+        self._shared_conn = None
+        self.connect()
+
+    def _get_conn(self):
+        if getattr(self._local, "own", False):
+            return self._local.conn
+        return self._shared_conn
+
+    def _set_conn(self, conn):
+        if getattr(self._local, "own", False):
+            self._local.conn = conn
+        else:
+            self._shared_conn = conn
+    _conn = property(_get_conn, _set_conn)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path,
+                detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+        conn.executescript(SCHEMA)
+        return conn
+
+    @contextlib.contextmanager
+    def own_connection(self):
+        ## :memory:的库另开连接就是另一个库了, 只能接着共用
+        if self.path == ":memory:":
+            yield self._conn
+            return
+        self._local.own = True
+        self._local.conn = self._connect()
+        try:
+            yield self._local.conn
+        finally:
+            conn, self._local.conn = self._local.conn, None
+            self._local.own = False
+            conn.close()
+
+    def connect(self):
+        self._conn = self._connect()
+        return self._conn
+
+    def execute(self, sql, args=None, cursor=None):
+        if args is None:
+            args = ()
+        elif not isinstance(args, (tuple, list)):
+            args = (args,)
+        args = [_param(x) for x in args]
+
+        t = time.time()
+        try:
+            cursor = cursor or self._conn.cursor()
+            cursor.execute(sql.replace("%s", "?"), args)
+        except sqlite3.IntegrityError, e:
+            raise MySQLdb.IntegrityError(*e.args)
+        finally:
+            profile.record_sql(sql, time.time() - t)
+        return cursor
+
+    def commit(self):
+        return self._conn and self._conn.commit()
+
+    def rollback(self):
+        return self._conn and self._conn.rollback()
+
+class FakeMemcache(object):
+
+    ## memcached takes expire larger than 30 days as a unix timestamp
+    MAX_RELATIVE_EXPIRE = 60 * 60 * 24 * 30
+
+    def __init__(self):
+        self._data = {}
+        self._version = 0
+        self.cas_ids = {}
+
+    def _expire_at(self, t):
+        if not t:
+            return 0
+        if t > self.MAX_RELATIVE_EXPIRE:
+            return t
+        return time.time() + t
+
+    def _get(self, key):
+        r = self._data.get(key)
+        if r is None:
+            return None
+        value, expire_at, version = r
+        if expire_at and expire_at <= time.time():
+            del self._data[key]
+            return None
+        return r
+
+    def _set(self, key, val, time_=0):
+        self._version += 1
+        self._data[key] = (pickle.dumps(val, pickle.HIGHEST_PROTOCOL),
+                self._expire_at(time_), self._version)
+        return True
+
+    def get(self, key):
+        r = self._get(key)
+        return pickle.loads(r[0]) if r else None
+
+    def gets(self, key):
+        r = self._get(key)
+        if r is None:
+            return None
+        self.cas_ids[key] = r[2]
+        return pickle.loads(r[0])
+
+    def get_multi(self, keys, key_prefix=''):
+        rs = {}
+        for k in keys:
+            v = self.get(key_prefix + k)
+            if v is not None:
+                rs[k] = v
+        return rs
+
+    def set(self, key, val, time=0, min_compress_len=0):
+        return self._set(key, val, time)
+
+    def set_multi(self, mapping, time=0, key_prefix='', min_compress_len=0):
+        for k, v in mapping.iteritems():
+            self._set(key_prefix + k, v, time)
+        return []
+
+    def add(self, key, val, time=0, min_compress_len=0):
+        if self._get(key) is not None:
+            return False
+        return self._set(key, val, time)
+
+    def replace(self, key, val, time=0, min_compress_len=0):
+        if self._get(key) is None:
+            return False
+        return self._set(key, val, time)
+
+    def cas(self, key, val, time=0, min_compress_len=0):
+        ## no gets before, cas works as set
+        if key not in self.cas_ids:
+            return self._set(key, val, time)
+        version = self.cas_ids.pop(key)
+        r = self._get(key)
+        if r is None or r[2] != version:
+            return False
+        return self._set(key, val, time)
+
+    def delete(self, key, time=0):
+        self._data.pop(key, None)
+        return 1
+
+    def delete_multi(self, keys, time=0, key_prefix=''):
+        for k in keys:
+            self.delete(key_prefix + k)
+        return 1
+
+    def incr(self, key, delta=1):
+        r = self._get(key)
+        if r is None:
+            return None
+        value = max(int(pickle.loads(r[0])) + delta, 0)
+        self._version += 1
+        self._data[key] = (pickle.dumps(str(value), pickle.HIGHEST_PROTOCOL),
+                r[1], self._version)
+        return value
+
+    def decr(self, key, delta=1):
+        return self.incr(key, -delta)
+
+    def reset_cas(self):
+        self.cas_ids = {}
+
+    def flush_all(self):
+        self._data = {}
+
+    def disconnect_all(self):
+        pass
+
+    def get_stats(self):
+        return [("fake", {"curr_items": str(len(self._data))})]
+
+def create_store():
+    ## PAST_BENCH_DB: a sqlite file to keep the seeded data between runs
+    return FakeDB(os.environ.get("PAST_BENCH_DB", ":memory:")), FakeMemcache()
@@ -0,0 +1,533 @@
+#-*- coding:utf-8 -*-
+
+'''local http stand-in of the provider apis, to load test jobs.sync, the
+backfill of cronjob/first_sync_timeline.py and the clients in past/api
+without calling douban, sina etc.
+
+one server answers all the providers, told apart by the path:
+
+    douban      /shuo/v2/statuses/user_timeline/<uid>  since_id, until_id, count
+                /people/<uid>/notes, /people/<uid>/miniblog  start-index, max-results
+                /service/auth2/token  (refresh_token)
+    sina        /2/statuses/user_timeline.json  since_id, max_id, page, count
+    twitter     /1.1/statuses/user_timeline.json  since_id, max_id, count
+    qqweibo     /api/statuses/broadcast_timeline  pageflag, pagetime, reqnum
+    renren      /restserver.do  method=status.gets|blog.gets|blog.get|
+                photos.getAlbums|photos.get, page, count
+                /oauth/token  (refresh_token)
+    instagram   /v1/users/<uid>/media/recent  min_id, max_id, count
+
+every access token gets its own timeline, generated on first use with
+bench.seed.Generator. a refreshed token keeps the timeline of the old one.
+latency, random 5xx, token expiry (douban 106 etc.) and rate limits are
+configurable, each provider answers them in its own format.
+
+    python -m bench.mock_provider --port 8900 --latency 0.05 --expire-after 30
+
+or in process:
+
+    server = MockProviderServer(port=0, latency=0.05).start()
+    point_clients_at(server.url)
+'''
+
+import sys
+import time
+import json
+import random
+import urllib
+import urlparse
+import datetime
+import threading
+from collections import defaultdict
+from optparse import OptionParser
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+from bench.seed import Generator
+
+DOUBAN = "douban"
+SINA = "sina"
+TWITTER = "twitter"
+QQ = "qq"
+RENREN = "renren"
+INSTAGRAM = "instagram"
+
+## 一页最多返回的条数，和各家api的限制一致
+MAX_COUNT = {
+    DOUBAN: 200,
+    SINA: 100,
+    TWITTER: 200,
+    QQ: 70,
+    RENREN: 1000,
+    INSTAGRAM: 33,
+}
+
+class Account(object):
+    '''the statuses of one access token, newest first'''
+
+    def __init__(self, key, size, days, seed, start_id):
+        self.key = key
+        self.size = size
+        self.days = days
+        self.gen = Generator(hash((seed, key)) & 0xffffffff, start_id)
+        self.uid = self.gen.rnd.randint(10**6, 10**7)
+        self.requests = 0
+        self.expired = False
+        self.window = []
+        self._timelines = {}
+        self._lock = threading.Lock()
+
+    def _times(self, n):
+        ## 由远及近，id也随之递增
+        now = datetime.datetime.now()
+        step = self.days * 86400.0 / max(n, 1)
+        return [now - datetime.timedelta(seconds=step * i) for i in xrange(n - 1, -1, -1)]
+
+    def timeline(self, name):
+        with self._lock:
+            if name not in self._timelines:
+                make = {
+                    DOUBAN: self.gen.douban_status,
+                    SINA: self.gen.sina_status,
+                    TWITTER: self.gen.twitter_status,
+                    QQ: self.gen.qq_status,
+                    "renren_status": self.gen.renren_status,
+                    "renren_blog": self.gen.renren_blog,
+                    "renren_album": self.gen.renren_album,
+                    INSTAGRAM: self.gen.instagram_status,
+                    "douban_note": lambda uid, t: self.gen.douban_entry("note", t),
+                    "douban_miniblog": lambda uid, t: self.gen.douban_entry("miniblog", t),
+                }[name]
+                size = self.size if name != "renren_album" else max(self.size / 50, 1)
+                self._timelines[name] = [make(self.uid, t) for t in self._times(size)][::-1]
+            return self._timelines[name]
+
+    def photos(self, aid, size):
+        key = "renren_photo:%s" % aid
+        with self._lock:
+            if key not in self._timelines:
+                self._timelines[key] = [self.gen.renren_photo(self.uid, t)
+                        for t in self._times(size)][::-1]
+            return self._timelines[key]
+
+def _int(x, default=0):
+    try:
+        return int(x)
+    except (TypeError, ValueError):
+        return default
+
+def _id_of(d):
+    ## instagram的id是 <media_id>_<user_id>
+    return _int(str(d.get("id", "")).split("_")[0])
+
+def after(items, since_id, count, id_of=_id_of):
+    '''newer than since_id, the newest count of them'''
+    return [x for x in items if id_of(x) > since_id][:count]
+
+def before(items, max_id, count, inclusive=False, id_of=_id_of):
+    if inclusive:
+        return [x for x in items if id_of(x) <= max_id][:count]
+    return [x for x in items if id_of(x) < max_id][:count]
+
+def page_of(items, page, count):
+    start = (max(page, 1) - 1) * count
+    return items[start:start + count]
+
+class MockProvider(object):
+
+    def __init__(self, timeline_size=500, days=365*3, latency=0.0, jitter=0.0,
+            error_rate=0.0, expire_after=0, rate_limit=0, rate_window=3600, seed=1):
+        self.timeline_size = timeline_size
+        self.days = days
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.expire_after = expire_after
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.seed = seed
+        self.rnd = random.Random(seed)
+        self.accounts = {}
+        self.tokens = {}
+        ## 每个帐号一段id，不同用户的status不会撞上 (origin_id, site, category)
+        self._next_start_id = 10**10
+        self.stats = defaultdict(int)
+        self._lock = threading.Lock()
+
+    ## -- accounts --
+    def account(self, token):
+        with self._lock:
+            key = self.tokens.setdefault(token, token)
+            if key not in self.accounts:
+                self.accounts[key] = Account(key, self.timeline_size, self.days,
+                        self.seed, self._next_start_id)
+                self._next_start_id += 10**8
+            return self.accounts[key]
+
+    def refresh(self, refresh_token):
+        ## refresh_token 和 access_token 指向同一个帐号
+        acc = self.account(refresh_token)
+        new_token = "%032x" % self.rnd.getrandbits(128)
+        with self._lock:
+            self.tokens[new_token] = acc.key
+            acc.expired = False
+            acc.requests = 0
+        return {"access_token": new_token, "refresh_token": refresh_token,
+                "expires_in": 604800, "token_type": "Bearer"}
+
+    def expire(self, token):
+        self.account(token).expired = True
+
+    def _check(self, acc):
+        '''returns "expired", "rate_limited" or None'''
+        now = time.time()
+        with self._lock:
+            acc.requests += 1
+            if self.expire_after and acc.requests > self.expire_after:
+                acc.expired = True
+            if acc.expired:
+                return "expired"
+            if self.rate_limit:
+                acc.window = [t for t in acc.window if t > now - self.rate_window]
+                if len(acc.window) >= self.rate_limit:
+                    return "rate_limited"
+                acc.window.append(now)
+        return None
+
+    ## -- dispatch --
+    def handle(self, method, path, qs, headers):
+        '''returns (http status, json data)'''
+        if self.latency or self.jitter:
+            time.sleep(self.latency + self.rnd.uniform(0, self.jitter))
+
+        provider, handler = self.route(path, qs)
+        if not handler:
+            return self._count(provider, 404, {"error": "no such api: %s" % path})
+
+        if handler in (self.douban_token, self.renren_token):
+            return self._count(provider, *handler(qs))
+
+        if self.error_rate and self.rnd.random() < self.error_rate:
+            return self._count(provider, self.rnd.choice([500, 502, 503]),
+                    {"error": "internal error"})
+
+        token = self.token_of(provider, qs, headers)
+        if not token:
+            return self._count(provider, *self.error(provider, "expired", path))
+        acc = self.account(token)
+        err = self._check(acc)
+        if err:
+            return self._count(provider, *self.error(provider, err, path))
+        return self._count(provider, *handler(acc, path, qs))
+
+    def _count(self, provider, status, data):
+        self.stats["%s:%s" % (provider, status)] += 1
+        return status, data
+
+    def route(self, path, qs):
+        parts = path.strip("/").split("/")
+        if path.startswith("/shuo/v2/statuses/user_timeline/"):
+            return DOUBAN, self.douban_timeline
+        if path.startswith("/people/") and parts[-1] in ("notes", "miniblog"):
+            return DOUBAN, self.douban_entries
+        if path == "/service/auth2/token":
+            return DOUBAN, self.douban_token
+        if path.startswith("/1.1/") or path.startswith("/1/"):
+            return TWITTER, path.endswith("/statuses/user_timeline.json") and self.twitter_timeline
+        if path.endswith("/statuses/user_timeline.json"):
+            ## /2/statuses/..., the client may drop the /2
+            return SINA, self.sina_timeline
+        if path == "/api/statuses/broadcast_timeline":
+            return QQ, self.qq_timeline
+        if path == "/restserver.do":
+            return RENREN, self.renren
+        if path == "/oauth/token":
+            return RENREN, self.renren_token
+        if path.startswith("/v1/users/") and path.endswith("/media/recent"):
+            return INSTAGRAM, self.instagram_timeline
+        return "unknown", None
+
+    def token_of(self, provider, qs, headers):
+        auth = headers.get("authorization", "")
+        if provider == DOUBAN:
+            return auth[len("Bearer "):] if auth.startswith("Bearer ") else None
+        if provider == TWITTER:
+            for x in auth.split(","):
+                k, _, v = x.strip().partition("=")
+                if k.endswith("oauth_token"):
+                    return urllib.unquote(v.strip('"'))
+            return None
+        if provider == QQ:
+            return qs.get("oauth_token")
+        return qs.get("access_token")
+
+    def error(self, provider, kind, path):
+        '''the error responses of each provider, see check_result of the clients'''
+        expired = kind == "expired"
+        if provider == DOUBAN:
+            if expired:
+                return 400, {"code": 106, "msg": "access_token_has_expired", "request": path}
+            return 400, {"code": 1998, "msg": "rate_limit_exceeded2", "request": path}
+        if provider == SINA:
+            if expired:
+                return 400, {"error": "expired_token", "error_code": 21327, "request": path}
+            return 403, {"error": "User requests out of rate limit!", "error_code": 10023,
+                    "request": path}
+        if provider == TWITTER:
+            if expired:
+                return 401, {"errors": [{"message": "Invalid or expired token", "code": 89}]}
+            return 429, {"errors": [{"message": "Rate limit exceeded", "code": 88}]}
+        if provider == QQ:
+            if expired:
+                return 200, {"ret": 3, "errcode": 37, "msg": "check sign error", "data": None}
+            return 200, {"ret": 4, "errcode": 10, "msg": "access rate limit", "data": None}
+        if provider == RENREN:
+            if expired:
+                return 200, {"error_code": 106, "error_msg": "session key expired"}
+            return 200, {"error_code": 10302, "error_msg": "api calls limit exceeded"}
+        if provider == INSTAGRAM:
+            if expired:
+                return 400, {"meta": {"code": 400, "error_type": "OAuthAccessTokenException",
+                        "error_message": "The access_token provided is invalid."}}
+            return 429, {"meta": {"code": 429, "error_type": "OAuthRateLimitException",
+                    "error_message": "The maximum number of requests per hour has been exceeded."}}
+        return 400, {"error": kind}
+
+    def _count_arg(self, provider, x, default):
+        return min(_int(x, default) or default, MAX_COUNT[provider])
+
+    ## -- douban --
+    def douban_timeline(self, acc, path, qs):
+        items = acc.timeline(DOUBAN)
+        count = self._count_arg(DOUBAN, qs.get("count"), 20)
+        if qs.get("since_id"):
+            return 200, after(items, _int(qs["since_id"]), count)
+        if qs.get("until_id"):
+            return 200, before(items, _int(qs["until_id"]), count)
+        return 200, items[:count]
+
+    def douban_entries(self, acc, path, qs):
+        kind = path.rstrip("/").split("/")[-1]
+        items = acc.timeline("douban_note" if kind == "notes" else "douban_miniblog")
+        start = _int(qs.get("start-index"), 0)
+        count = self._count_arg(DOUBAN, qs.get("max-results"), 50)
+        return 200, {"entry": items[start:start + count],
+                "opensearch:totalResults": {"$t": str(len(items))}}
+
+    def douban_token(self, qs):
+        if qs.get("grant_type") != "refresh_token" or not qs.get("refresh_token"):
+            return 400, {"code": 100, "msg": "invalid_request_1"}
+        return 200, self.refresh(qs["refresh_token"])
+
+    ## -- sina --
+    def sina_timeline(self, acc, path, qs):
+        items = acc.timeline(SINA)
+        count = self._count_arg(SINA, qs.get("count"), 20)
+        if qs.get("since_id"):
+            r = after(items, _int(qs["since_id"]), count)
+        elif qs.get("max_id"):
+            ## 新浪的max_id是包含的
+            r = before(items, _int(qs["max_id"]), count, inclusive=True)
+        else:
+            r = page_of(items, _int(qs.get("page"), 1), count)
+        return 200, {"statuses": r, "total_number": len(items),
+                "previous_cursor": 0, "next_cursor": 0}
+
+    ## -- twitter --
+    def twitter_timeline(self, acc, path, qs):
+        items = acc.timeline(TWITTER)
+        count = self._count_arg(TWITTER, qs.get("count"), 20)
+        r = items
+        if qs.get("since_id"):
+            r = [x for x in r if x["id"] > _int(qs["since_id"])]
+        if qs.get("max_id"):
+            r = [x for x in r if x["id"] <= _int(qs["max_id"])]
+        return 200, r[:count]
+
+    ## -- qqweibo --
+    def qq_timeline(self, acc, path, qs):
+        items = acc.timeline(QQ)
+        count = self._count_arg(QQ, qs.get("reqnum"), 20)
+        pageflag = _int(qs.get("pageflag"))
+        pagetime = _int(qs.get("pagetime"))
+        ts = lambda x: x["timestamp"]
+        if pageflag == 1 and pagetime:
+            r = [x for x in items if ts(x) < pagetime][:count]
+        elif pageflag == 2 and pagetime:
+            r = [x for x in items if ts(x) > pagetime][-count:]
+        else:
+            r = items[:count]
+        if not r:
+            return 200, {"ret": 0, "errcode": 0, "msg": "ok", "data": None}
+        return 200, {"ret": 0, "errcode": 0, "msg": "ok",
+                "data": {"info": r, "hasnext": 0 if r[-1] is items[-1] else 1,
+                "timestamp": int(time.time())}}
+
+    ## -- renren --
+    def renren(self, acc, path, qs):
+        api = qs.get("method")
+        page = _int(qs.get("page"), 1)
+        count = self._count_arg(RENREN, qs.get("count"), 20)
+        if api == "status.gets":
+            return 200, page_of(acc.timeline("renren_status"), page, count)
+        if api == "blog.gets":
+            blogs = page_of(acc.timeline("renren_blog"), page, count)
+            return 200, {"uid": acc.uid, "blogs": [{"id": x["id"], "title": x["title"]}
+                    for x in blogs], "total": len(acc.timeline("renren_blog"))}
+        if api == "blog.get":
+            for x in acc.timeline("renren_blog"):
+                if str(x["id"]) == qs.get("id"):
+                    return 200, x
+            return 200, {"error_code": 200, "error_msg": "blog not exists"}
+        if api == "photos.getAlbums":
+            return 200, page_of(acc.timeline("renren_album"), page, count)
+        if api == "photos.get":
+            for x in acc.timeline("renren_album"):
+                if str(x["aid"]) == qs.get("aid"):
+                    return 200, page_of(acc.photos(x["aid"], x["size"]), page, count)
+            return 200, []
+        return 200, {"error_code": 3, "error_msg": "unknown method: %s" % api}
+
+    def renren_token(self, qs):
+        if qs.get("grant_type") != "refresh_token" or not qs.get("refresh_token"):
+            return 400, {"error": "invalid_request"}
+        return 200, self.refresh(qs["refresh_token"])
+
+    ## -- instagram --
+    def instagram_timeline(self, acc, path, qs):
+        items = acc.timeline(INSTAGRAM)
+        count = self._count_arg(INSTAGRAM, qs.get("count"), 20)
+        r = items
+        if qs.get("min_id"):
+            r = [x for x in r if _id_of(x) > _id_of({"id": qs["min_id"]})]
+        if qs.get("max_id"):
+            r = [x for x in r if _id_of(x) < _id_of({"id": qs["max_id"]})]
+        r = r[:count]
+        pagination = {}
+        if r and r[-1] is not items[-1]:
+            pagination["next_max_id"] = r[-1]["id"]
+        return 200, {"meta": {"code": 200}, "data": r, "pagination": pagination}
+
+class _Handler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def _handle(self):
+        u = urlparse.urlsplit(self.path)
+        qs = dict(urlparse.parse_qsl(u.query, keep_blank_values=True))
+        if self.command == "POST":
+            length = int(self.headers.get("content-length") or 0)
+            body = self.rfile.read(length) if length else ""
+            if "multipart" not in self.headers.get("content-type", ""):
+                qs.update(urlparse.parse_qsl(body, keep_blank_values=True))
+        headers = dict((k.lower(), v) for k, v in self.headers.items())
+
+        status, data = self.server.provider.handle(self.command, u.path, qs, headers)
+        content = json.dumps(data)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = _handle
+    do_POST = _handle
+
+    def log_message(self, format, *args):
+        pass
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class MockProviderServer(object):
+
+    def __init__(self, host="127.0.0.1", port=0, **kw):
+        self.provider = MockProvider(**kw)
+        self.httpd = _ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.provider = self.provider
+        self.host, self.port = self.httpd.server_address[:2]
+        self._thread = None
+
+    @property
+    def url(self):
+        return "http://%s:%s" % (self.host, self.port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever)
+        self._thread.setDaemon(True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def point_clients_at(url):
+    '''send the api clients of past/api to url instead of the providers,
+    returns a function restoring them'''
+    import tweepy
+    from past.api.douban import Douban
+    from past.api.sina import SinaWeibo
+    from past.api.qqweibo import QQWeibo
+    from past.api.renren import Renren
+    from past.api.instagram import Instagram
+    from past.api.twitter import TwitterOAuth1
+
+    saved = []
+    def set_(cls, name, value):
+        saved.append((cls, name, cls.__dict__[name]))
+        setattr(cls, name, value)
+
+    host = urlparse.urlsplit(url).netloc
+    set_(Douban, "api_host", url)
+    set_(Douban, "access_token_uri", url + "/service/auth2/token")
+    set_(SinaWeibo, "api_host", url)
+    set_(SinaWeibo, "access_token_uri", url + "/oauth2/access_token")
+    set_(QQWeibo, "api_uri", url + "/api")
+    set_(Renren, "api_host", url + "/restserver.do")
+    set_(Renren, "access_token_uri", url + "/oauth/token")
+    set_(Instagram, "api_host", url)
+    set_(TwitterOAuth1, "api", lambda self: tweepy.API(self.auth, host=host,
+            secure=False, api_root="/1.1", parser=tweepy.parsers.JSONParser()))
+
+    def restore():
+        for cls, name, value in reversed(saved):
+            setattr(cls, name, value)
+    return restore
+
+def main(argv):
+    parser = OptionParser(usage="python -m bench.mock_provider [options]")
+    parser.add_option("--host", default="127.0.0.1")
+    parser.add_option("-p", "--port", type="int", default=8900)
+    parser.add_option("--size", type="int", default=500,
+            help="statuses in the timeline of each token")
+    parser.add_option("--days", type="int", default=365*3,
+            help="the timeline spreads over the recent days")
+    parser.add_option("--latency", type="float", default=0.0, help="seconds")
+    parser.add_option("--jitter", type="float", default=0.0, help="seconds")
+    parser.add_option("--error-rate", type="float", default=0.0,
+            help="ratio of 5xx responses")
+    parser.add_option("--expire-after", type="int", default=0,
+            help="a token expires after this many requests, 0 for never")
+    parser.add_option("--rate-limit", type="int", default=0,
+            help="requests per token per rate window, 0 for no limit")
+    parser.add_option("--rate-window", type="int", default=3600, help="seconds")
+    parser.add_option("--seed", type="int", default=1)
+    options, args = parser.parse_args(argv)
+
+    server = MockProviderServer(options.host, options.port,
+            timeline_size=options.size, days=options.days,
+            latency=options.latency, jitter=options.jitter,
+            error_rate=options.error_rate, expire_after=options.expire_after,
+            rate_limit=options.rate_limit, rate_window=options.rate_window,
+            seed=options.seed)
+    print 'mock provider listening on %s' % server.url
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print json.dumps(server.provider.stats, indent=2, sort_keys=True)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
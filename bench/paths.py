@@ -0,0 +1,180 @@
+#-*- coding:utf-8 -*-
+
+'''the hot paths timed by bench.run, each returns the number of items
+handled'''
+
+import datetime
+
+from past import config
+from past.model.status import Status, SyncTask, \
+        get_status_ids_today_in_history, get_status_ids_yesterday
+from past.model.data import DoubanStatusData, SinaWeiboStatusData, \
+        TwitterStatusData, QQWeiboStatusData, RenrenStatusData, \
+        InstagramStatusData
+
+from bench.seed import Generator
+
+def status_gets(users, limit):
+    n = 0
+    for u in users:
+        n += len(Status.gets(Status.get_ids(u.id, limit=limit)))
+    return n
+
+def timelize(users, limit):
+    from past.view.utils import statuses_timelize
+    n = 0
+    for u in users:
+        n += len(statuses_timelize(Status.gets(Status.get_ids(u.id, limit=limit))))
+    return n
+
+def today_in_history(users, now):
+    n = 0
+    for u in users:
+        n += len(Status.gets(get_status_ids_today_in_history(u.id, now)))
+    return n
+
+def pdf_render(users, limit):
+    from past.utils.pdf import render
+    n = 0
+    for u in users:
+        html = render(u, Status.gets(Status.get_ids(u.id, limit=limit)))
+        n += len(html or "")
+    return n
+
+def reminder_render(users, now):
+    ## the mail of cronjob/send_reminding.py without sending it
+    from past.utils.template import get_template_module
+    m = get_template_module('mail.html')
+
+    y = (now - datetime.timedelta(days=1)).strftime("%Y-%m-%d")
+    n = 0
+    for u in users:
+        d = {}
+        for s in Status.gets(get_status_ids_today_in_history(u.id, now)):
+            d.setdefault(s.create_time.strftime("%Y-%m-%d"), []).append(s)
+        status_of_yesterday = Status.gets(get_status_ids_yesterday(u.id, now))
+        intros = [u.get_thirdparty_profile(x).get("intro") for x in config.OPENID_TYPE_DICT.values()]
+        intros = filter(None, intros)
+        html = m.status_in_past(status_of_yesterday, d, y, config, intros)
+        n += len(html.encode("utf8"))
+    return n
+
+class FakeClient(object):
+    '''a provider client returning new statuses on each call, as if the
+    user kept posting'''
+
+    def __init__(self, gen, uid, count=20):
+        self.gen = gen
+        self.uid = uid
+        self.count = count
+
+    def _statuses(self, make, cls, count):
+        now = datetime.datetime.now()
+        return [cls(make(self.uid, now - datetime.timedelta(minutes=i)))
+                for i in xrange(min(count or self.count, self.count))]
+
+    def get_douban_timeline(self, since_id=None, until_id=None, count=200, user_id=None):
+        return self._statuses(self.gen.douban_status, DoubanStatusData, count)
+
+    def get_sina_timeline(self, since_id=None, until_id=None, count=100):
+        return self._statuses(self.gen.sina_status, SinaWeiboStatusData, count)
+
+    def get_twitter_timeline(self, since_id=None, max_id=None, count=200):
+        return self._statuses(self.gen.twitter_status, TwitterStatusData, count)
+
+    def get_new_timeline(self, reqnum=20):
+        return self._statuses(self.gen.qq_status, QQWeiboStatusData, reqnum)
+
+    def get_old_timeline(self, pagetime, reqnum=200):
+        return self._statuses(self.gen.qq_status, QQWeiboStatusData, reqnum)
+
+    def get_renren_timeline(self, page=1, count=100):
+        return self._statuses(self.gen.renren_status, RenrenStatusData, count)
+
+    def get_instagram_timeline(self, uid=None, min_id=None, max_id=None, count=100):
+        return self._statuses(self.gen.instagram_status, InstagramStatusData, count)
+
+def mock_providers(seed_=1):
+    '''replace get_client of the api classes with FakeClient, returns a
+    function restoring them'''
+    from past.api.douban import Douban
+    from past.api.sina import SinaWeibo
+    from past.api.twitter import TwitterOAuth1
+    from past.api.qqweibo import QQWeibo
+    from past.api.renren import Renren
+    from past.api.instagram import Instagram
+
+    ## ids after the seeded ones
+    gen = Generator(seed_, start_id=6000000000)
+    saved = []
+    def patch(cls, timeline):
+        def get_client(cls_, user_id):
+            client = FakeClient(gen, int(user_id))
+            if timeline:
+                client.get_timeline = getattr(client, timeline)
+            return client
+        saved.append((cls, cls.__dict__["get_client"]))
+        cls.get_client = classmethod(get_client)
+    patch(Douban, "get_douban_timeline")
+    patch(SinaWeibo, "get_sina_timeline")
+    patch(TwitterOAuth1, "get_twitter_timeline")
+    patch(QQWeibo, None)
+    patch(Renren, "get_renren_timeline")
+    patch(Instagram, "get_instagram_timeline")
+
+    def restore():
+        for cls, get_client in saved:
+            cls.get_client = get_client
+    return restore
+
+def sync(users, seed_=1):
+    import jobs
+    restore = mock_providers(seed_)
+    n = 0
+    try:
+        for u in users:
+            for t in SyncTask.gets_by_user(u):
+                jobs.sync(t)
+                n += 1
+    finally:
+        restore()
+    return n
+
+def sync_http(users, url):
+    '''jobs.sync of new statuses, the real clients talk to the
+    bench.mock_provider at url'''
+    import jobs
+    from bench.mock_provider import point_clients_at
+    restore = point_clients_at(url)
+    n = 0
+    try:
+        for u in users:
+            for t in SyncTask.gets_by_user(u):
+                jobs.sync(t)
+                n += 1
+    finally:
+        restore()
+    return n
+
+def backfill(users, url, max_rounds=20):
+    '''the loop of cronjob/first_sync_timeline.py over the sync tasks of
+    users, against the bench.mock_provider at url. returns the statuses
+    fetched'''
+    import jobs
+    from bench.mock_provider import point_clients_at
+    restore = point_clients_at(url)
+    n = 0
+    try:
+        for u in users:
+            for t in SyncTask.gets_by_user(u):
+                min_id = Status.get_min_origin_id(t.category, t.user_id)
+                for i in xrange(max_rounds):
+                    r = jobs.sync(t, old=True)
+                    n += r
+                    new_min_id = Status.get_min_origin_id(t.category, t.user_id)
+                    if r == 0 or new_min_id == min_id:
+                        break
+                    min_id = new_min_id
+    finally:
+        restore()
+    return n
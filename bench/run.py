@@ -0,0 +1,157 @@
+#-*- coding:utf-8 -*-
+
+'''time the hot paths on a seeded dataset, results go out as json so runs
+can be compared.
+
+    python -m bench.run --users 10 --statuses 500 --rounds 3 -o before.json
+
+runs on the in-process fakes of bench/fakes.py by default. with --real the
+db and mc of past/config.py (local_config.py) are used, point them at a
+local mysql and memcached first, the dataset is seeded into that db.
+
+sync_http and backfill run jobs.sync with the real api clients against
+bench/mock_provider.py, started in process, on users fresh each round.
+'''
+
+import os
+import sys
+import time
+import json
+import platform
+import datetime
+from optparse import OptionParser
+
+def parse_args(argv):
+    parser = OptionParser(usage="python -m bench.run [options]")
+    parser.add_option("-u", "--users", type="int", default=10)
+    parser.add_option("-s", "--statuses", type="int", default=200,
+            help="statuses per user")
+    parser.add_option("-y", "--years", type="int", default=4,
+            help="statuses spread over the recent years")
+    parser.add_option("-r", "--rounds", type="int", default=3)
+    parser.add_option("--seed", type="int", default=1)
+    parser.add_option("--real", action="store_true", default=False,
+            help="use the mysql and memcached in config")
+    parser.add_option("--latency", type="float", default=0.0,
+            help="seconds the mock provider waits before answering")
+    parser.add_option("--error-rate", type="float", default=0.0,
+            help="ratio of 5xx from the mock provider")
+    parser.add_option("--only", default="",
+            help="comma separated names of the benches to run")
+    parser.add_option("-o", "--output", default="",
+            help="write the json to this file instead of stdout")
+    options, args = parser.parse_args(argv)
+    return options
+
+class Bench(object):
+
+    def __init__(self, rounds):
+        self.rounds = rounds
+        self.results = {}
+
+    def run(self, name, func, setup=None):
+        ## func returns the number of items it handled
+        times = []
+        items = 0
+        for i in xrange(self.rounds):
+            setup and setup()
+            t = time.time()
+            items = func() or 0
+            times.append(time.time() - t)
+        times.sort()
+        self.results[name] = {
+            "rounds": self.rounds,
+            "items": items,
+            "min_ms": round(times[0] * 1000, 3),
+            "median_ms": round(times[len(times) / 2] * 1000, 3),
+            "max_ms": round(times[-1] * 1000, 3),
+            "per_item_ms": round(times[0] * 1000 / items, 3) if items else None,
+        }
+        print >> sys.stderr, "%-32s %10.1fms %8s items" % (name, times[0] * 1000, items)
+
+def main(argv):
+    options = parse_args(argv)
+    if not options.real:
+        os.environ.setdefault("PAST_STORE_FACTORY", "bench.fakes:create_store")
+
+    from past.store import mc
+    from past.model.user import User
+    from past.model.status import Status
+    from past.corelib.cache import invalidate_ns
+    from bench.seed import seed, create_user, Generator
+    from bench.mock_provider import MockProviderServer
+    from bench import paths
+
+    now = datetime.datetime.now()
+    t = time.time()
+    user_ids = seed(options.users, options.statuses, options.years, now, options.seed)
+    seed_ms = int((time.time() - t) * 1000)
+    users = [User.get(x) for x in user_ids]
+
+    def cold_status():
+        ## ids lists stay cached, the status objs are fetched again
+        for u in users:
+            for x in Status.get_ids(u.id, limit=options.statuses):
+                mc.delete("status:%s" % x)
+                mc.delete("mc_raw_status:%s" % x)
+
+    def cold_date():
+        for u in users:
+            invalidate_ns("status_date:user:%s" % u.id)
+
+    only = filter(None, options.only.split(","))
+    provider = None
+    if not only or "sync_http" in only or "backfill" in only:
+        provider = MockProviderServer(timeline_size=options.statuses,
+                days=365 * options.years, latency=options.latency,
+                error_rate=options.error_rate, seed=options.seed).start()
+
+    gen = Generator(options.seed + 1)
+    fresh = []
+    def fresh_users():
+        fresh[:] = [create_user(gen, "http%s" % i) for i in xrange(options.users)]
+
+    bench = Bench(options.rounds)
+    for name, func, setup in [
+            ("status_gets_cold", lambda: paths.status_gets(users, options.statuses), cold_status),
+            ("status_gets_warm", lambda: paths.status_gets(users, options.statuses), None),
+            ("statuses_timelize", lambda: paths.timelize(users, options.statuses), None),
+            ("today_in_history_cold", lambda: paths.today_in_history(users, now), cold_date),
+            ("today_in_history_warm", lambda: paths.today_in_history(users, now), None),
+            ("pdf_render", lambda: paths.pdf_render(users, options.statuses), None),
+            ("reminder_render", lambda: paths.reminder_render(users, now), None),
+            ("sync", lambda: paths.sync(users, options.seed), None),
+            ("sync_http", lambda: paths.sync_http(fresh, provider.url), fresh_users),
+            ("backfill", lambda: paths.backfill(fresh, provider.url), fresh_users),
+            ]:
+        if only and name not in only:
+            continue
+        bench.run(name, func, setup)
+    provider and provider.stop()
+
+    r = {
+        "meta": {
+            "time": now.strftime("%Y-%m-%d %H:%M:%S"),
+            "store": "real" if options.real else os.environ.get("PAST_STORE_FACTORY"),
+            "users": options.users,
+            "statuses_per_user": options.statuses,
+            "years": options.years,
+            "seed": options.seed,
+            "seed_ms": seed_ms,
+            "provider_latency": options.latency,
+            "provider_error_rate": options.error_rate,
+            "python": platform.python_version(),
+            "host": platform.node(),
+        },
+        "results": bench.results,
+        "provider": provider and dict(provider.provider.stats) or {},
+    }
+    out = json.dumps(r, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, "w") as f:
+            f.write(out)
+    else:
+        print out
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
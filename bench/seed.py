@@ -0,0 +1,283 @@
+#-*- coding:utf-8 -*-
+
+'''synthetic dataset for the bench: users bound to every provider, each
+with statuses over all the categories, raw data shaped as the apis return
+it. the same seed gives the same dataset.'''
+
+import random
+import datetime
+import time
+
+from past import config
+from past.utils.escape import json_encode
+from past.model.user import User, UserAlias, OAuth2Token
+from past.model.status import Status, SyncTask
+from past.model.data import DoubanStatusData, DoubanMiniBlogData, \
+        DoubanNoteData, SinaWeiboStatusData, TwitterStatusData, \
+        QQWeiboStatusData, RenrenStatusData, RenrenBlogData, \
+        RenrenAlbumData, RenrenPhotoData, InstagramStatusData
+from past.store import db_conn
+
+WORDS = [u"今天", u"天气", u"不错", u"和朋友", u"去了", u"豆瓣", u"电影", u"看完",
+    u"一本书", u"咖啡", u"加班", u"周末", u"旅行", u"北京", u"上海", u"下雨",
+    u"the", u"past", u"of", u"me", u"hello", u"world", u"coding", u"python",
+    u"http://t.cn/zOxbTqH", u"#话题#", u"@朋友", u"[哈哈]", u"[score]4[/score]"]
+
+## sync_task 的 category
+SYNC_CATES = (config.CATE_DOUBAN_STATUS, config.CATE_SINA_STATUS,
+        config.CATE_TWITTER_STATUS, config.CATE_QQWEIBO_STATUS,
+        config.CATE_RENREN_STATUS, config.CATE_INSTAGRAM_STATUS)
+
+## 各个category的占比，大致和线上一致
+CATE_WEIGHTS = (
+    (config.CATE_DOUBAN_STATUS, 20),
+    (config.CATE_DOUBAN_MINIBLOG, 5),
+    (config.CATE_DOUBAN_NOTE, 2),
+    (config.CATE_SINA_STATUS, 30),
+    (config.CATE_TWITTER_STATUS, 10),
+    (config.CATE_QQWEIBO_STATUS, 8),
+    (config.CATE_THEPAST_NOTE, 2),
+    (config.CATE_RENREN_STATUS, 8),
+    (config.CATE_RENREN_FEED, 2),
+    (config.CATE_RENREN_BLOG, 3),
+    (config.CATE_RENREN_ALBUM, 2),
+    (config.CATE_RENREN_PHOTO, 4),
+    (config.CATE_INSTAGRAM_STATUS, 4),
+)
+
+class Generator(object):
+    '''raw data of each provider, see past/model/data.py for the fields'''
+
+    def __init__(self, seed=1, start_id=3000000000):
+        self.rnd = random.Random(seed)
+        self._id = start_id
+
+    def next_id(self):
+        self._id += self.rnd.randint(1, 1000)
+        return self._id
+
+    def text(self, min_words=3, max_words=40):
+        n = self.rnd.randint(min_words, max_words)
+        return u" ".join(self.rnd.choice(WORDS) for i in xrange(n))
+
+    def image(self, host, path):
+        return "http://%s/%s/p%s.jpg" % (host, path, self.rnd.randint(1, 10**8))
+
+    def choose_category(self):
+        total = sum(w for c, w in CATE_WEIGHTS)
+        r = self.rnd.uniform(0, total)
+        for c, w in CATE_WEIGHTS:
+            r -= w
+            if r <= 0:
+                return c
+        return CATE_WEIGHTS[-1][0]
+
+    def douban_user(self, uid):
+        return {"id": str(uid), "uid": "bench%s" % uid, "screen_name": u"用户%s" % uid,
+                "description": self.text(), "type": "user",
+                "small_avatar": "http://img3.douban.com/icon/u%s-1.jpg" % uid,
+                "large_avatar": "http://img3.douban.com/icon/ul%s-1.jpg" % uid}
+
+    def douban_status(self, uid, t, reshare=True):
+        d = {"id": self.next_id(), "created_at": t.strftime("%Y-%m-%d %H:%M:%S"),
+                "title": self.rnd.choice([u"说：", u"推荐", u"看过[score]4[/score]"]),
+                "text": self.text(), "target_type": "sns",
+                "user": self.douban_user(uid), "attachments": []}
+        if self.rnd.random() < 0.3:
+            d["attachments"].append({"type": "image", "title": "", "href": "", "description": "",
+                    "media": [{"type": "image", "src":
+                    self.image("img3.douban.com", "view/status/small/public")}]})
+        if reshare and self.rnd.random() < 0.2:
+            d["reshared_status"] = self.douban_status(uid + 1, t, reshare=False)
+        return d
+
+    def douban_entry(self, kind, t, image=False):
+        ## 旧版api的atom格式
+        d = {"id": {"$t": "http://api.douban.com/%s/%s" % (kind, self.next_id())},
+                "published": {"$t": t.strftime("%Y-%m-%dT%H:%M:%S+08:00")},
+                "title": {"$t": self.text(2, 8)}, "content": {"$t": self.text(10, 200)},
+                "link": []}
+        if image:
+            d["link"].append({"@rel": "image",
+                    "@href": self.image("img3.douban.com", "spic")})
+        return d
+
+    def sina_user(self, uid):
+        return {"id": uid, "idstr": str(uid), "domain": "bench%s" % uid,
+                "screen_name": u"微博用户%s" % uid, "description": self.text(),
+                "profile_image_url": "http://tp1.sinaimg.cn/%s/50/1.jpg" % uid,
+                "avatar_large": "http://tp1.sinaimg.cn/%s/180/1.jpg" % uid}
+
+    def sina_status(self, uid, t, retweet=True):
+        id_ = self.next_id()
+        d = {"id": id_, "idstr": str(id_), "mid": str(id_),
+                "created_at": t.strftime("%a %b %d %H:%M:%S +0800 %Y"),
+                "text": self.text(), "source": u"<a href=\"http://weibo.com/\">新浪微博</a>",
+                "user": self.sina_user(uid), "reposts_count": self.rnd.randint(0, 50),
+                "comments_count": self.rnd.randint(0, 50)}
+        if self.rnd.random() < 0.3:
+            name = "%x" % self.rnd.randint(1, 16**16)
+            d["thumbnail_pic"] = "http://ww2.sinaimg.cn/thumbnail/%s.jpg" % name
+            d["bmiddle_pic"] = "http://ww2.sinaimg.cn/bmiddle/%s.jpg" % name
+            d["original_pic"] = "http://ww2.sinaimg.cn/large/%s.jpg" % name
+        if retweet and self.rnd.random() < 0.3:
+            d["retweeted_status"] = self.sina_status(uid + 1, t, retweet=False)
+        return d
+
+    def twitter_status(self, uid, t):
+        ## twitter 是utc时间
+        t = t - datetime.timedelta(seconds=8*3600)
+        id_ = self.next_id()
+        return {"id": id_, "id_str": str(id_),
+                "created_at": t.strftime("%a %b %d %H:%M:%S +0000 %Y"),
+                "text": self.text(), "user": {"id": uid, "id_str": str(uid),
+                "name": "bench%s" % uid, "screen_name": "bench%s" % uid,
+                "profile_image_url": "http://a0.twimg.com/profile_images/%s/1.png" % uid}}
+
+    def qq_status(self, uid, t, retweet=True):
+        d = {"id": str(self.next_id()), "timestamp": int(time.mktime(t.timetuple())),
+                "text": self.text(), "name": "bench%s" % uid, "nick": u"腾讯用户%s" % uid,
+                "openid": "%032x" % uid, "head": "http://app.qlogo.cn/mbloghead/%s" % uid,
+                "fromurl": "http://t.qq.com/bench%s" % uid, "image": None, "source": None}
+        if self.rnd.random() < 0.3:
+            d["image"] = ["http://app.qpic.cn/mblogpic/%x" % self.rnd.randint(1, 16**16)]
+        if retweet and self.rnd.random() < 0.2:
+            d["source"] = self.qq_status(uid + 1, t, retweet=False)
+        return d
+
+    def renren_status(self, uid, t):
+        return {"status_id": self.next_id(), "uid": uid, "time": t.strftime("%Y-%m-%d %H:%M:%S"),
+                "message": self.text(), "forward_message": "", "root_message": "",
+                "root_status_id": "", "root_uid": "", "root_username": "", "place": None}
+
+    def renren_feed(self, uid, t):
+        return {"feed_id": self.next_id(), "actor_id": uid, "feed_type": 10,
+                "update_time": t.strftime("%Y-%m-%d %H:%M:%S"), "message": self.text()}
+
+    def renren_blog(self, uid, t):
+        return {"id": self.next_id(), "uid": uid, "time": t.strftime("%Y-%m-%d %H:%M:%S"),
+                "title": self.text(2, 8), "content": self.text(50, 400)}
+
+    def renren_album(self, uid, t):
+        return {"aid": self.next_id(), "uid": uid, "create_time": t.strftime("%Y-%m-%d %H:%M:%S"),
+                "name": self.text(1, 4), "description": self.text(0, 10),
+                "url": self.image("fmn.rrimg.com", "fmn057/20120101"),
+                "size": self.rnd.randint(1, 200)}
+
+    def renren_photo(self, uid, t):
+        p = "fmn.rrimg.com/fmn060/20120101/%s" % self.rnd.randint(1, 10**8)
+        return {"pid": self.next_id(), "uid": uid, "time": t.strftime("%Y-%m-%d %H:%M:%S"),
+                "caption": self.text(0, 10), "url_large": "http://%s/large.jpg" % p,
+                "url_tiny": "http://%s/tiny.jpg" % p, "url_head": "http://%s/head.jpg" % p}
+
+    def instagram_status(self, uid, t):
+        p = "distilleryimage%s.instagram.com/%x" % (self.rnd.randint(0, 11),
+                self.rnd.randint(1, 16**16))
+        return {"id": "%s_%s" % (self.next_id(), uid),
+                "created_time": str(int(time.mktime(t.timetuple()))),
+                "caption": {"text": self.text(0, 10)}, "link": "http://instagr.am/p/%x/" % uid,
+                "user": {"id": str(uid), "username": "bench%s" % uid,
+                "full_name": "bench %s" % uid, "profile_picture": "http://images.instagram.com/%s.jpg" % uid},
+                "images": {"standard_resolution": {"url": "http://%s_7.jpg" % p},
+                "low_resolution": {"url": "http://%s_6.jpg" % p},
+                "thumbnail": {"url": "http://%s_5.jpg" % p}}, "location": None}
+
+    def data(self, cate, uid, t):
+        ## returns the data obj of the category, None for renren feed
+        if cate == config.CATE_DOUBAN_STATUS:
+            return DoubanStatusData(self.douban_status(uid, t))
+        elif cate == config.CATE_DOUBAN_MINIBLOG:
+            return DoubanMiniBlogData(self.douban_entry("miniblog", t,
+                    image=self.rnd.random() < 0.3))
+        elif cate == config.CATE_DOUBAN_NOTE:
+            return DoubanNoteData(self.douban_entry("note", t))
+        elif cate == config.CATE_SINA_STATUS:
+            return SinaWeiboStatusData(self.sina_status(uid, t))
+        elif cate == config.CATE_TWITTER_STATUS:
+            return TwitterStatusData(self.twitter_status(uid, t))
+        elif cate == config.CATE_QQWEIBO_STATUS:
+            return QQWeiboStatusData(self.qq_status(uid, t))
+        elif cate == config.CATE_RENREN_STATUS:
+            return RenrenStatusData(self.renren_status(uid, t))
+        elif cate == config.CATE_RENREN_BLOG:
+            return RenrenBlogData(self.renren_blog(uid, t))
+        elif cate == config.CATE_RENREN_ALBUM:
+            return RenrenAlbumData(self.renren_album(uid, t))
+        elif cate == config.CATE_RENREN_PHOTO:
+            return RenrenPhotoData(self.renren_photo(uid, t))
+        elif cate == config.CATE_INSTAGRAM_STATUS:
+            return InstagramStatusData(self.instagram_status(uid, t))
+        return None
+
+    def create_time(self, now, years):
+        ## 1/10落在历史上的今天和昨天，让提醒邮件有内容
+        r = self.rnd.random()
+        if r < 0.05:
+            y = now.year - self.rnd.randint(1, years)
+            try:
+                t = now.replace(year=y)
+            except ValueError:
+                ## 2月29日
+                t = now.replace(year=y, day=28)
+        elif r < 0.1:
+            t = now - datetime.timedelta(days=1)
+        else:
+            t = now - datetime.timedelta(days=self.rnd.uniform(1, 365 * years))
+        return t.replace(hour=self.rnd.randint(0, 23), minute=self.rnd.randint(0, 59),
+                second=self.rnd.randint(0, 59), microsecond=0)
+
+def create_user(gen, i):
+    alias = "bench%s_%s" % (i, gen.rnd.randint(1, 10**6))
+    ua = UserAlias.create_new_user(config.OPENID_TYPE_DICT[config.OPENID_DOUBAN],
+            alias, u"测试用户%s" % i)
+    user = User.get(ua.user_id)
+    user.set_email("%s@bench.thepast.me" % alias)
+
+    for provider, type_ in config.OPENID_TYPE_DICT.iteritems():
+        if provider in (config.OPENID_THEPAST, config.OPENID_WORDPRESS):
+            continue
+        if provider == config.OPENID_DOUBAN:
+            alias_id = ua.id
+        else:
+            alias_id = UserAlias.bind_to_exists_user(user, type_, alias).id
+        OAuth2Token.add(alias_id, "%032x" % gen.rnd.getrandbits(128),
+                "%032x" % gen.rnd.getrandbits(128))
+        user.set_thirdparty_profile_item(type_, "intro", gen.text(3, 10))
+
+    for cate in SYNC_CATES:
+        SyncTask.add(cate, user.id)
+    return user
+
+def add_status(gen, user, cate, t):
+    uid = int(user.id)
+    if cate == config.CATE_THEPAST_NOTE:
+        cursor = db_conn.execute('''insert into note (user_id, title, content, create_time)
+                values (%s, %s, %s, %s)''', (user.id, gen.text(2, 8), gen.text(50, 500), t))
+        db_conn.commit()
+        note_id = cursor.lastrowid
+        cursor and cursor.close()
+        return Status.add(user.id, note_id, t,
+                config.OPENID_TYPE_DICT[config.OPENID_THEPAST], cate, "")
+    elif cate == config.CATE_RENREN_FEED:
+        raw = gen.renren_feed(uid, t)
+        return Status.add(user.id, raw["feed_id"], t,
+                config.OPENID_TYPE_DICT[config.OPENID_RENREN], cate, "",
+                raw["message"], json_encode(raw))
+    else:
+        d = gen.data(cate, uid, t)
+        ## 和 jobs.sync 一样存
+        return Status.add(user.id, d.get_origin_id(), d.get_create_time(), d.site,
+                d.category, d.get_title(), d.get_content(), json_encode(d.get_data()))
+
+def seed(n_users=10, n_statuses=200, years=4, now=None, seed_=1):
+    '''returns the ids of the users created'''
+    now = now or datetime.datetime.now()
+    gen = Generator(seed_)
+    user_ids = []
+    for i in xrange(n_users):
+        user = create_user(gen, i)
+        for j in xrange(n_statuses):
+            cate = gen.choose_category()
+            add_status(gen, user, cate, gen.create_time(now, years))
+        user_ids.append(user.id)
+    return user_ids
@@ -0,0 +1,17 @@
+#-*- coding:utf-8 -*-
+
+import sys
+sys.path.append("../")
+
+activate_this = '../env/bin/activate_this.py'
+execfile(activate_this, dict(__file__=activate_this))
+
+import datetime
+from past.corelib.cache import stats
+from past.corelib.cache_stats import format_stats
+
+if __name__ == "__main__":
+    print '----- cache stats at %s' % datetime.datetime.now()
+    print format_stats(stats.get_all())
+    if len(sys.argv) > 1 and sys.argv[1] == "reset":
+        stats.reset()
@@ -4,84 +4,267 @@ import sys
 sys.path.append("../")
 
 import time
+import signal
+import resource
 import datetime
 import calendar
-import commands
+import multiprocessing
+from optparse import OptionParser
 
 activate_this = '../env/bin/activate_this.py'
 execfile(activate_this, dict(__file__=activate_this))
 
-from past.utils.pdf import generate_pdf, get_pdf_filename, is_pdf_file_exists, get_pdf_full_filename
+from past.utils.pdf import generate_pdf, get_pdf_filename, is_pdf_file_exists, get_pdf_full_filename, \
+        get_pdf_volume_filename, compress_pdf, remove_pdf_volumes, get_pdf_digest, get_indexed_pdf_digest, \
+        update_pdf_index, remove_pdf_index
 from past.model.user import User, UserAlias, PdfSettings
 from past.model.status import Status
+from past.store import db_conn, mc
+from past.utils import image
 from past import config
 
 
-def generate(user_id, date, order='asc'):
+def get_month_range(date):
+    start_date = datetime.datetime(date.year, date.month, 1)
+    end_date = datetime.datetime(date.year, date.month,
+            calendar.monthrange(date.year, date.month)[1], 23, 59, 59)
+    return start_date, end_date
+
+def is_month_changed(user_id, date, digest=None):
+    '''whether the pdf of the month is missing or out of date'''
+    month = date.strftime("%Y%m")
+    if digest is None:
+        digest = get_pdf_digest(user_id, *get_month_range(date))
+    old = get_indexed_pdf_digest(user_id, month)
+    if not is_pdf_file_exists(get_pdf_volume_filename(user_id, month)):
+        return digest is not None or old is not None
+
+    if old is None and digest is not None:
+        ## 有索引之前生成的pdf, 当作是最新的, 记下现在的文件和digest
+        update_pdf_index(user_id, month, digest)
+        return False
+    return old != digest
+
+def generate(user_id, date, order='asc', force=False, digest=None):
+    '''digest: given when the caller has checked the month is changed'''
     try:
         uas = UserAlias.gets_by_user_id(user_id)
         if not uas:
-            return
+            return "no_alias"
 
-        start_date = datetime.datetime(date.year, date.month, 1)
-        end_date = datetime.datetime(date.year, date.month,
-                calendar.monthrange(date.year, date.month)[1], 23, 59, 59)
+        start_date, end_date = get_month_range(date)
+        month = date.strftime("%Y%m")
 
-        pdf_filename = get_pdf_filename(user_id, date.strftime("%Y%m"), "")
-        pdf_filename_compressed = get_pdf_filename(user_id, date.strftime("%Y%m"))
-        print '----generate pdf:', start_date, ' to ', end_date, ' file is', pdf_filename
+        pdf_filename_compressed = get_pdf_volume_filename(user_id, month)
+        print '----generate pdf:', start_date, ' to ', end_date, ' file is', pdf_filename_compressed
 
-        if is_pdf_file_exists(pdf_filename_compressed):
-            print '---- %s exists, so ignore...' % pdf_filename_compressed
-            return
+        ## 先算digest再取status, 中间有变化的话下次还会重新生成
+        if digest is None:
+            digest = get_pdf_digest(user_id, start_date, end_date)
+            if not force and not is_month_changed(user_id, date, digest):
+                print '---- %s exists and not changed, so ignore...' % pdf_filename_compressed
+                return "exists"
 
-        status_ids = Status.get_ids_by_date(user_id, start_date, end_date)[:900]
+        status_ids = Status.get_ids_by_date(user_id, start_date, end_date)
         if order == 'asc':
             status_ids = status_ids[::-1]
         if not status_ids:
             print '----- status ids is none', status_ids
-            return
-        generate_pdf(pdf_filename, user_id, status_ids)
-
-        if not is_pdf_file_exists(pdf_filename):
-            print '----%s generate pdf for user:%s fail' % (datetime.datetime.now(), user_id)
-        else:
-            commands.getoutput("cd %s && tar -zcf %s %s && rm %s" %(config.PDF_FILE_DOWNLOAD_DIR, 
-                    pdf_filename_compressed, pdf_filename, pdf_filename))
-            print '----%s generate pdf for user:%s succ' % (datetime.datetime.now(), user_id)
+            remove_pdf_volumes(user_id, month)
+            remove_pdf_index(user_id, month)
+            return "empty"
+
+        ## 不再只取前900条, 按PDF_STATUSES_PER_VOLUME分卷, 每卷的内存是有上限的
+        ## 倒着生成, 第一卷最后才有, 它存在就说明这个月的都生成完了
+        n = config.PDF_STATUSES_PER_VOLUME
+        volumes = [status_ids[i:i+n] for i in xrange(0, len(status_ids), n)]
+        for i, ids in reversed(list(enumerate(volumes))):
+            volume = i + 1
+            pdf_filename = get_pdf_volume_filename(user_id, month, volume, "")
+            print '----generate volume %s/%s of %s statuses: %s' % (volume, len(volumes), len(ids), pdf_filename)
+            generate_pdf(pdf_filename, user_id, ids)
+
+            if not is_pdf_file_exists(pdf_filename):
+                print '----%s generate pdf for user:%s fail' % (datetime.datetime.now(), user_id)
+                return "fail"
+            compress_pdf(pdf_filename)
+
+        ## 以前多出来的卷
+        remove_pdf_volumes(user_id, month, len(volumes) + 1)
+        update_pdf_index(user_id, month, digest)
+        print '----%s generate pdf for user:%s succ' % (datetime.datetime.now(), user_id)
+        return "succ"
     except Exception, e:
         import traceback
         print '%s %s' % (datetime.datetime.now(), traceback.format_exc())
+        return "error"
 
 def generate_pdf_by_user(user_id):
+    for d in get_months_of_user(user_id):
+        generate(user_id, d)
+
+def get_months_of_user(user_id):
     user = User.get(user_id)
     if not user:
-        return
+        return []
 
     #XXX:暂时只生成2012年的(uid从98开始的用户)
     #XXX:暂时只生成2012年3月份的(uid从166开始的用户)
     start_date = Status.get_oldest_create_time(None, user_id)
     if not start_date:
-        return
+        return []
     now = datetime.datetime.now()
     now = datetime.datetime(now.year, now.month, now.day) - datetime.timedelta(days = calendar.monthrange(now.year, now.month)[1])
 
+    months = []
     d = start_date
     while d <= now:
-        generate(user_id, d)
+        months.append(d)
 
         days = calendar.monthrange(d.year, d.month)[1]
         d += datetime.timedelta(days=days)
         d = datetime.datetime(d.year, d.month, 1)
+    return months
+
+
+## xhtml2pdf只用得上一个核，按(user, month)分给多个进程，
+## 每个job限时限内存，一个job挂了(甚至进程挂了)不影响其他的
+class JobTimeout(BaseException):
+    ## 不是Exception, generate里的except拦不住
+    pass
+
+def _on_alarm(signum, frame):
+    raise JobTimeout()
 
+## 子进程里fork来的mysql连接不能关，关了会把父进程的也断掉
+_inherited_conns = []
+
+def _init_worker(timeout, memory, force):
+    _inherited_conns.append(db_conn._conn)
+    db_conn.connect()
+    mc.disconnect_all()
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGALRM, _on_alarm)
+    if memory:
+        limit = memory * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    global _job_timeout, _force
+    _job_timeout = timeout
+    _force = force
+
+_job_timeout = 0
+_force = False
+
+def _run_job(job):
+    user_id, date, digest = job
+    t = time.time()
+    signal.alarm(_job_timeout)
+    try:
+        r = generate(user_id, date, force=_force, digest=digest)
+    except JobTimeout:
+        print '----%s generate pdf for user:%s timeout' % (datetime.datetime.now(), user_id)
+        r = "timeout"
+    except MemoryError:
+        r = "memory"
+    finally:
+        signal.alarm(0)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return user_id, date, r, time.time() - t, rss
+
+def generate_all(jobs, workers=0, timeout=None, memory=None, jobs_per_worker=None, force=False):
+    '''jobs: [(user_id, date, digest)], digest None if not known yet,
+    returns {result: count}'''
+    workers = workers or config.PDF_WORKERS or multiprocessing.cpu_count()
+    timeout = timeout if timeout is not None else config.PDF_JOB_TIMEOUT
+    memory = memory if memory is not None else config.PDF_JOB_MEMORY
+    jobs_per_worker = jobs_per_worker or config.PDF_JOBS_PER_WORKER
+
+    print '----- %s generate %s pdf with %s workers' % (datetime.datetime.now(), len(jobs), workers)
+    begin = time.time()
+    pool = multiprocessing.Pool(workers, _init_worker, (timeout, memory, force),
+            maxtasksperchild=jobs_per_worker)
+    pending = [(job, pool.apply_async(_run_job, (job,))) for job in jobs]
+    pool.close()
+
+    counts = {}
+    done = 0
+    last_done_time = time.time()
+    while pending:
+        time.sleep(0.5)
+        rest = []
+        for job, r in pending:
+            if not r.ready():
+                rest.append((job, r))
+                continue
+            done += 1
+            last_done_time = time.time()
+            try:
+                user_id, date, result, cost, rss = r.get()
+            except Exception, e:
+                user_id, date, digest = job
+                result, cost, rss = "error", 0, 0
+                print '----- job of user:%s fail: %s' % (user_id, e)
+            counts[result] = counts.get(result, 0) + 1
+            print '----- [%s/%s] user:%s %s %s %.1fs maxrss %sMB' % (done, len(jobs),
+                    user_id, date.strftime("%Y%m"), result, cost, rss)
+        pending = rest
+
+        ## job都有alarm, 这么久没有一个完成，剩下的是worker进程挂掉时丢了的
+        if pending and timeout and time.time() - last_done_time > timeout + 60:
+            for (user_id, date, digest), r in pending:
+                print '----- user:%s %s lost, the worker died' % (user_id, date.strftime("%Y%m"))
+            counts["lost"] = counts.get("lost", 0) + len(pending)
+            pool.terminate()
+            break
+    else:
+        pool.join()
+
+    print '----- %s generate pdf done in %.1fs: %s' % (datetime.datetime.now(),
+            time.time() - begin, counts)
+    print '----- image cache: %s' % image.get_cache().get_stats()
+    return counts
 
 if __name__ == "__main__":
-    for uid in PdfSettings.get_all_user_ids():
-        #print '------begin generate pdf of user:', uid
-        #generate_pdf_by_user(uid)
+    parser = OptionParser(usage="python generate_pdf.py [options]")
+    parser.add_option("-w", "--workers", type="int", default=0,
+            help="processes, default config.PDF_WORKERS or the cpu count")
+    parser.add_option("-t", "--timeout", type="int", default=None,
+            help="seconds a job may take, default config.PDF_JOB_TIMEOUT")
+    parser.add_option("-m", "--memory", type="int", default=None,
+            help="MB of memory a job may take, default config.PDF_JOB_MEMORY")
+    parser.add_option("-a", "--all-months", action="store_true", default=False,
+            help="every month of the users instead of only the last month")
+    parser.add_option("-f", "--force", action="store_true", default=False,
+            help="regenerate even if the statuses of the month are not changed")
+    parser.add_option("-o", "--original-images", action="store_true", default=False,
+            help="embed the original images, not the normalized ones")
+    options, args = parser.parse_args()
+
+    if options.original_images:
+        ## fork出来的worker也会看到
+        config.PDF_IMAGE_NORMALIZE = False
 
+    if options.all_months:
+        print '----- generate pdf of all months'
+        jobs = [(uid, d) for uid in PdfSettings.get_all_user_ids()
+                for d in get_months_of_user(uid)]
+    else:
         now = datetime.datetime.now()
         last_mongth = datetime.datetime(now.year, now.month, now.day) \
                 - datetime.timedelta(days = calendar.monthrange(now.year, now.month)[1])
-        print '----- generate last month pdf of user:', last_mongth, uid
-        generate(uid, last_mongth)
+        print '----- generate last month pdf:', last_mongth
+        jobs = [(uid, last_mongth) for uid in PdfSettings.get_all_user_ids()]
+    if options.force:
+        jobs = [(uid, d, None) for uid, d in jobs]
+    else:
+        ## 每个月只查一次digest, 没变化的月份不用交给worker, 变了的把digest带过去
+        total = len(jobs)
+        changed = []
+        for uid, d in jobs:
+            digest = get_pdf_digest(uid, *get_month_range(d))
+            if is_month_changed(uid, d, digest):
+                changed.append((uid, d, digest))
+        jobs = changed
+        print '----- %s of %s months changed' % (len(jobs), total)
+    generate_all(jobs, options.workers, options.timeout, options.memory, force=options.force)
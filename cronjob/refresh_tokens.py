@@ -0,0 +1,159 @@
+#-*- coding:utf-8 -*-
+## access token快过期的时候就刷新, 不再等同步时api调用失败了才去刷
+
+import sys
+sys.path.append("../")
+
+import time
+import datetime
+import threading
+import Queue
+from optparse import OptionParser
+
+activate_this = '../env/bin/activate_this.py'
+execfile(activate_this, dict(__file__=activate_this))
+
+from past import config
+from past.model.user import OAuth2Token
+from past.model.token_health import TokenHealth
+from past.api.douban import Douban
+from past.api.sina import SinaWeibo
+from past.api.renren import Renren
+from past.api.error import OAuthTokenExpiredError
+
+CLIENTS = {
+    config.OPENID_DOUBAN: Douban,
+    config.OPENID_SINA: SinaWeibo,
+    config.OPENID_RENREN: Renren,
+}
+
+class RateLimiter(object):
+    '''at most rate calls per second, shared by the threads'''
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_time = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.time()
+            t = max(now, self.next_time)
+            self.next_time = t + self.interval
+        if t > now:
+            time.sleep(t - now)
+
+def refresh_all(clients, threads=None, per_provider=None, rate=None):
+    '''clients: [(token_row, client)], only the http requests are done in the
+    threads, db_conn is not thread safe. returns [(token_row, client, new_tokens, error)]'''
+    threads = threads or config.TOKEN_REFRESH_THREADS
+    per_provider = per_provider or config.TOKEN_REFRESH_PER_PROVIDER
+    rate = rate if rate is not None else config.TOKEN_REFRESH_RATE
+
+    q = Queue.Queue()
+    for x in clients:
+        q.put(x)
+    providers = {}
+    lock = threading.Lock()
+    results = []
+
+    def provider_limits(type_):
+        with lock:
+            if type_ not in providers:
+                providers[type_] = (threading.Semaphore(per_provider), RateLimiter(rate))
+            return providers[type_]
+
+    def worker():
+        while True:
+            try:
+                row, client = q.get_nowait()
+            except Queue.Empty:
+                return
+            semaphore, limiter = provider_limits(row[1])
+            new_tokens, error = None, None
+            with semaphore:
+                limiter.wait()
+                try:
+                    new_tokens = client.refresh_tokens()
+                except Exception, e:
+                    error = e
+            with lock:
+                results.append((row, client, new_tokens, error))
+
+    workers = [threading.Thread(target=worker) for i in xrange(min(threads, len(clients)))]
+    for x in workers:
+        x.setDaemon(True)
+        x.start()
+    for x in workers:
+        x.join()
+    return results
+
+def save_result(row, client, new_tokens, error, now):
+    alias_id, type_, user_id, expire_time = row
+    if not error and new_tokens and isinstance(new_tokens, dict) \
+            and new_tokens.get("access_token"):
+        ## 有的第三方刷新时不返回新的refresh_token, 接着用原来的
+        OAuth2Token.add(alias_id, new_tokens.get("access_token"),
+                new_tokens.get("refresh_token") or client.refresh_token,
+                new_tokens.get("expires_in"))
+        TokenHealth.set_status(user_id, type_, TokenHealth.OK)
+        return "succ"
+
+    print '---- refresh token of user:%s %s fail: %s' % (user_id, type_, error or new_tokens)
+    ## 已经过期又刷不了, 只能等用户重新授权了
+    if expire_time and expire_time < now:
+        OAuthTokenExpiredError(user_id, type_, error or new_tokens).set_the_profile()
+        return "expired"
+    return "fail"
+
+def refresh_expiring_tokens(ahead=None, unknown_age=None, batch_size=None,
+        threads=None, per_provider=None, rate=None):
+    ahead = ahead or config.TOKEN_REFRESH_AHEAD
+    unknown_age = unknown_age or config.TOKEN_REFRESH_UNKNOWN_AGE
+    batch_size = batch_size or config.TOKEN_REFRESH_BATCH
+
+    now = datetime.datetime.now()
+    expire_before = now + datetime.timedelta(seconds=ahead)
+    unknown_before = now - datetime.timedelta(seconds=unknown_age)
+    types = [config.OPENID_TYPE_DICT[x] for x in config.TOKEN_REFRESH_PROVIDERS
+            if x in CLIENTS]
+
+    print '----- %s refresh tokens expiring before %s' % (now, expire_before)
+    begin = time.time()
+    counts = {}
+    after_alias_id = 0
+    while True:
+        rows = OAuth2Token.get_expiring(types, expire_before, unknown_before,
+                after_alias_id, batch_size)
+        if not rows:
+            break
+        after_alias_id = rows[-1][0]
+
+        clients = []
+        for row in rows:
+            client = CLIENTS[config.OPENID_TYPE_DICT_REVERSE[row[1]]].get_client(row[2])
+            if client and client.refresh_token:
+                clients.append((row, client))
+            else:
+                counts["no_client"] = counts.get("no_client", 0) + 1
+
+        for row, client, new_tokens, error in refresh_all(clients, threads, per_provider, rate):
+            r = save_result(row, client, new_tokens, error, now)
+            counts[r] = counts.get(r, 0) + 1
+        print '----- %s refreshed %s tokens: %s' % (datetime.datetime.now(), len(rows), counts)
+        sys.stdout.flush()
+
+    print '----- %s refresh tokens done in %.1fs: %s' % (datetime.datetime.now(),
+            time.time() - begin, counts)
+    return counts
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="python refresh_tokens.py [options]")
+    parser.add_option("-a", "--ahead", type="int", default=None,
+            help="seconds before expiring to refresh, default config.TOKEN_REFRESH_AHEAD")
+    parser.add_option("-t", "--threads", type="int", default=None,
+            help="default config.TOKEN_REFRESH_THREADS")
+    parser.add_option("-r", "--rate", type="float", default=None,
+            help="requests per second to each provider, default config.TOKEN_REFRESH_RATE")
+    options, args = parser.parse_args()
+
+    refresh_expiring_tokens(ahead=options.ahead, threads=options.threads, rate=options.rate)
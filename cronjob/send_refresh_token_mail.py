@@ -6,24 +6,22 @@ sys.path.append("../")
 activate_this = '../env/bin/activate_this.py'
 execfile(activate_this, dict(__file__=activate_this))
 
-import time
-from past.store import db_conn
-from send_reminding import send_reconnect
+from collections import defaultdict
 
-if __name__ == "__main__":
-    cursor = db_conn.execute("select max(id) from user")
-    row = cursor.fetchone()
-    cursor and cursor.close()
-    max_uid = row and row[0]
-    max_uid = int(max_uid)
-    t = 0
-    for uid in xrange(4,max_uid + 1):
-    #for uid in xrange(4, 5):
-        if t >= 100:
-            t = 0
-            time.sleep(5)
-        send_reconnect(uid)
-        time.sleep(1)
-        t += 1
-        sys.stdout.flush()
+from past.model.user import User
+from past.utils.sendmail import MailSender
+from past.model.token_health import TokenHealth
+from past.api.error import OAuthTokenExpiredError
+from send_reminding import send_reconnect_mail
 
+if __name__ == "__main__":
+    ## 只给有授权过期、有email、没关掉邮件的用户发
+    ## 过期的第三方一次查出来, email和设置也是一批一个查询, 发的时候不再一个个查
+    expired = defaultdict(dict)
+    for h in TokenHealth.gets_by_status(OAuthTokenExpiredError.TYPE):
+        expired[h.user_id][h.provider] = h.since
+    with MailSender() as mailer:
+        for uid, email, name in User.iter_mail_recipients(expired.keys(), after_id=3):
+            send_reconnect_mail(uid, email, name, expired[uid], mailer=mailer)
+            sys.stdout.flush()
+    print '---- mail stats:', mailer.get_stats()
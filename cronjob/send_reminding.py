@@ -8,19 +8,32 @@ execfile(activate_this, dict(__file__=activate_this))
 
 import datetime
 import time
+import signal
 import traceback
+import threading
+import multiprocessing
+import Queue
 
-from past.utils import wrap_long_line, filters 
-from past.utils.escape import clear_html_element
-from past.utils.sendmail import send_mail
+from past.utils.sendmail import send_mail, MailSender
+from past.utils.template import get_template_module
 from past.model.status import get_status_ids_today_in_history, \
-        get_status_ids_yesterday, Status
+        get_status_ids_yesterday, get_user_ids_with_status_today_in_history, Status
 from past.model.user import User
-from past.store import db_conn
+from past.store import db_conn, mc
 from past import config
+from past.model.token_health import TokenHealth
 from past.api.error import OAuthTokenExpiredError
 
-def send_today_in_history(user_id, now=None, include_yestorday=False):
+def _send(mailer, email, subject, text, html):
+    ## 批量发的时候传进来一个MailSender, 共用smtp连接
+    if mailer:
+        r = mailer.send(["%s" % email], "thepast<help@thepast.me>", subject, text, html)
+        if r.get(email) != MailSender.SENT:
+            print '--- send to %s fail: %s' % (email, r.get(email))
+    else:
+        send_mail(["%s" % email], "thepast<help@thepast.me>", subject, text, html)
+
+def send_today_in_history(user_id, now=None, include_yestorday=False, mailer=None):
     if not now:
         now = datetime.datetime.now()
 
@@ -38,8 +51,19 @@ def send_today_in_history(user_id, now=None, include_yestorday=False):
         print '---- user %s no email' % u.id
         return
     
+    html = render_today_in_history(u, now, include_yestorday)
+    if not html:
+        return
+
+    subject = '''thepast.me|整理自己的故事 %s''' % now.strftime("%Y-%m-%d")
+    text = ''
+    
+    print '--- send reminding to %s %s' %(user_id, email)
+    _send(mailer, email, subject, text, html)
+
+def render_today_in_history(u, now, include_yestorday=False):
+    '''the html of the mail utf8 encoded, None if the user has nothing in history'''
     history_ids = get_status_ids_today_in_history(u.id, now)
-    status_of_today_in_history = Status.gets(history_ids)
     
     if include_yestorday:
         yesterday_ids = get_status_ids_yesterday(u.id, now) 
@@ -47,9 +71,6 @@ def send_today_in_history(user_id, now=None, include_yestorday=False):
     else:
         status_of_yesterday = None
 
-    intros = [u.get_thirdparty_profile(x).get("intro") for x in config.OPENID_TYPE_DICT.values()]
-    intros = filter(None, intros)
-    
     d = {}
     for s in Status.gets(history_ids):
         t = s.create_time.strftime("%Y-%m-%d")
@@ -58,37 +79,20 @@ def send_today_in_history(user_id, now=None, include_yestorday=False):
         else:
             d[t] = [s]
     status_of_today_in_history = d
-    from past.consts import YESTERDAY
 
     if not (status_of_today_in_history or (include_yestorday and status_of_yesterday)):
         print '--- user %s has no status in history' % u.id
         return
 
-    from jinja2 import Environment, PackageLoader
-    env = Environment(loader=PackageLoader('past', 'templates'))
-    env.filters['wrap_long_line'] = wrap_long_line
-    env.filters['nl2br'] = filters.nl2br
-    env.filters['stream_time'] = filters.stream_time
-    env.filters['clear_html_element'] = clear_html_element
-    env.filters['isstr'] = lambda x: isinstance(x, basestring)
-    t = env.get_template('mail.html')
-    m = t.module
-
+    intros = [u.get_thirdparty_profile(x).get("intro") for x in config.OPENID_TYPE_DICT.values()]
+    intros = filter(None, intros)
 
-    if now:
-        y = (now - datetime.timedelta(days=1)).strftime("%Y-%m-%d")
-    else:
-        y = YESTERDAY
+    m = get_template_module('mail.html')
+    y = (now - datetime.timedelta(days=1)).strftime("%Y-%m-%d")
     html = m.status_in_past(status_of_yesterday, status_of_today_in_history, y, config, intros)
-    html = html.encode("utf8")
-
-    subject = '''thepast.me|整理自己的故事 %s''' % now.strftime("%Y-%m-%d")
-    text = ''
-    
-    print '--- send reminding to %s %s' %(user_id, email)
-    send_mail(["%s" % email], "thepast<help@thepast.me>", subject, text, html)
+    return html.encode("utf8")
 
-def send_yesterday(user_id, now=None):
+def send_yesterday(user_id, now=None, mailer=None):
     if not now:
         now = datetime.datetime.now()
 
@@ -118,14 +122,7 @@ def send_yesterday(user_id, now=None):
         print '--- user %s has no status in yesterday' % u.id
         return
 
-    from jinja2 import Environment, PackageLoader
-    env = Environment(loader=PackageLoader('past', 'templates'))
-    env.filters['wrap_long_line'] = wrap_long_line
-    env.filters['nl2br'] = filters.nl2br
-    env.filters['stream_time'] = filters.stream_time
-    env.filters['clear_html_element'] = clear_html_element
-    t = env.get_template('mail.html')
-    m = t.module
+    m = get_template_module('mail.html')
 
 
     if now:
@@ -139,9 +136,9 @@ def send_yesterday(user_id, now=None):
     text = ''
     
     print '--- send reminding to %s %s' %(user_id, email)
-    send_mail(["%s" % email], "thepast<help@thepast.me>", subject, text, html)
+    _send(mailer, email, subject, text, html)
 
-def send_pdf(user_id):
+def send_pdf(user_id, mailer=None):
     u = User.get(user_id)
 
     if not u:
@@ -166,9 +163,9 @@ http://thepast.me | 个人杂志计划
 thanks''' % user_id
     
     print '--- send pdf file to %s %s' %(user_id, email)
-    send_mail(["%s" % email], "thepast<help@thepast.me>", subject, text, "")
+    _send(mailer, email, subject, text, "")
 
-def send_reconnect(user_id):
+def send_reconnect(user_id, mailer=None):
     u = User.get(user_id)
 
     if not u:
@@ -179,24 +176,24 @@ def send_reconnect(user_id):
         print '---user %s does not like to receive remind mail' % u.id
         return
 
-    excps = [OAuthTokenExpiredError(user_id, x) for x in config.OPENID_TYPE_DICT.values()]
-    expires_site = {}
-    for e in excps:
-        t = e.is_exception_exists()
-        if t:
-            expires_site[e.openid_type] = t
-
-    if not expires_site:
-        print '--- user %s has no expired connection' % u.id
-        return
-    else:
-        print '--- user %s expired connection: %s' %(u.id, expires_site)
+    expires_site = dict((h.provider, h.since) for h in TokenHealth.gets_by_user(u.id)
+            if h.status == OAuthTokenExpiredError.TYPE)
 
     email = u.get_email()
     if not email:
         print '---- user %s no email' % u.id
         return
 
+    send_reconnect_mail(u.id, email, u.name, expires_site, mailer)
+
+def send_reconnect_mail(user_id, email, name, expires_site, mailer=None):
+    '''expires_site: {provider: since}, everything is looked up by the caller'''
+    if not expires_site:
+        print '--- user %s has no expired connection' % user_id
+        return
+    else:
+        print '--- user %s expired connection: %s' %(user_id, expires_site)
+
     names = []
     reconnect_urls = []
     for x in expires_site.keys():
@@ -219,27 +216,125 @@ def send_reconnect(user_id):
 如果你不愿意接收此类邮件，那么请到 http://thepast.me/settings 设置：）
 ---
 http://thepast.me 
-thanks''' % (u.name.encode("utf8"), ", ".join(names).encode("utf8"), "\n".join(reconnect_urls))
+thanks''' % ((name or "").encode("utf8"), ", ".join(names).encode("utf8"), "\n".join(reconnect_urls))
 
     print '--- send reconnections to %s %s' %(user_id, email)
-    send_mail(["%s" % email], "thepast<help@thepast.me>", subject, text, "")
-
+    _send(mailer, email, subject, text, "")
+
+
+## 每天早上的提醒邮件, 分成几段流水线, 段之间是有界的队列:
+## 1. 主进程查出有历史上的今天、有email、没关掉提醒的用户, 一批一个查询
+## 2. 进程池里取历史上的今天并渲染html, 一个进程一个db连接, 取和渲染都在这里并发
+## 3. 一个线程用MailSender发信
+def _iter_recipients(now, batch_size):
+    ## 先一次查出今天有历史的用户, 再只读这些用户的email和profile
+    user_ids = get_user_ids_with_status_today_in_history(now)
+    for user_id, email, name in User.iter_mail_recipients(user_ids, 
+            after_id=3, batch_size=batch_size):
+        yield user_id, email
+
+## 子进程里fork来的mysql连接不能关，关了会把父进程的也断掉
+_inherited_conns = []
+
+def _init_worker():
+    _inherited_conns.append(db_conn._conn)
+    db_conn.connect()
+    mc.disconnect_all()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def _render_job(user_id, email, now):
+    try:
+        u = User.get(user_id)
+        html = u and render_today_in_history(u, now)
+        return html and (user_id, email, html)
+    except:
+        print '--- render mail of user %s fail: %s' % (user_id, traceback.format_exc())
+
+def send_all_today_in_history(now=None, workers=None, batch_size=None, queue_size=None):
+    now = now or datetime.datetime.now()
+    workers = workers or config.MAIL_RENDER_WORKERS or multiprocessing.cpu_count()
+    batch_size = batch_size or config.MAIL_USER_BATCH
+    queue_size = queue_size or config.MAIL_QUEUE_SIZE
+    subject = '''thepast.me|整理自己的故事 %s''' % now.strftime("%Y-%m-%d")
 
-if __name__ == '__main__':
-    cursor = db_conn.execute("select max(id) from user")
-    row = cursor.fetchone()
-    cursor and cursor.close()
-    max_uid = row and row[0]
-    max_uid = int(max_uid)
-    t = 0
-    for uid in xrange(4,max_uid + 1):
-        if t >= 100:
-            t = 0
-            time.sleep(5)
+    begin = time.time()
+    stats = {"users": 0, "rendered": 0, "lost": 0}
+    pool = multiprocessing.Pool(workers, _init_worker)
+    ## 进程池里最多queue_size个job, 发信队列也最多queue_size封, 满了前一段就等着
+    send_q = Queue.Queue(queue_size)
+    pending = []
+    last_done = [time.time()]
+
+    def collect(max_pending):
+        ## 渲染好的交给发信线程, 等到没完成的不超过max_pending个
+        ## 不用callback, worker进程死掉的job就一直没有结果, 太久没有一个完成就当丢了
+        while True:
+            rest = []
+            for job, r in pending:
+                if not r.ready():
+                    rest.append((job, r))
+                    continue
+                last_done[0] = time.time()
+                try:
+                    x = r.get()
+                except Exception, e:
+                    print '--- render mail of user %s fail: %s' % (job[0], e)
+                    x = None
+                if x:
+                    stats["rendered"] += 1
+                    send_q.put(x)
+            pending[:] = rest
+            if len(pending) <= max_pending:
+                return
+            if time.time() - last_done[0] > config.MAIL_RENDER_TIMEOUT:
+                for (user_id, email), r in pending:
+                    print '--- render mail of user %s lost, the worker died' % user_id
+                stats["lost"] += len(pending)
+                del pending[:]
+                return
+            time.sleep(0.05)
+
+    def sender(mailer):
+        while True:
+            r = send_q.get()
+            if r is None:
+                break
+            user_id, email, html = r
+            print '--- send reminding to %s %s' %(user_id, email)
+            ## 一封出错不能让线程退出, 不然发信队列满了collect就一直等着
+            try:
+                _send(mailer, email, subject, '', html)
+            except:
+                print '--- send reminding to %s fail: %s' % (user_id, traceback.format_exc())
+
+    with MailSender() as mailer:
+        t = threading.Thread(target=sender, args=(mailer,))
+        t.start()
+        closed = False
         try:
-            send_today_in_history(uid)
-        except:
-            print traceback.format_exc()
-        time.sleep(1)
-        t += 1
+            for user_id, email in _iter_recipients(now, batch_size):
+                collect(queue_size - 1)
+                if not pending:
+                    last_done[0] = time.time()
+                stats["users"] += 1
+                pending.append(((user_id, email), 
+                        pool.apply_async(_render_job, (user_id, email, now))))
+            pool.close()
+            closed = True
+            collect(0)
+        finally:
+            try:
+                ## 中途出错没close, 或者丢了job, pool.join()都会出错或者一直等
+                if stats["lost"] or not closed:
+                    pool.terminate()
+                else:
+                    pool.join()
+            finally:
+                send_q.put(None)
+                t.join()
+    print '---- %s reminding of %s users done in %.1fs, %s rendered, %s lost, mail stats: %s' % (
+            datetime.datetime.now(), stats["users"], time.time() - begin, 
+            stats["rendered"], stats["lost"], mailer.get_stats())
 
+if __name__ == '__main__':
+    send_all_today_in_history()
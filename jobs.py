@@ -20,13 +20,17 @@ from past.api.wordpress import Wordpress
 from past.corelib import category2provider
 from past.model.status import Status, SyncTask
 from past.model.user import User, UserAlias, OAuth2Token
+from past.model.token_health import TokenHealth
+from past.api.error import OAuthError, OAuthTokenExpiredError
 
 log = logging.getLogger(__file__)
 
 def sync(t, old=False):
+    '''returns how many are synced, None if the api can not be called,
+    OAuthError is raised'''
     if not t:
         print 'no such task'
-        return 0
+        return None
     log.info("the sync task is :%s" % t)
     try:
         alias = None
@@ -36,12 +40,12 @@ def sync(t, old=False):
                 config.OPENID_TYPE_DICT[provider])
         if not alias:
             log.warn("no alias...")
-            return 0
+            return None
 
         token = OAuth2Token.get(alias.id)
         if not token:
             log.warn("no access token, break...")
-            return 0
+            return None
         
         client = None
         if provider == config.OPENID_DOUBAN:
@@ -58,7 +62,7 @@ def sync(t, old=False):
             client = Instagram.get_client(alias.user_id)
         if not client:
             log.warn("get client fail, break...")
-            return 0
+            return None
 
         if t.category == config.CATE_DOUBAN_NOTE:
             if old:
@@ -219,8 +223,11 @@ def sync(t, old=False):
                 for x in status_list:
                     Status.add_from_obj(t.user_id, x, json_encode(x.get_data()))
                 return len(status_list)
+    except OAuthError:
+        raise
     except Exception, e:
         print "---sync_exception_catched:", e
+        return None
     return 0
 
 def sync_wordpress(t, refresh=True):
@@ -259,13 +266,34 @@ def sync_helper(cate,old=False):
         log.warn("no task list, so sleep 10s and continue...")
         return 
     
-    log.info("task_list length is %s" % len(task_list))
+    ## 授权过期的不用去同步了, 每次都是失败, 等用户重新授权
+    ## 不过隔TOKEN_EXPIRED_RETRY_INTERVAL还是试一次, 没准又能用了(误判或者第三方恢复了)
+    retry_before = datetime.datetime.now() - \
+            datetime.timedelta(seconds=config.TOKEN_EXPIRED_RETRY_INTERVAL)
+    expired = {}
+    for h in TokenHealth.gets_by_status(OAuthTokenExpiredError.TYPE):
+        expired[(h.user_id, h.provider)] = h
+    log.info("task_list length is %s, %s expired tokens" % (len(task_list), len(expired)))
     for t in task_list:
+        provider = category2provider(t.category)
+        h = expired.get((str(t.user_id), config.OPENID_TYPE_DICT.get(provider)))
+        if h and h.since and h.since > retry_before:
+            log.info("token of %s expired, skip" % t)
+            continue
+        if h:
+            ## 先把since刷成现在, 还是失败的话下次要再等一个间隔
+            log.info("token of %s expired since %s, retry" % (t, h.since))
+            TokenHealth.set_status(h.user_id, h.provider, h.status, h.msg, flush=True)
         try:
             if t.category == config.CATE_WORDPRESS_POST:
                 sync_wordpress(t)
             else:
-                sync(t, old)
+                r = sync(t, old)
+                ## 不是每个第三方调用成功都会清掉过期的标记(比如从profile搬过来的), 这里清一下
+                if h and r is not None:
+                    TokenHealth.set_status(h.user_id, h.provider, TokenHealth.OK)
+        except OAuthError, e:
+            log.warn("sync %s fail: %s" % (t, e))
         except Exception, e:
             import traceback
             print "%s %s" % (datetime.datetime.now(), traceback.format_exc())
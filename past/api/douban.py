@@ -67,7 +67,8 @@ class Douban(OAuth2):
                     if new_tokens and isinstance(new_tokens, dict):
                         OAuth2Token.add(self.user_alias.id, 
                                 new_tokens.get("access_token"), 
-                                new_tokens.get("refresh_token"))
+                                new_tokens.get("refresh_token"),
+                                new_tokens.get("expires_in"))
                         excp.clear_the_profile()
                 except OAuthError, e:
                     log.warn("refresh token fail: %s" % e)
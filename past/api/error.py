@@ -1,7 +1,6 @@
 # -*- coding: utf-8 -*-
-import datetime
 from tweepy.error import TweepError
-from past.model.user import User
+from past.model.token_health import TokenHealth
 
 class OAuthError(Exception):
     def __init__(self, msg_type, user_id, openid_type, msg):
@@ -15,28 +14,22 @@ class OAuthError(Exception):
             (self.user_id, self.openid_type, self.msg_type, self.msg)
     __repr__ = __str__
 
+    ## 状态记在token_health里, 不再写进profile的json
     def set_the_profile(self, flush=False):
         if self.user_id:
-            u = User.get(self.user_id)
-            if u:
-                if flush:
-                    u.set_thirdparty_profile_item(self.openid_type, self.msg_type, datetime.datetime.now())
-                else:
-                    p = u.get_thirdparty_profile(self.openid_type)
-                    t = p and p.get(self.msg_type)
-                    u.set_thirdparty_profile_item(self.openid_type, self.msg_type, t or datetime.datetime.now())
+            TokenHealth.set_status(self.user_id, self.openid_type, self.msg_type, 
+                    self.msg, flush)
 
     def clear_the_profile(self):
         if self.user_id:
-            u = User.get(self.user_id)
-            if u:
-                u.set_thirdparty_profile_item(self.openid_type, self.msg_type, "")
+            h = TokenHealth.get(self.user_id, self.openid_type)
+            if h and h.status == self.msg_type:
+                TokenHealth.set_status(self.user_id, self.openid_type, TokenHealth.OK)
     
     def is_exception_exists(self):
         if self.user_id:
-            u = User.get(self.user_id)
-            p = u and u.get_thirdparty_profile(self.openid_type)
-            return p and p.get(self.msg_type)
+            h = TokenHealth.get(self.user_id, self.openid_type)
+            return h and h.status == self.msg_type and h.since
 
 
 class OAuthTokenExpiredError(OAuthError):
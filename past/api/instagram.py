@@ -61,11 +61,24 @@ class Instagram(OAuth2):
 
         log.info('getting %s...' % uri)
         resp, content = httplib2_request(uri, method)
+        user_id = self.user_alias and self.user_alias.user_id or None
+        excp = OAuthTokenExpiredError(user_id,
+                config.OPENID_TYPE_DICT[config.OPENID_INSTAGRAM], content)
         if resp.status == 200:
+            excp.clear_the_profile()
             return json_decode(content) if content else None
         else:
             log.warn("get %s fail, status code=%s, msg=%s" \
                     % (uri, resp.status, content))
+            try:
+                jdata = json_decode(content) if content else None
+            except ValueError:
+                jdata = None
+            meta = jdata and isinstance(jdata, dict) and jdata.get("meta") or {}
+            if meta.get("error_type") == "OAuthAccessTokenException":
+                ## token无效或者用户撤销了授权
+                excp.set_the_profile()
+                raise excp
 
     def get_user_info(self, uid=None):
         uid = uid or self.user_alias.alias or "self"
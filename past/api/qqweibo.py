@@ -216,7 +216,8 @@ class QQWeibo(object):
         if d['oauth_signature_method'] != "HMAC-SHA1":
             raise
 
-        hashed = hmac.new(key, raw, hashlib.sha1)
+        ## token从db出来是unicode, hmac只认str
+        hashed = hmac.new(str(key), raw, hashlib.sha1)
         hashed = binascii.b2a_base64(hashed.digest())[:-1]
         d["oauth_signature"] = hashed
         
@@ -281,9 +282,11 @@ class QQWeibo(object):
             print '---status from qqweibo, len is: %s' % len(info)
             return [QQWeiboStatusData(c) for c in info]
 
-    def post_status(self, text):
-        from flask import request
-        qs = {"content": text, "format": "json", "clientip": request.remote_addr,}
+    def post_status(self, text, clientip=None):
+        if not clientip:
+            from flask import request
+            clientip = request.remote_addr
+        qs = {"content": text, "format": "json", "clientip": clientip,}
         return self.access_resource2("POST", "/t/add", qs)
 
     def post_status_with_image(self, text, image_file):
@@ -66,7 +66,7 @@ class Renren(OAuth2):
         resp, content = httplib2_request(uri, method)
         if resp.status == 200:
             user_id = self.user_alias and self.user_alias.user_id or None
-            excp = OAuthTokenExpiredError(user_id=None,
+            excp = OAuthTokenExpiredError(user_id=user_id,
                     openid_type=config.OPENID_TYPE_DICT[config.OPENID_RENREN], 
                     msg=content)
             jdata = json_decode(content) if content else None
@@ -85,12 +85,15 @@ class Renren(OAuth2):
                             if new_tokens and isinstance(new_tokens, dict):
                                 OAuth2Token.add(self.user_alias.id, 
                                         new_tokens.get("access_token"), 
-                                        new_tokens.get("refresh_token"))
+                                        new_tokens.get("refresh_token"),
+                                        new_tokens.get("expires_in"))
                                 excp.clear_the_profile()
                         except OAuthError, e:
                             log.warn("refresh token fail: %s" % e)
                             excp.set_the_profile()
                             raise e
+                    return jdata
+            excp.clear_the_profile()
             return jdata
 
     def get_user_info(self, uid=None):
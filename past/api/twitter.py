@@ -39,7 +39,8 @@ class TwitterOAuth1(object):
 
         self.auth = tweepy.OAuthHandler(self.consumer_key, self.consumer_secret, self.callback)
         if self.token and self.token_secret and self.auth:
-            self.auth.set_access_token(self.token, self.token_secret)
+            ## token从db出来是unicode, 签名的hmac只认str
+            self.auth.set_access_token(str(self.token), str(self.token_secret))
 
     def __repr__(self):
         return "<TwitterOAuth1 consumer_key=%s, consumer_secret=%s, token=%s, token_secret=%s>" \
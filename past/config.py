@@ -10,11 +10,35 @@ DB_NAME = "thepast"
 SMTP_SERVER = "localhost"
 SMTP_USER = ""
 SMTP_PASSWORD = ""
+#MailSender keeps one smtp session for SMTP_MESSAGES_PER_SESSION mails,
+#and sends at most SMTP_RATE mails per second
+SMTP_MESSAGES_PER_SESSION = 100
+SMTP_RATE = 1
+SMTP_TIMEOUT = 30
+#the reminding mails are rendered in MAIL_RENDER_WORKERS processes (0 for the
+#cpu count), users are loaded MAIL_USER_BATCH a time, at most MAIL_QUEUE_SIZE
+#mails are waiting for rendering or sending
+MAIL_RENDER_WORKERS = 0
+MAIL_USER_BATCH = 500
+MAIL_QUEUE_SIZE = 200
+#render jobs not finished when no job finished for MAIL_RENDER_TIMEOUT seconds
+#are taken as lost (the worker died)
+MAIL_RENDER_TIMEOUT = 300
 
 #-- mc config --
 # mc replace redis
 MEMCACHED_HOST = "127.0.0.1"
 MEMCACHED_PORT = 11211
+## more than one node: keys are spread on a consistent hash ring,
+## e.g. ["10.0.0.1:11211", ("10.0.0.2:11211", 2)], the number is the weight
+MEMCACHED_SERVERS = []
+## a node failing this many times in a row is ejected for a while
+MEMCACHED_FAILURE_LIMIT = 3
+MEMCACHED_EJECT_TIME = 30
+## keys of an ejected node are written to the next nodes meanwhile, expiring in
+## at most this many seconds, or they would be read again, stale, the next
+## time the node is ejected
+MEMCACHED_FALLBACK_EXPIRE = 30
 
 #-- app config --
 DEBUG = True
@@ -107,6 +131,27 @@ APIKEY_DICT = {
     },
 }
 
+#/reshare_ajax posts to the providers at the same time, and waits at most
+#RESHARE_TIMEOUT seconds for them
+RESHARE_TIMEOUT = 10
+
+#-- oauth token refresh --
+#cronjob/refresh_tokens.py refreshes the tokens expiring in TOKEN_REFRESH_AHEAD
+#seconds, and the ones without a known expire time saved TOKEN_REFRESH_UNKNOWN_AGE
+#seconds ago, TOKEN_REFRESH_BATCH tokens loaded a time
+TOKEN_REFRESH_PROVIDERS = [OPENID_DOUBAN, OPENID_SINA, OPENID_RENREN,]
+TOKEN_REFRESH_AHEAD = 3600 * 24 * 2
+TOKEN_REFRESH_UNKNOWN_AGE = 3600 * 24 * 5
+TOKEN_REFRESH_BATCH = 200
+#at most TOKEN_REFRESH_PER_PROVIDER requests at a time and TOKEN_REFRESH_RATE
+#requests per second to the same provider
+TOKEN_REFRESH_THREADS = 8
+TOKEN_REFRESH_PER_PROVIDER = 2
+TOKEN_REFRESH_RATE = 2
+#jobs.py skips syncing the expired tokens, but retries each of them once every
+#TOKEN_EXPIRED_RETRY_INTERVAL seconds
+TOKEN_EXPIRED_RETRY_INTERVAL = 3600 * 24
+
 #-- category of status --
 CATE_DOUBAN_STATUS = 100
 CATE_DOUBAN_NOTE = 101
@@ -162,14 +207,52 @@ MY_USER_ID = 4
 
 #cache
 CACHE_DIR = "/home/work/proj/thepast/var/cache"
+#the images in CACHE_DIR are kept under this size, least recently used out first
+IMAGE_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+#images of a pdf are downloaded into CACHE_DIR before rendering,
+#with these many threads, at most PER_HOST at a time from one host
+PDF_IMAGE_FETCH_THREADS = 8
+PDF_IMAGE_FETCH_PER_HOST = 2
+PDF_IMAGE_FETCH_TIMEOUT = 10
+PDF_IMAGE_MAX_SIZE = 5 * 1024 * 1024
+#and downscaled to what the pdf shows (img is at most 550px wide in pdf.css,
+#twice that for print), recompressed with this jpeg quality
+PDF_IMAGE_MAX_WIDTH = 1100
+PDF_IMAGE_MAX_HEIGHT = 1600
+PDF_IMAGE_QUALITY = 80
+#False to embed the original images, generate_pdf logs the render time of
+#each pdf to compare the two
+PDF_IMAGE_NORMALIZE = True
+
+#compiled jinja templates of the offline jobs (pdf, reminding mails)
+TEMPLATE_CACHE_DIR = "/home/work/proj/thepast/var/jinja_cache"
 
 #file download 
 FILE_DOWNLOAD_DIR = "/home/work/proj/thepast/var/down"
 PDF_FILE_DOWNLOAD_DIR = FILE_DOWNLOAD_DIR + "/pdf"
+#a month with more statuses is split into several pdf volumes, xhtml2pdf
+#takes memory in proportion to the statuses of one pdf
+PDF_STATUSES_PER_VOLUME = 300
+#gzip level of the pdf.tar.gz, 1 is fastest, 9 is smallest
+PDF_COMPRESS_LEVEL = 6
+#processes of cronjob/generate_pdf.py, 0 for one per cpu
+PDF_WORKERS = 0
+#a pdf job is stopped after PDF_JOB_TIMEOUT seconds or when taking more
+#than PDF_JOB_MEMORY MB, a worker process is replaced after PDF_JOBS_PER_WORKER jobs
+PDF_JOB_TIMEOUT = 600
+PDF_JOB_MEMORY = 2048
+PDF_JOBS_PER_WORKER = 10
 
 #suicide log
 SUICIDE_LOG = "/home/work/proj/thepast/suicide.log"
 
+#slow request log, requests slower than the threshold(seconds) are logged
+SLOW_REQUEST_LOG = "/home/work/proj/thepast/var/slow_request.log"
+SLOW_REQUEST_THRESHOLD = 1.0
+#add the X-Past-Profile header (sql/mc count and time) to every response,
+#only turn it on in local_config of a dev box
+PROFILE_HEADER = False
+
 try:
     from local_config import *
 except:
@@ -5,6 +5,7 @@ from past import config
 from past.corelib import set_user_cookie 
 
 from past.model.user import User, UserAlias, OAuth2Token
+from past.model.token_health import TokenHealth
 from past.model.status import SyncTask, TaskQueue
 
 from past.api.douban import Douban
@@ -16,7 +17,6 @@ from past.api.twitter import TwitterOAuth1
 from past.api.wordpress import Wordpress
 from past.api.error import OAuthError
 
-from past.utils.escape import json_encode
 from past.connect import blue_print
 
 from past.utils.logger import logging
@@ -188,13 +188,8 @@ def _save_user_and_token(token_dict, thirdparty_user, openid_type):
     if not ua:
         return None
 
-    ##设置个人资料（头像等等）
+    ##设置个人资料（头像等等）, 把各个第三方的uid保存到profile里面, 一次写进去
     u = User.get(ua.user_id)
-    u.set_avatar_url(thirdparty_user.get_avatar())
-    u.set_icon_url(thirdparty_user.get_icon())
-
-    ##把各个第三方的uid保存到profile里面
-    k = openid_type
     v = {
         "uid": thirdparty_user.get_uid(), 
         "name": thirdparty_user.get_nickname(), 
@@ -205,7 +200,10 @@ def _save_user_and_token(token_dict, thirdparty_user, openid_type):
         "email": thirdparty_user.get_email(),
         "first_connect": "Y" if first_connect else "N",
     }
-    u.set_profile_item(k, json_encode(v))
+    u.update_profile({
+        "avatar_url": thirdparty_user.get_avatar(),
+        "icon_url": thirdparty_user.get_icon(),
+    }, {openid_type: v})
 
     ##保存access token
     if openid_type == config.OPENID_TYPE_DICT[config.OPENID_TWITTER]:
@@ -213,7 +211,9 @@ def _save_user_and_token(token_dict, thirdparty_user, openid_type):
                 token_dict.get("access_token_secret", ""))
     else:
         OAuth2Token.add(ua.id, token_dict.get("access_token"), 
-                token_dict.get("refresh_token", ""))
+                token_dict.get("refresh_token", ""), token_dict.get("expires_in"))
+    ##重新授权了, 之前记下的过期就不算了
+    TokenHealth.set_status(ua.user_id, openid_type, TokenHealth.OK)
     ##set cookie，保持登录状态
     if not g.user:
         g.user = User.get(ua.user_id)
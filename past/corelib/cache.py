@@ -4,6 +4,8 @@
 
 import inspect
 from functools import wraps
+import math
+import random
 import time
 
 try:
@@ -13,6 +15,7 @@ except:
 
 from .empty import Empty
 from .format import format
+from .cache_stats import create_stats
 
 from past.store import mc
 
@@ -24,6 +27,97 @@ ONE_DAY = ONE_HOUR * 24
 ONE_WEEK = ONE_DAY * 7
 ONE_MONTH = ONE_DAY * 30
 
+# anti miss-storm: only the holder of the lease recomputes an expired key,
+# the others serve the stale value or wait for the lease to be released
+LEASE_EXPIRE = 10
+LEASE_RETRY = 20
+LEASE_RETRY_INTERVAL = 0.05
+# how long an expired value is kept around to be served as stale
+STALE_EXPIRE = 300
+# beta of the probabilistic early refresh, bigger means refresh earlier
+EARLY_REFRESH_BETA = 1.0
+
+stats = create_stats(mc)
+
+class CacheItem(object):
+    """value stored in mc, with its soft expire time and recompute cost"""
+
+    def __init__(self, value, expire=0, delta=0):
+        self.value = value
+        self.expire_at = time.time() + expire if expire else 0
+        self.delta = delta
+
+    def need_refresh(self, beta=EARLY_REFRESH_BETA):
+        if not self.expire_at:
+            return False
+        ## refresh before expire with a probability growing as time goes by,
+        ## the more expensive the recompute, the earlier
+        early = - self.delta * beta * math.log(random.random() or 1e-10)
+        return time.time() + early >= self.expire_at
+
+def _load_item(r):
+    if not r:
+        return None
+    r = pickle.loads(r)
+    if not isinstance(r, CacheItem):
+        ## value set before leases were introduced
+        r = CacheItem(r)
+    return r
+
+def _lease_key(key):
+    return "lease:%s" % key
+
+def _create(mc, key, creator, expire):
+    t = time.time()
+    r = creator()
+    delta = time.time() - t
+    stats.incr(key, "miss")
+    stats.incr(key, "recompute_ms", int(delta * 1000))
+    if r is not None:
+        item = CacheItem(r, expire, delta)
+        v = pickle.dumps(item)
+        stats.incr(key, "bytes", len(v))
+        mc.set(key, v, expire and expire + STALE_EXPIRE)
+    return r
+
+def get_or_create(mc, key, creator, expire=0, max_retry=None):
+    item = _load_item(mc.get(key))
+    if item is not None and not item.need_refresh():
+        stats.incr(key, "hit")
+        return item.value
+
+    lease = _lease_key(key)
+    if mc.add(lease, 1, LEASE_EXPIRE):
+        try:
+            return _create(mc, key, creator, expire)
+        finally:
+            mc.delete(lease)
+
+    ## someone else is recomputing
+    if item is not None:
+        stats.incr(key, "stale")
+        return item.value
+
+    retry = LEASE_RETRY if max_retry is None else max_retry
+    t = time.time()
+    if retry > 0:
+        stats.incr(key, "wait")
+    try:
+        while retry > 0:
+            time.sleep(LEASE_RETRY_INTERVAL)
+            rs = mc.get_multi([key, lease])
+            item = _load_item(rs.get(key))
+            if item is not None:
+                stats.incr(key, "hit")
+                return item.value
+            if lease not in rs:
+                ## lease released without a value or mc is down, do not wait more
+                break
+            retry -= 1
+    finally:
+        stats.incr(key, "wait_ms", int((time.time() - t) * 1000))
+    return _create(mc, key, creator, expire)
+
 
 def gen_key(key_pattern, arg_names, defaults, *a, **kw):
     return gen_key_factory(key_pattern, arg_names, defaults)(*a, **kw)
@@ -44,34 +138,57 @@ def gen_key_factory(key_pattern, arg_names, defaults):
         return key and key.replace(' ','_'), aa
     return gen_key
 
-def cache_(key_pattern, mc, expire=0, max_retry=0):
+## namespace: keys of a namespace embed its version, so bumping the version
+## invalidates all of them at once, e.g. every id list of one user
+def _ns_key(ns):
+    if isinstance(ns, unicode):
+        ns = ns.encode("utf8")
+    return "ns:%s" % ns.replace(' ', '_')
+
+def get_ns_version(mc, ns):
+    k = _ns_key(ns)
+    v = mc.get(k)
+    if v is None:
+        ## start from a timestamp, so versions used before an eviction
+        ## will not be reused
+        v = int(time.time() * 1000)
+        if not mc.add(k, v):
+            v = mc.get(k) or v
+    return v
+
+def invalidate_ns_(ns, mc):
+    k = _ns_key(ns)
+    if mc.incr(k) is None:
+        mc.set(k, int(time.time() * 1000))
+
+def gen_ns_key_factory(ns_pattern, arg_names, defaults, mc):
+    gen_ns = gen_key_factory(ns_pattern, arg_names, defaults)
+    def gen_key(key, *a, **kw):
+        ns, _ = gen_ns(*a, **kw)
+        if not ns:
+            return key
+        return "%s:v%s" % (key, get_ns_version(mc, ns))
+    return gen_key
+
+def cache_(key_pattern, mc, expire=0, max_retry=None, ns=None):
     def deco(f):
         arg_names, varargs, varkw, defaults = inspect.getargspec(f)
         if varargs or varkw:
             raise Exception("do not support varargs")
         gen_key = gen_key_factory(key_pattern, arg_names, defaults)
+        gen_ns_key = ns and gen_ns_key_factory(ns, arg_names, defaults, mc)
         @wraps(f)
         def _(*a, **kw):
             key, args = gen_key(*a, **kw)
             if not key:
                 return f(*a, **kw)
+            if gen_ns_key:
+                key = gen_ns_key(key, *a, **kw)
             if isinstance(key, unicode):
                 key = key.encode("utf8")
-            r = mc.get(key)
-
-            # anti miss-storm
-            retry = max_retry
-            while r is None and retry > 0:
-                time.sleep(0.1)
-                r = mc.get(key)
-                retry -= 1
-            r = pickle.loads(r) if r else None
-            
-            if r is None:
-                r = f(*a, **kw)
-                if r is not None:
-                    mc.set(key, pickle.dumps(r), expire)
-            
+            r = get_or_create(mc, key, lambda: f(*a, **kw),
+                    expire=expire, max_retry=max_retry)
+
             if isinstance(r, Empty):
                 r = None
             return r
@@ -79,7 +196,7 @@ def cache_(key_pattern, mc, expire=0, max_retry=0):
         return _
     return deco
 
-def pcache_(key_pattern, mc, count=300, expire=0, max_retry=0):
+def pcache_(key_pattern, mc, count=300, expire=0, max_retry=None, ns=None):
     def deco(f):
         arg_names, varargs, varkw, defaults = inspect.getargspec(f)
         if varargs or varkw:
@@ -87,6 +204,7 @@ def pcache_(key_pattern, mc, count=300, expire=0, max_retry=0):
         if not ('limit' in arg_names):
             raise Exception("function must has 'limit' in args")
         gen_key = gen_key_factory(key_pattern, arg_names, defaults)
+        gen_ns_key = ns and gen_ns_key_factory(ns, arg_names, defaults, mc)
         @wraps(f)
         def _(*a, **kw):
             key, args = gen_key(*a, **kw)
@@ -96,27 +214,54 @@ def pcache_(key_pattern, mc, count=300, expire=0, max_retry=0):
             limit = int(limit)
             if not key or limit is None or start+limit > count:
                 return f(*a, **kw)
+            if gen_ns_key:
+                key = gen_ns_key(key, *a, **kw)
             if isinstance(key, unicode):
                 key = key.encode("utf8")
-            r = mc.get(key)
-            
-            # anti miss-storm
-            retry = max_retry
-            while r is None and retry > 0:
-                time.sleep(0.1)
-                r = mc.get(key)
-                retry -= 1
-            r = pickle.loads(r) if r else None
-
-            if r is None:
-                r = f(limit=count, **args)
-                mc.set(key, pickle.dumps(r), expire)
+            r = get_or_create(mc, key, lambda: f(limit=count, **args),
+                    expire=expire, max_retry=max_retry)
             return r[start:start+limit]
 
+        def update_cache(update, *a, **kw):
+            key, args = gen_key(*a, **kw)
+            if not key:
+                return True
+            if gen_ns_key:
+                key = gen_ns_key(key, *a, **kw)
+            if isinstance(key, unicode):
+                key = key.encode("utf8")
+            return update_pcache_(key, lambda r: update(r, count), mc)
+
         _.original_function = f
+        _.update_cache = update_cache
         return _
     return deco
 
+def update_pcache_(key, update, mc, max_retry=3):
+    """update the cached list in place, safe under concurrency with gets/cas.
+    update(list) returns the new list, or None if it can not be applied.
+    returns False when the list is still cached but not updated, the caller
+    should invalidate it then"""
+    try:
+        for i in xrange(max_retry):
+            r = mc.gets(key)
+            if r is None:
+                ## not cached, nothing to update
+                return True
+            item = _load_item(r)
+            value = update(list(item.value))
+            if value is None:
+                return False
+            item.value = value
+            expire = item.expire_at and \
+                    max(int(item.expire_at - time.time()), 1) + STALE_EXPIRE
+            if mc.cas(key, pickle.dumps(item), expire):
+                return True
+        return False
+    finally:
+        ## cache_cas的client会一直记着gets过的key, 用完就清掉
+        mc.reset_cas()
+
 def delete_cache_(key_pattern, mc):
     def deco(f):
         arg_names, varargs, varkw, defaults = inspect.getargspec(f)
@@ -128,6 +273,7 @@ def delete_cache_(key_pattern, mc):
             key, args = gen_key(*a, **kw)
             r = f(*a, **kw)
             mc.delete(key)
+            stats.incr(key, "delete")
             return r
         return _
         _.original_function = f
@@ -135,16 +281,21 @@ def delete_cache_(key_pattern, mc):
 
 def create_decorators(mc):
 
-    def _cache(key_pattern, expire=0, mc=mc, max_retry=0):
-        return cache_(key_pattern, mc, expire=expire, max_retry=max_retry)
+    def _cache(key_pattern, expire=0, mc=mc, max_retry=None, ns=None):
+        return cache_(key_pattern, mc, expire=expire, max_retry=max_retry, ns=ns)
     
-    def _pcache(key_pattern, count=300, expire=0, max_retry=0):
-        return pcache_(key_pattern, mc, count=count, expire=expire, max_retry=max_retry)
+    def _pcache(key_pattern, count=300, expire=0, max_retry=None, ns=None):
+        return pcache_(key_pattern, mc, count=count, expire=expire, 
+                max_retry=max_retry, ns=ns)
     
     def _delete_cache(key_pattern):
         return delete_cache_(key_pattern, mc=mc)
+
+    def _invalidate_ns(ns):
+        return invalidate_ns_(ns, mc=mc)
     
-    return dict(cache=_cache, pcache=_pcache, delete_cache=_delete_cache)
+    return dict(cache=_cache, pcache=_pcache, delete_cache=_delete_cache,
+            invalidate_ns=_invalidate_ns)
                 
     
 globals().update(create_decorators(mc))
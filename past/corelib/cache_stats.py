@@ -0,0 +1,142 @@
+#-*- coding:utf-8 -*-
+
+'''hit/miss/recompute stats of the cache, grouped by key prefix.
+
+counted in process, and added up in mc every few seconds by a background
+thread, so the numbers of all the web workers and cron jobs can be read in
+one place without slowing down the requests.
+'''
+
+import os
+import time
+import atexit
+import threading
+import traceback
+from collections import defaultdict
+
+METRICS = (
+    "hit",          # fresh value returned
+    "stale",        # stale value returned while someone else recomputes
+    "miss",         # recomputed by this caller
+    "recompute_ms", # time spent in recompute
+    "bytes",        # payload size of the values set
+    "wait",         # callers waiting on the lease of someone else
+    "wait_ms",      # time spent waiting on the lease
+    "delete",       # deleted by delete_cache
+)
+
+REGISTRY_KEY = "cache_stats:prefixes"
+
+def key_prefix(key):
+    ## status:123 -> status:, mc_raw_status:123 -> mc_raw_status:
+    if ":" in key:
+        return key.split(":", 1)[0] + ":"
+    return key
+
+class CacheStats(object):
+
+    def __init__(self, mc, flush_interval=10):
+        self.mc = mc
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._counts = defaultdict(lambda: defaultdict(int))
+        self._pid = None
+
+    def incr(self, key, metric, n=1):
+        if self._pid != os.getpid():
+            self._start()
+        with self._lock:
+            self._counts[key_prefix(key)][metric] += n
+
+    def _start(self):
+        ## 第一次计数时起flush线程; fork出来的子进程里没有这个线程, 
+        ## 锁也可能是fork时别的线程拿着的, 都重新来, 父进程没写出去的数归父进程
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._counts = defaultdict(lambda: defaultdict(int))
+        t = threading.Thread(target=self._run, args=(self._pid,))
+        t.setDaemon(True)
+        t.start()
+
+    def _run(self, pid):
+        while self._pid == pid:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            counts, self._counts = self._counts, defaultdict(lambda: defaultdict(int))
+        if not counts:
+            return
+
+        ## 统计写失败了丢掉就是, 不能影响别的
+        try:
+            self._register(set(counts))
+
+            for prefix, d in counts.iteritems():
+                for metric, n in d.iteritems():
+                    if not n:
+                        continue
+                    k = self._key(prefix, metric)
+                    if self.mc.incr(k, int(n)) is None and not self.mc.add(k, str(int(n))):
+                        self.mc.incr(k, int(n))
+        except Exception:
+            print '---- flush cache stats fail: %s' % traceback.format_exc()
+
+    def _register(self, prefixes):
+        ## 每次flush都看一下, 别的进程reset了或者被LRU踢掉了也能补回来
+        ## 几个进程同时加, 用gets/cas(没有就add), 谁的都不会丢
+        try:
+            for i in xrange(3):
+                old = self.mc.gets(REGISTRY_KEY)
+                if old is None:
+                    if self.mc.add(REGISTRY_KEY, prefixes):
+                        return
+                elif prefixes <= old:
+                    return
+                elif self.mc.cas(REGISTRY_KEY, old | prefixes):
+                    return
+        finally:
+            self.mc.reset_cas()
+
+    def _key(self, prefix, metric):
+        return "cache_stats:%s%s" % (prefix, metric)
+
+    def get_all(self):
+        self.flush()
+        prefixes = sorted(self.mc.get(REGISTRY_KEY) or [])
+        keys = [self._key(p, m) for p in prefixes for m in METRICS]
+        rs = keys and self.mc.get_multi(keys) or {}
+
+        r = {}
+        for p in prefixes:
+            d = dict((m, int(rs.get(self._key(p, m)) or 0)) for m in METRICS)
+            total = d["hit"] + d["stale"] + d["miss"]
+            d["hit_ratio"] = round(float(d["hit"] + d["stale"]) / total, 4) if total else 0
+            d["avg_recompute_ms"] = d["recompute_ms"] / d["miss"] if d["miss"] else 0
+            d["avg_bytes"] = d["bytes"] / d["miss"] if d["miss"] else 0
+            r[p] = d
+        return r
+
+    def reset(self):
+        prefixes = self.mc.get(REGISTRY_KEY) or []
+        for p in prefixes:
+            for m in METRICS:
+                self.mc.delete(self._key(p, m))
+        self.mc.delete(REGISTRY_KEY)
+        with self._lock:
+            self._counts = defaultdict(lambda: defaultdict(int))
+
+def format_stats(stats):
+    lines = ["%-28s %10s %10s %10s %8s %12s %10s %8s" % ("prefix", "hit", "stale",
+            "miss", "ratio", "recompute_ms", "avg_bytes", "wait")]
+    for p, d in sorted(stats.iteritems(), key=lambda x: -x[1]["miss"]):
+        lines.append("%-28s %10s %10s %10s %8s %12s %10s %8s" % (p, d["hit"], d["stale"],
+                d["miss"], d["hit_ratio"], d["avg_recompute_ms"], d["avg_bytes"], d["wait"]))
+    return "\n".join(lines)
+
+def create_stats(mc):
+    stats = CacheStats(mc)
+    ## cron jobs exit before the next flush
+    atexit.register(stats.flush)
+    return stats
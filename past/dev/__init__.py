@@ -10,6 +10,7 @@ blue_print = Blueprint("dev", __name__, template_folder="templates", static_fold
 
 from .view import token 
 from .view import api
+from .view import cache
 
 @blue_print.before_request
 def before_request():
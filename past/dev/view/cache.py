@@ -0,0 +1,20 @@
+#-*- coding:utf-8 -*-
+# blueprint: dev -> view -> cache
+
+from flask import g, abort, request
+
+from past import config
+from past.dev import blue_print
+from past.corelib.cache import stats
+from past.utils.escape import json_encode
+
+from past.utils.logger import logging
+log = logging.getLogger(__file__)
+
+@blue_print.route("/cache/stats")
+def cache_stats():
+    if not (g.user and g.user.id == str(config.MY_USER_ID)):
+        abort(403, "Not allowed")
+    if request.args.get("reset"):
+        stats.reset()
+    return json_encode(stats.get_all())
@@ -5,6 +5,7 @@ from MySQLdb import IntegrityError
 from past.corelib.cache import cache
 from past.store import db_conn, mc
 from past.utils.escape import json_encode, json_decode
+from past import config
 
 class Kv(object):
     def __init__(self, key_, val, time):
@@ -98,6 +99,100 @@ class UserProfile(object):
             db_conn.rollback()
         cursor and cursor.close()
 
+## profile每个key一行, 改一项只写那一行, 不再把整个json读出来改了再写回去
+## 第三方帐号的profile一项一行, key是"D:share"这样的
+class UserProfileItem(object):
+
+    @classmethod
+    def clear_cache(cls, user_id):
+        mc.delete("mc_user_profile_item:%s" %user_id)
+
+    @classmethod
+    @cache("mc_user_profile_item:{user_id}")
+    def gets(cls, user_id):
+        '''{key: value} of the user'''
+        cursor = db_conn.execute('''select `key`, value from user_profile_item
+                where user_id=%s''', user_id)
+        rows = cursor.fetchall()
+        cursor and cursor.close()
+        r = {}
+        for k, v in rows:
+            try:
+                r[k] = json_decode(v)
+            except ValueError:
+                print '------decode profile item %s of %s fail' % (k, user_id)
+        return r
+
+    @classmethod
+    def flatten(cls, profile):
+        '''{k: v} of a profile as the old json, the profile of a thirdparty
+        (a dict or its json) is split into "openid_type:k" items'''
+        items = {}
+        for k, v in profile.iteritems():
+            if k in config.OPENID_TYPE_DICT.values():
+                if isinstance(v, basestring):
+                    try:
+                        v = json_decode(v) if v else {}
+                    except ValueError:
+                        v = {}
+                if isinstance(v, dict):
+                    for k_, v_ in v.iteritems():
+                        items["%s:%s" % (k, k_)] = v_
+                    continue
+            items[k] = v
+        return items
+
+    @classmethod
+    def set(cls, user_id, items):
+        '''write the items whose value changed, in one statement,
+        returns False if nothing is written'''
+        old = cls.gets(user_id)
+        items = [(k, v) for k, v in items.iteritems() if k not in old or old[k] != v]
+        if not items:
+            return True
+        args = []
+        for k, v in items:
+            args.extend([user_id, k, json_encode(v)])
+
+        cursor = None
+        try:
+            cursor = db_conn.execute('''replace into user_profile_item (user_id, `key`, value) 
+                values ''' + ",".join(["(%s,%s,%s)"] * len(items)), tuple(args))
+            db_conn.commit()
+            cls.clear_cache(user_id)
+            return True
+        except IntegrityError:
+            db_conn.rollback()
+            return False
+        finally:
+            cursor and cursor.close()
+
+    @classmethod
+    def remove_keys(cls, user_id, keys):
+        if not keys:
+            return
+        cursor = None
+        try:
+            cursor = db_conn.execute('''delete from user_profile_item where user_id=%%s 
+                    and `key` in (%s)''' % ",".join(["%s"] * len(keys)), 
+                    tuple([user_id] + list(keys)))
+            db_conn.commit()
+            cls.clear_cache(user_id)
+        except IntegrityError:
+            db_conn.rollback()
+        cursor and cursor.close()
+
+    @classmethod
+    def remove(cls, user_id):
+        cursor = None
+        try:
+            cursor = db_conn.execute('''delete from user_profile_item where user_id=%s''', user_id)
+            db_conn.commit()
+            cls.clear_cache(user_id)
+        except IntegrityError:
+            db_conn.rollback()
+        cursor and cursor.close()
+
 class RawStatus(object):
     def __init__(self, status_id, text, raw, time):
         self.status_id = status_id
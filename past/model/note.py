@@ -5,7 +5,7 @@ from MySQLdb import IntegrityError
 import datetime
 
 from past.store import db_conn, mc
-from past.corelib.cache import cache, pcache, HALF_HOUR
+from past.corelib.cache import cache, pcache, invalidate_ns, HALF_HOUR
 from past.utils.escape import json_encode, json_decode
 from past import consts
 from past import config
@@ -25,8 +25,7 @@ class Note(object):
     @classmethod
     def _clear_cache(cls, user_id, note_id):
         if user_id:
-            mc.delete("note_ids:%s" % user_id)
-            mc.delete("note_ids_asc:%s" % user_id)
+            invalidate_ns("note:user:%s" % user_id)
         if note_id:
             mc.delete("note:%s" % note_id)
 
@@ -101,14 +100,16 @@ class Note(object):
             db_conn.execute("""delete from status where id=%s""", id)
             db_conn.commit()
             cls._clear_cache(note.user_id, note.id)
+            from past.model.status import Status
+            Status._clear_cache(note.user_id, None)
         
     @classmethod
-    @pcache("note_ids:user:{user_id}")
+    @pcache("note_ids:user:{user_id}", ns="note:user:{user_id}")
     def get_ids_by_user(cls, user_id, start, limit):
         return cls._get_ids_by_user(user_id, start, limit)
 
     @classmethod
-    @pcache("note_ids_asc:user:{user_id}")
+    @pcache("note_ids_asc:user:{user_id}", ns="note:user:{user_id}")
     def get_ids_by_user_asc(cls, user_id, start, limit):
         return cls._get_ids_by_user(user_id, start, limit, order="create_time asc")
 
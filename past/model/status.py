@@ -8,7 +8,7 @@ from MySQLdb import IntegrityError
 from past.utils.escape import json_encode, json_decode, clear_html_element
 from past.utils.logger import logging
 from past.store import mc, db_conn
-from past.corelib.cache import cache, pcache, HALF_HOUR
+from past.corelib.cache import cache, pcache, invalidate_ns, HALF_HOUR
 from .user import UserAlias, User
 from .note import Note
 from .data import DoubanMiniBlogData, DoubanNoteData, DoubanStatusData, \
@@ -101,9 +101,52 @@ class Status(object):
         if status_id:
             mc.delete("status:%s" % status_id)
         if user_id:
-            mc.delete("status_ids:user:%scate:" % user_id)
-            if cate:
-                mc.delete("status_ids:user:%scate:%s" % (user_id, cate))
+            ## all the id lists of the user, whatever the category or date
+            invalidate_ns("status:user:%s" % user_id)
+            invalidate_ns("status_date:user:%s" % user_id)
+
+    @classmethod
+    def _add_to_ids_cache(cls, status):
+        """insert the new status into the cached id lists of the user,
+        returns False if some list can not be updated in place"""
+        if str(status.category) == str(config.CATE_DOUBAN_NOTE):
+            ## douban notes are in none of the lists
+            return True
+
+        create_time = status._raw_create_time()
+        def _insert(pairs, count, desc):
+            if int(status.id) in [x[1] for x in pairs]:
+                return pairs
+            ## binary search the position, the lists are sorted by create_time
+            ## and carry it, no need to get the statuses
+            lo, hi = 0, len(pairs)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                t = pairs[mid][0]
+                if (t >= create_time if desc else t <= create_time):
+                    lo = mid + 1
+                else:
+                    hi = mid
+            if lo >= count:
+                ## out of the cached window
+                return pairs
+            pairs.insert(lo, (create_time, int(status.id)))
+            return pairs[:count]
+
+        for cate in ("", status.category):
+            if not cls._get_timed_ids.update_cache(lambda pairs, count: _insert(pairs, count, True),
+                    cls, status.user_id, cate=cate):
+                return False
+            if not cls._get_timed_ids_asc.update_cache(lambda pairs, count: _insert(pairs, count, False),
+                    cls, status.user_id, cate=cate):
+                return False
+        return True
+
+    def _raw_create_time(self):
+        ## create_time as in db, the one of twitter is shifted in __init__
+        if self.site == config.OPENID_TYPE_DICT[config.OPENID_TWITTER]:
+            return self.create_time - datetime.timedelta(seconds=8*3600)
+        return self.create_time
 
     def privacy(self):
         if self.category == config.CATE_THEPAST_NOTE:
@@ -140,6 +183,7 @@ class Status(object):
             text=None, raw=None):
         status = None
         cursor = None
+        added = False
         try:
             cursor = db_conn.execute("""insert into status 
                     (user_id, origin_id, create_time, site, category, title)
@@ -151,12 +195,18 @@ class Status(object):
                 raw = json_encode(raw) if raw is not None else ""
                 RawStatus.set(status_id, text, raw)
                 db_conn.commit()
+                added = True
                 status = cls.get(status_id)
         except IntegrityError:
             log.warning("add status duplicated, uniq key is %s:%s:%s, ignore..." %(origin_id, site, category))
             db_conn.rollback()
         finally:
-            cls._clear_cache(user_id, None, cate=category)
+            if added:
+                ## update the cached id lists in place, rebuild them 
+                ## from db only if that fails
+                invalidate_ns("status_date:user:%s" % user_id)
+                if not (status and cls._add_to_ids_cache(status)):
+                    cls._clear_cache(user_id, None, cate=category)
             cursor and cursor.close()
 
         return status
@@ -194,14 +244,23 @@ class Status(object):
         return status
 
     @classmethod
-    @pcache("status_ids:user:{user_id}cate:{cate}")
     def get_ids(cls, user_id, start=0, limit=20, cate=""):
+        return [x[1] for x in cls._get_timed_ids(user_id, start, limit, cate=cate)]
+
+    @classmethod
+    def get_ids_asc(cls, user_id, start=0, limit=20, cate=""):
+        return [x[1] for x in cls._get_timed_ids_asc(user_id, start, limit, cate=cate)]
+
+    ## 缓存的是(create_time, id), 插入新status时按时间找位置用
+    @classmethod
+    @pcache("status_timed_ids:user:{user_id}cate:{cate}", ns="status:user:{user_id}")
+    def _get_timed_ids(cls, user_id, start=0, limit=20, cate=""):
         return cls._get_ids(user_id, start, limit, 
                 order="create_time desc", cate=cate)
 
     @classmethod
-    @pcache("status_ids_asc:user:{user_id}cate:{cate}")
-    def get_ids_asc(cls, user_id, start=0, limit=20, cate=""):
+    @pcache("status_timed_ids_asc:user:{user_id}cate:{cate}", ns="status:user:{user_id}")
+    def _get_timed_ids_asc(cls, user_id, start=0, limit=20, cate=""):
         return cls._get_ids(user_id, start, limit, 
                 order="create_time", cate=cate)
 
@@ -213,16 +272,16 @@ class Status(object):
         if cate:
             if str(cate) == str(config.CATE_DOUBAN_NOTE):
                 return []
-            sql = """select id from status where user_id=%s and category=%s
+            sql = """select create_time, id from status where user_id=%s and category=%s
                     order by """ + order + """ limit %s,%s""" 
             cursor = db_conn.execute(sql, (user_id, cate, start, limit))
         else:
-            sql = """select id from status where user_id=%s and category!=%s
+            sql = """select create_time, id from status where user_id=%s and category!=%s
                     order by """ + order + """ limit %s,%s""" 
             cursor = db_conn.execute(sql, (user_id, config.CATE_DOUBAN_NOTE, start, limit))
         rows = cursor.fetchall()
         cursor and cursor.close()
-        return [x[0] for x in rows]
+        return [(x[0], x[1]) for x in rows]
 
     @classmethod
     def get_ids_by_date(cls, user_id, start_date, end_date):
@@ -234,6 +293,20 @@ class Status(object):
         cursor and cursor.close()
         return [x[0] for x in rows]
 
+    @classmethod
+    def get_update_times_by_date(cls, user_id, start_date, end_date):
+        '''[(status_id, time of status, time of raw_status, update_time and privacy of note)],
+        anything changed in the statuses of the date range changes one of them'''
+        cursor = db_conn.execute('''select s.id, s.time, r.time, n.update_time, n.privacy
+                from status s left join raw_status r on r.status_id=s.id
+                left join note n on s.category=%s and n.id=s.origin_id
+                where s.user_id=%s and s.category!=%s and s.create_time>=%s and s.create_time<=%s
+                order by s.create_time desc''',
+                (config.CATE_THEPAST_NOTE, user_id, config.CATE_DOUBAN_NOTE, start_date, end_date))
+        rows = cursor.fetchall()
+        cursor and cursor.close()
+        return rows
+
     @classmethod
     def gets(cls, ids):
         return [cls.get(x) for x in ids]
@@ -510,7 +583,7 @@ class TaskQueue(object):
         
 ## functions
 def get_all_text_by_user(user_id, limit=1000):
-    text = ""
+    text = []
     status_ids = Status.get_ids(user_id, limit=limit)
     for s in Status.gets(status_ids):
         try:
@@ -523,26 +596,44 @@ def get_all_text_by_user(user_id, limit=1000):
                     _t += retweeted_data
                 else:
                     _t += retweeted_data.get_content()
-            text += _t
+            text.append(_t)
         except Exception, e:
             print e
-    return text
+    return "".join(text)
 
-@cache("sids:{user_id}:{now}", expire=3600*24)
+@cache("sids:{user_id}:{now}", expire=3600*24, ns="status_date:user:{user_id}")
 def get_status_ids_yesterday(user_id, now):
     s = (now - datetime.timedelta(days=1)).strftime("%Y-%m-%d")
     e = now.strftime("%Y-%m-%d")
     ids = Status.get_ids_by_date(user_id, s, e)
     return ids
 
-@cache("sids_today_in_history:{user_id}:{now}", expire=3600*24)
-def get_status_ids_today_in_history(user_id, now):
+def _dates_of_today_in_history(now):
     years = range(now.year-1, 2005, -1)
-    dates = [("%s-%s" %(y,now.strftime("%m-%d")), 
+    return [("%s-%s" %(y,now.strftime("%m-%d")), 
         "%s-%s" %(y,(now+datetime.timedelta(days=1)).strftime("%m-%d"))) for y in years]
+
+@cache("sids_today_in_history:{user_id}:{now}", expire=3600*24, 
+        ns="status_date:user:{user_id}")
+def get_status_ids_today_in_history(user_id, now):
+    dates = _dates_of_today_in_history(now)
     ids = [Status.get_ids_by_date(user_id, d[0], d[1]) for d in dates]
     r =[]
     for x in ids:
         r.extend(x)
     return r
 
+def get_user_ids_with_status_today_in_history(now):
+    '''set of the users who has statuses on this day in the past years, 
+    one query over idx_create_time instead of asking every user'''
+    dates = _dates_of_today_in_history(now)
+    where = " or ".join(["(create_time>=%s and create_time<=%s)"] * len(dates))
+    args = [config.CATE_DOUBAN_NOTE]
+    for d in dates:
+        args.extend(d)
+    cursor = db_conn.execute('''select distinct user_id from status 
+            where category!=%s and (''' + where + ''')''', tuple(args))
+    rows = cursor.fetchall()
+    cursor and cursor.close()
+    return set(str(row[0]) for row in rows)
+
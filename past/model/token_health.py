@@ -0,0 +1,89 @@
+#-*- coding:utf-8 -*-
+# 第三方授权的状态, (user_id, provider)一行
+# 以前记在profile的json里, 找出过期的用户要把所有人的profile都解一遍
+
+import datetime
+from MySQLdb import IntegrityError
+from past.corelib.cache import cache
+from past.store import mc, db_conn
+
+def _to_text(msg):
+    ## 第三方返回的msg常常是中文unicode, 也有utf8的str和异常对象, 
+    ## str()会抛UnicodeEncodeError
+    if isinstance(msg, unicode):
+        return msg
+    if isinstance(msg, str):
+        return msg.decode("utf8", "replace")
+    try:
+        return unicode(msg)
+    except UnicodeError:
+        return str(msg).decode("utf8", "replace")
+
+class TokenHealth(object):
+    OK = "ok"
+
+    def __init__(self, user_id, provider, status, msg, since, time):
+        self.user_id = str(user_id)
+        self.provider = provider
+        self.status = status
+        self.msg = msg
+        self.since = since
+        self.time = time
+
+    def __repr__(self):
+        return "<TokenHealth user_id=%s, provider=%s, status=%s, since=%s>" \
+                % (self.user_id, self.provider, self.status, self.since)
+    __str__ = __repr__
+
+    @classmethod
+    def _clear_cache(cls, user_id):
+        mc.delete("token_health:u%s" % user_id)
+
+    @classmethod
+    @cache("token_health:u{user_id}")
+    def gets_by_user(cls, user_id):
+        cursor = db_conn.execute('''select user_id, provider, status, msg, since, time 
+                from token_health where user_id=%s''', user_id)
+        rows = cursor.fetchall()
+        cursor and cursor.close()
+        return [cls(*row) for row in rows]
+
+    @classmethod
+    def get(cls, user_id, provider):
+        for x in cls.gets_by_user(user_id):
+            if x.provider == provider:
+                return x
+
+    @classmethod
+    def gets_by_status(cls, status, provider=None):
+        if provider:
+            cursor = db_conn.execute('''select user_id, provider, status, msg, since, time 
+                    from token_health where status=%s and provider=%s''', (status, provider))
+        else:
+            cursor = db_conn.execute('''select user_id, provider, status, msg, since, time 
+                    from token_health where status=%s''', status)
+        rows = cursor.fetchall()
+        cursor and cursor.close()
+        return [cls(*row) for row in rows]
+
+    @classmethod
+    def set_status(cls, user_id, provider, status, msg="", flush=False):
+        '''since is kept while the status is not changed, unless flush'''
+        old = cls.get(user_id, provider)
+        ## 每次api调用成功都会来设置ok, 绝大多数时候没有变化, 不用写库
+        current = old.status if old else cls.OK
+        if current == status and not flush:
+            return
+        since = datetime.datetime.now()
+
+        cursor = None
+        try:
+            cursor = db_conn.execute('''replace into token_health 
+                    (user_id, provider, status, msg, since) values (%s,%s,%s,%s,%s)''',
+                    (user_id, provider, status, _to_text(msg or "")[:255], since))
+            db_conn.commit()
+            cls._clear_cache(user_id)
+        except IntegrityError:
+            db_conn.rollback()
+        finally:
+            cursor and cursor.close()
@@ -1,12 +1,13 @@
 #-*- coding:utf-8 -*-
 
 import re
+import datetime
 from MySQLdb import IntegrityError
 from past.corelib.cache import cache, pcache
 from past.store import mc, db_conn
 from past.utils import randbytes
 from past.utils.escape import json_decode, json_encode
-from .kv import Kv, UserProfile
+from .kv import Kv, UserProfile, UserProfileItem
 from past import config
 
 class User(object):
@@ -31,6 +32,7 @@ class User(object):
         if user_id:
             mc.delete("user:%s" % user_id)
             UserProfile.clear_cache(user_id)
+            UserProfileItem.clear_cache(user_id)
         mc.delete("user:ids")
         
     @classmethod
@@ -100,6 +102,72 @@ class User(object):
         cursor and cursor.close()
         return [x[0] for x in rows]
 
+    @classmethod
+    def iter_mail_recipients(cls, user_ids=None, after_id=0, batch_size=500):
+        '''yields (user_id, email, name) of the users who has an email and 
+        does not turn off the mails, ordered by user_id, batch_size users a query;
+        user_ids: only these users'''
+        key = "email_remind_today_in_history"
+        if user_ids is not None:
+            user_ids = sorted(int(x) for x in user_ids if int(x) > after_id)
+        last_id = after_id
+        while True:
+            if user_ids is None:
+                cursor = db_conn.execute('''select u.id, p.email, u.name, upi.value from user u 
+                        join passwd p on p.user_id=u.id 
+                        left join user_profile_item upi on upi.user_id=u.id and upi.`key`=%s
+                        where u.id>%s and p.email!='' order by u.id limit %s''', 
+                        (key, last_id, batch_size))
+            else:
+                batch = user_ids[:batch_size]
+                user_ids = user_ids[batch_size:]
+                if not batch:
+                    break
+                cursor = db_conn.execute('''select u.id, p.email, u.name, upi.value from user u 
+                        join passwd p on p.user_id=u.id 
+                        left join user_profile_item upi on upi.user_id=u.id and upi.`key`=%%s
+                        where u.id in (%s) and p.email!='' order by u.id''' 
+                        % ",".join(["%s"] * len(batch)), tuple([key] + batch))
+            rows = cursor.fetchall()
+            cursor and cursor.close()
+            if not rows and user_ids is None:
+                break
+
+            ## 只有还没拆到user_profile_item的老用户才去解user_profile的json
+            legacy = cls._get_legacy_profile_item([x[0] for x in rows if x[3] is None], key)
+            for user_id, email, name, remind in rows:
+                last_id = user_id
+                if remind is None:
+                    remind = legacy.get(user_id)
+                else:
+                    try:
+                        remind = json_decode(remind)
+                    except ValueError:
+                        remind = None
+                if remind == 'N':
+                    continue
+                yield str(user_id), email, name
+
+    @classmethod
+    def _get_legacy_profile_item(cls, user_ids, key):
+        '''{user_id: value} of key in the json of user_profile, for the users
+        not split into user_profile_item yet'''
+        if not user_ids:
+            return {}
+        cursor = db_conn.execute('''select user_id, profile from user_profile 
+                where user_id in (%s)''' % ",".join(["%s"] * len(user_ids)), tuple(user_ids))
+        rows = cursor.fetchall()
+        cursor and cursor.close()
+        r = {}
+        for user_id, profile in rows:
+            try:
+                p = json_decode(profile) if profile else {}
+            except ValueError:
+                continue
+            if isinstance(p, dict) and key in p:
+                r[user_id] = p[key]
+        return r
+
     def get_alias(self):
         return UserAlias.gets_by_user_id(self.id)
     
@@ -200,22 +268,54 @@ class User(object):
             
 
     def set_profile(self, profile):
-        UserProfile.set(self.id, json_encode(profile))
+        '''replace the whole profile, the items not in profile are removed'''
+        items = UserProfileItem.flatten(profile)
+        if not UserProfileItem.set(self.id, items):
+            return self.get_profile()
+        UserProfileItem.remove_keys(self.id, 
+                [k for k in UserProfileItem.gets(self.id) if k not in items])
+        ## 老的json也不要了, 不然删掉的项又从那里合并回来
+        UserProfile.remove(self.id)
         return self.get_profile()
 
     def get_profile(self):
+        ## 没有搬到user_profile_item的老数据还在user_profile的json里, 以一行一项的为准
         r = UserProfile.get(self.id)
         p = r.val if r else ""
         try:
-            return json_decode(p) if p else {}
+            p = json_decode(p) if p else {}
         except ValueError, e:
             print '------decode profile fail:', e
-            return {}
+            p = {}
+
+        items = UserProfileItem.gets(self.id)
+        for k, v in items.iteritems():
+            if ":" not in k:
+                p[k] = v
+        for k, v in items.iteritems():
+            if ":" in k:
+                openid_type, k_ = k.split(":", 1)
+                x = p.get(openid_type)
+                if not isinstance(x, dict):
+                    try:
+                        x = json_decode(x) if x else {}
+                    except ValueError:
+                        x = {}
+                x[k_] = v
+                p[openid_type] = x
+        return p
+
+    def update_profile(self, items=None, thirdparty=None):
+        '''items: {k: v}, thirdparty: {openid_type: {k: v}}, only the changed
+        ones are written, in one statement'''
+        d = dict(items or {})
+        for openid_type, x in (thirdparty or {}).iteritems():
+            for k, v in x.iteritems():
+                d["%s:%s" % (openid_type, k)] = v
+        UserProfileItem.set(self.id, d)
     
     def set_profile_item(self, k, v):
-        p = self.get_profile()
-        p[k] = v
-        self.set_profile(p)
+        self.update_profile({k: v})
         return self.get_profile()
 
     def get_profile_item(self, k):
@@ -232,9 +332,11 @@ class User(object):
             return r
 
     def set_thirdparty_profile_item(self, openid_type, k, v):
-        p = self.get_thirdparty_profile(openid_type)
-        p[k] = v
-        self.set_profile_item(openid_type, p)
+        self.update_profile(thirdparty={openid_type: {k: v}})
+
+    def set_thirdparty_profile_items(self, items):
+        '''items: {openid_type: {k: v}}'''
+        self.update_profile(thirdparty=items)
         
     def get_avatar_url(self):
         return self.get_profile().get("avatar_url", "")
@@ -402,32 +504,37 @@ class UserAlias(object):
 
 class OAuth2Token(object):
    
-    def __init__(self, alias_id, access_token, refresh_token):
+    def __init__(self, alias_id, access_token, refresh_token, expire_time=None):
         self.alias_id = alias_id
         self.access_token = access_token
         self.refresh_token = refresh_token
+        self.expire_time = expire_time
 
     @classmethod
     def get(cls, alias_id):
         ot = None
-        cursor = db_conn.execute("""select access_token, refresh_token  
+        cursor = db_conn.execute("""select access_token, refresh_token, expire_time  
                 from oauth2_token where alias_id=%s order by time desc limit 1""", 
                 (alias_id,))
         row = cursor.fetchone()
         if row:
-            ot = cls(alias_id, row[0], row[1])
+            ot = cls(alias_id, row[0], row[1], row[2])
         cursor and cursor.close()
         return ot
 
     @classmethod
-    def add(cls, alias_id, access_token, refresh_token):
+    def add(cls, alias_id, access_token, refresh_token, expires_in=None):
+        ## expires_in是第三方返回的秒数, 没有的话过期时间就是未知的
+        expire_time = None
+        if expires_in:
+            expire_time = datetime.datetime.now() + datetime.timedelta(seconds=int(expires_in))
         ot = None
         cursor = None
         try:
             cursor = db_conn.execute("""replace into oauth2_token 
-                    (alias_id, access_token, refresh_token)
-                    values (%s, %s, %s)""", 
-                    (alias_id, access_token, refresh_token))
+                    (alias_id, access_token, refresh_token, expire_time)
+                    values (%s, %s, %s, %s)""", 
+                    (alias_id, access_token, refresh_token, expire_time))
             db_conn.commit()
             ot = cls.get(alias_id)
         except IntegrityError:
@@ -437,6 +544,25 @@ class OAuth2Token(object):
 
         return ot
 
+    @classmethod
+    def get_expiring(cls, types, expire_before, unknown_before, after_alias_id=0, limit=200):
+        '''[(alias_id, type, user_id, expire_time)] of the tokens of types which
+        expire before expire_before, or were saved before unknown_before without
+        an expire_time. the tokens marked expired already are left out'''
+        if not types:
+            return []
+        cursor = db_conn.execute("""select t.alias_id, a.type, a.user_id, t.expire_time 
+                from oauth2_token t join user_alias a on a.id=t.alias_id
+                left join token_health h on h.user_id=a.user_id and h.provider=a.type
+                where t.alias_id>%s and a.type in (""" + ",".join(["%s"] * len(types)) + """)
+                and t.refresh_token!='' and (h.status is null or h.status!='expired')
+                and (t.expire_time<%s or (t.expire_time is null and t.time<%s))
+                order by t.alias_id limit %s""", 
+                tuple([after_alias_id] + list(types) + [expire_before, unknown_before, limit]))
+        rows = cursor.fetchall()
+        cursor and cursor.close()
+        return rows
+
 
 class Confirmation(object):
     def __init__(self, random_id, text, time):
@@ -523,3 +649,71 @@ class PdfSettings(object):
         db_conn.commit()
         cls._clear_cache(user_id)
 
+## 生成了的pdf, 一卷一行, 由generate_pdf维护, pdf页面不用再一个月一个月地stat文件
+class PdfFile(object):
+    def __init__(self, user_id, month, volume, filename, size, digest, time):
+        self.user_id = str(user_id)
+        self.month = month
+        self.volume = volume
+        self.filename = filename
+        self.size = size
+        self.digest = digest
+        self.time = time
+
+    @classmethod
+    def _clear_cache(cls, user_id):
+        mc.delete("pdf_file:u%s" % user_id)
+
+    @classmethod
+    @cache("pdf_file:u{user_id}")
+    def gets_by_user(cls, user_id):
+        cursor = db_conn.execute('''select user_id, month, volume, filename, size, digest, time
+                from pdf_file where user_id=%s order by month, volume''', user_id)
+        rows = cursor.fetchall()
+        cursor and cursor.close()
+        return [cls(*row) for row in rows]
+
+    @classmethod
+    def get_digest(cls, user_id, month):
+        '''None if the month is not indexed'''
+        cursor = db_conn.execute('''select digest from pdf_file 
+                where user_id=%s and month=%s and volume=1''', (user_id, month))
+        row = cursor.fetchone()
+        cursor and cursor.close()
+        return row and row[0]
+
+    @classmethod
+    def set_month(cls, user_id, month, volumes, digest):
+        '''volumes: [(filename, size)] in order'''
+        cursor = None
+        try:
+            cursor = db_conn.execute('''delete from pdf_file where user_id=%s and month=%s''',
+                    (user_id, month))
+            for i, (filename, size) in enumerate(volumes):
+                cursor and cursor.close()
+                cursor = db_conn.execute('''insert into pdf_file 
+                        (user_id, month, volume, filename, size, digest) 
+                        values (%s,%s,%s,%s,%s,%s)''',
+                        (user_id, month, i + 1, filename, size, digest))
+            db_conn.commit()
+            cls._clear_cache(user_id)
+        except IntegrityError:
+            db_conn.rollback()
+        finally:
+            cursor and cursor.close()
+
+    @classmethod
+    def remove_month(cls, user_id, month):
+        cursor = db_conn.execute('''delete from pdf_file where user_id=%s and month=%s''',
+                (user_id, month))
+        db_conn.commit()
+        cursor and cursor.close()
+        cls._clear_cache(user_id)
+
+    @classmethod
+    def remove_by_user(cls, user_id):
+        cursor = db_conn.execute('''delete from pdf_file where user_id=%s''', user_id)
+        db_conn.commit()
+        cursor and cursor.close()
+        cls._clear_cache(user_id)
+
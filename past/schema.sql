@@ -42,9 +42,11 @@ CREATE TABLE `oauth2_token` (
   `alias_id` int(11) unsigned NOT NULL,
   `access_token` varchar(128) NOT NULL DEFAULT '',
   `refresh_token` varchar(128) NOT NULL DEFAULT '',
+  `expire_time` timestamp NULL DEFAULT NULL,
   `time` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
   PRIMARY KEY (`id`),
-  UNIQUE KEY `idx_alias_id` (`alias_id`)
+  UNIQUE KEY `idx_alias_id` (`alias_id`),
+  KEY `idx_expire_time` (`expire_time`)
 ) ENGINE=InnoDB AUTO_INCREMENT=1748 DEFAULT CHARSET=utf8 COMMENT='oauth2_token';
 /*!40101 SET character_set_client = @saved_cs_client */;
 
@@ -156,6 +158,17 @@ CREATE TABLE `pdf_settings` (
   PRIMARY KEY (`user_id`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8 COMMENT='pdf_settings';
 
+CREATE TABLE `pdf_file` (
+  `user_id` int(11) unsigned NOT NULL,
+  `month` char(6) NOT NULL,
+  `volume` smallint(4) unsigned NOT NULL DEFAULT '1',
+  `filename` varchar(128) NOT NULL,
+  `size` int(11) unsigned NOT NULL DEFAULT '0',
+  `digest` char(32) NOT NULL DEFAULT '',
+  `time` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`user_id`,`month`,`volume`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8 COMMENT='pdf_file';
+
 --
 -- Table structure for table `user_alias`
 --
@@ -183,6 +196,47 @@ CREATE TABLE `user_alias` (
 /*!40101 SET COLLATION_CONNECTION=@OLD_COLLATION_CONNECTION */;
 /*!40111 SET SQL_NOTES=@OLD_SQL_NOTES */;
 
+CREATE TABLE `kv` (
+  `key` varchar(128) NOT NULL,
+  `value` mediumtext NOT NULL,
+  `time` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`key`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8 COMMENT='kv';
+
+CREATE TABLE `user_profile` (
+  `user_id` int(11) unsigned NOT NULL,
+  `profile` text NOT NULL,
+  `time` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`user_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8 COMMENT='user_profile';
+
+CREATE TABLE `user_profile_item` (
+  `user_id` int(11) unsigned NOT NULL,
+  `key` varchar(64) NOT NULL,
+  `value` text NOT NULL,
+  `time` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`user_id`,`key`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8 COMMENT='user_profile_item';
+
+CREATE TABLE `raw_status` (
+  `status_id` int(11) unsigned NOT NULL,
+  `text` mediumtext NOT NULL,
+  `raw` mediumtext NOT NULL,
+  `time` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`status_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8 COMMENT='raw_status';
+
+CREATE TABLE `token_health` (
+  `user_id` int(11) unsigned NOT NULL,
+  `provider` varchar(2) NOT NULL,
+  `status` varchar(16) NOT NULL DEFAULT 'ok',
+  `msg` varchar(255) NOT NULL DEFAULT '',
+  `since` timestamp NOT NULL DEFAULT '0000-00-00 00:00:00',
+  `time` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`user_id`,`provider`),
+  KEY `idx_status` (`status`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8 COMMENT='token_health';
+
 CREATE TABLE `user_tokens` (
   `id` int(11) unsigned NOT NULL AUTO_INCREMENT,
   `user_id` int(11) unsigned NOT NULL,
@@ -3,12 +3,20 @@
 import os
 import commands
 import datetime
+import time
+import bisect
+import hashlib
+import struct
+import contextlib
+import threading
+from collections import defaultdict
 
 import MySQLdb
 import redis
 import memcache
 
 from past.utils.escape import json_decode, json_encode
+from past.utils import profile
 from past import config 
 
 def init_db():
@@ -84,7 +92,33 @@ class MongoDB(object):
 class DB(object):
     
     def __init__(self):
-        self._conn = connect_db()
+        self._local = threading.local()
+        self._shared_conn = connect_db()
+
+    ## 默认大家用同一个连接; 在own_connection()里的线程用自己的连接,
+    ## 它的commit/rollback不会落到别人的事务里
+    def _get_conn(self):
+        if getattr(self._local, "own", False):
+            return self._local.conn
+        return self._shared_conn
+
+    def _set_conn(self, conn):
+        if getattr(self._local, "own", False):
+            self._local.conn = conn
+        else:
+            self._shared_conn = conn
+    _conn = property(_get_conn, _set_conn)
+
+    @contextlib.contextmanager
+    def own_connection(self):
+        self._local.own = True
+        self._local.conn = connect_db()
+        try:
+            yield self._local.conn
+        finally:
+            conn, self._local.conn = self._local.conn, None
+            self._local.own = False
+            conn and conn.close()
 
     def connect(self):
         self._conn = connect_db()
@@ -92,6 +126,7 @@ class DB(object):
 
     def execute(self, *a, **kw):
         cursor = kw.pop('cursor', None)
+        t = time.time()
         try:
             cursor = cursor or self._conn.cursor()
             cursor.execute(*a, **kw)
@@ -101,6 +136,8 @@ class DB(object):
             self.connect()
             cursor = self._conn.cursor()
             cursor.execute(*a, **kw)
+        finally:
+            profile.record_sql(a and a[0], time.time() - t)
         return cursor
         
     def commit(self):
@@ -109,11 +146,251 @@ class DB(object):
     def rollback(self):
         return self._conn and self._conn.rollback()
 
+class HashRingClient(object):
+    """memcached client over several nodes. keys are placed on a ketama-style
+    consistent hash ring, adding or removing a node only moves about 1/n of
+    the keys. a node failing failure_limit times in a row is ejected from
+    the ring for eject_time seconds, its keys go to the next nodes meanwhile.
+    an ejected node is flushed before it is back, what it holds is stale by then.
+    the copies written to the next nodes meanwhile expire in fallback_expire
+    seconds, they are stale after the node is back, and would be read again
+    when it is ejected the next time.
+    the ring state is shared by the threads of the process, guarded by lock.
+    """
+
+    POINTS_PER_WEIGHT = 40
+
+    def __init__(self, servers, failure_limit=3, eject_time=30, fallback_expire=30, **kw):
+        self.failure_limit = failure_limit
+        self.eject_time = eject_time
+        self.fallback_expire = fallback_expire
+        self.weights = {}
+        self.nodes = {}
+        for s in servers:
+            if isinstance(s, tuple):
+                s, weight = s
+            else:
+                weight = 1
+            self.weights[s] = weight
+            self.nodes[s] = memcache.Client([s], **kw)
+        self.failures = defaultdict(int)
+        self.ejected = {}
+        self.lock = threading.Lock()
+        ## 所有节点都在时的ring, 用来判断key是不是写到了替补的节点上
+        self._full_ring = self._make_ring(self.weights.keys())
+        self._build_ring()
+
+    def _build_ring(self):
+        ## points和nodes一起换, 别的线程不会拿到对不上的
+        self._ring = self._make_ring([n for n in self.weights if n not in self.ejected])
+
+    def _make_ring(self, nodes):
+        ring = []
+        for node in nodes:
+            weight = self.weights[node]
+            for i in xrange(self.POINTS_PER_WEIGHT * weight):
+                d = hashlib.md5("%s-%s" % (node, i)).digest()
+                for j in xrange(4):
+                    ring.append((struct.unpack("<I", d[j*4:j*4+4])[0], node))
+        ring.sort()
+        return ([x[0] for x in ring], [x[1] for x in ring])
+
+    def _hash(self, key):
+        return struct.unpack("<I", hashlib.md5(key).digest()[:4])[0]
+
+    def get_node(self, key):
+        now = time.time()
+        if any(t <= now for t in self.ejected.values()):
+            self._rejoin(now)
+        return self._lookup(self._ring, key)
+
+    def _lookup(self, ring, key):
+        points, nodes = ring
+        if not points:
+            return None
+        i = bisect.bisect(points, self._hash(key)) % len(points)
+        return nodes[i]
+
+    def _expire(self, key, time):
+        ## 本来的节点被踢出去了, 写到替补节点上的不能久留
+        if self.ejected and self._lookup(self._full_ring, key) in self.ejected:
+            if not time or time > self.fallback_expire:
+                return self.fallback_expire
+        return time
+
+    def _is_dead(self, node):
+        ## python-memcached does not raise, it marks the host dead instead
+        return any(h.deaduntil > time.time() for h in self.nodes[node].servers)
+
+    def _rejoin(self, now):
+        with self.lock:
+            back = [n for n, t in self.ejected.iteritems() if t <= now]
+            ## flush的时候先往后推一个eject_time, 别的线程不会再来flush, 也不会用到它
+            for n in back:
+                self.ejected[n] = now + self.eject_time
+        if not back:
+            return
+
+        ## 踢出去的这段时间它上面的key(包括ns:的版本号)都没再更新过,
+        ## 清空了再回来, 不然会读到旧的. 网络调用不能拿着锁
+        alive = []
+        for n in back:
+            self.nodes[n].flush_all()
+            if not self._is_dead(n):
+                alive.append(n)
+
+        with self.lock:
+            for n in alive:
+                print 'debug, %s memcached node %s back to ring' % (datetime.datetime.now(), n)
+                self.ejected.pop(n, None)
+                self.failures[n] = 0
+            if alive:
+                self._build_ring()
+
+    def _check_node(self, node):
+        dead = self._is_dead(node)
+        with self.lock:
+            if not dead:
+                self.failures[node] = 0
+                return
+            self.failures[node] += 1
+            if self.failures[node] >= self.failure_limit and node not in self.ejected:
+                print 'debug, %s memcached node %s ejected' % (datetime.datetime.now(), node)
+                self.ejected[node] = time.time() + self.eject_time
+                self._build_ring()
+
+    def _call(self, method, key, *a, **kw):
+        node = self.get_node(key)
+        if not node:
+            return None
+        r = getattr(self.nodes[node], method)(key, *a, **kw)
+        self._check_node(node)
+        return r
+
+    def get(self, key):
+        return self._call("get", key)
+
+    def gets(self, key):
+        return self._call("gets", key)
+
+    def set(self, key, val, time=0):
+        return self._call("set", key, val, self._expire(key, time))
+
+    def add(self, key, val, time=0):
+        return self._call("add", key, val, self._expire(key, time))
+
+    def replace(self, key, val, time=0):
+        return self._call("replace", key, val, self._expire(key, time))
+
+    def cas(self, key, val, time=0):
+        return self._call("cas", key, val, self._expire(key, time))
+
+    def delete(self, key, time=0):
+        return self._call("delete", key, time)
+
+    def incr(self, key, delta=1):
+        return self._call("incr", key, delta)
+
+    def decr(self, key, delta=1):
+        return self._call("decr", key, delta)
+
+    def _group_by_node(self, keys, key_prefix=''):
+        r = defaultdict(list)
+        for k in keys:
+            node = self.get_node(key_prefix + k)
+            if node:
+                r[node].append(k)
+        return r
+
+    def get_multi(self, keys, key_prefix=''):
+        r = {}
+        for node, keys_ in self._group_by_node(keys, key_prefix).iteritems():
+            r.update(self.nodes[node].get_multi(keys_, key_prefix=key_prefix))
+            self._check_node(node)
+        return r
+
+    def set_multi(self, mapping, time=0, key_prefix=''):
+        failed = []
+        for node, keys_ in self._group_by_node(mapping.keys(), key_prefix).iteritems():
+            by_expire = defaultdict(list)
+            for k in keys_:
+                by_expire[self._expire(key_prefix + k, time)].append(k)
+            for t, ks in by_expire.iteritems():
+                failed.extend(self.nodes[node].set_multi(dict((k, mapping[k]) for k in ks),
+                        t, key_prefix=key_prefix))
+            self._check_node(node)
+        return failed
+
+    def delete_multi(self, keys, time=0, key_prefix=''):
+        r = 1
+        for node, keys_ in self._group_by_node(keys, key_prefix).iteritems():
+            r &= self.nodes[node].delete_multi(keys_, time, key_prefix=key_prefix)
+            self._check_node(node)
+        return r
+
+    def reset_cas(self):
+        for c in self.nodes.itervalues():
+            c.reset_cas()
+
+    def disconnect_all(self):
+        for c in self.nodes.itervalues():
+            c.disconnect_all()
+
+    def get_stats(self):
+        r = []
+        for c in self.nodes.itervalues():
+            r.extend(c.get_stats())
+        return r
+
+class TracedClient(object):
+    """mc client wrapper, records the round trips into the profile of
+    the current request"""
+
+    TRACED = frozenset(["get", "gets", "get_multi", "set", "add", "replace", "cas",
+            "delete", "incr", "decr", "set_multi", "delete_multi"])
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name not in self.TRACED:
+            return attr
+        def _(*a, **kw):
+            if not profile.current():
+                return attr(*a, **kw)
+            t = time.time()
+            try:
+                return attr(*a, **kw)
+            finally:
+                profile.record_mc(name, time.time() - t)
+        return _
+
 def connect_memcached():
-    mc = memcache.Client(['%s:%s' % (config.MEMCACHED_HOST, config.MEMCACHED_PORT)], debug=0)
-    return mc
+    servers = config.MEMCACHED_SERVERS or \
+            ['%s:%s' % (config.MEMCACHED_HOST, config.MEMCACHED_PORT)]
+    ## cache_cas: gets/cas are used to update cached lists in place,
+    ## the callers reset_cas() after each update, or cas_ids keeps growing
+    if len(servers) == 1:
+        mc = memcache.Client(servers, debug=0, cache_cas=True)
+    else:
+        mc = HashRingClient(servers, 
+                failure_limit=config.MEMCACHED_FAILURE_LIMIT,
+                eject_time=config.MEMCACHED_EJECT_TIME,
+                fallback_expire=config.MEMCACHED_FALLBACK_EXPIRE,
+                debug=0, cache_cas=True, dead_retry=config.MEMCACHED_EJECT_TIME)
+    return TracedClient(mc)
+
+def create_store():
+    ## PAST_STORE_FACTORY=module:callable, returns (db_conn, mc), 
+    ## bench/ runs the models on local stand-ins with it
+    factory = os.environ.get("PAST_STORE_FACTORY")
+    if factory:
+        module, name = factory.split(":")
+        return getattr(__import__(module, fromlist=[name]), name)()
+    return DB(), connect_memcached()
 
-db_conn = DB()
-mc = redis_cache_conn = connect_memcached()
+db_conn, mc = create_store()
+redis_cache_conn = mc
 #redis_conn = connect_redis()
 #mongo_conn = MongoDB()
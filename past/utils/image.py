@@ -0,0 +1,466 @@
+#-*- coding:utf-8 -*-
+
+## 生成pdf前把图片并发拉到 config.CACHE_DIR, pisa的link_callback只读本地文件
+
+import os
+import re
+import time
+import fcntl
+import Queue
+import urllib2
+import hashlib
+import urlparse
+import threading
+try:
+    import cStringIO as StringIO
+except ImportError:
+    import StringIO
+try:
+    from PIL import Image
+except ImportError:
+    try:
+        import Image
+    except ImportError:
+        Image = None
+
+from past.utils import is_valid_image, randbytes
+from past.utils.logger import logging
+from past import config
+
+log = logging.getLogger(__file__)
+
+IMG_SRC_RE = re.compile(r'''<img[^>]+src\s*=\s*["']([^"']+)["']''', re.I)
+
+def collect_image_urls(html):
+    urls = []
+    seen = set()
+    for x in IMG_SRC_RE.findall(html or ""):
+        if x not in seen and is_fetchable(x):
+            seen.add(x)
+            urls.append(x)
+    return urls
+
+def is_fetchable(uri):
+    lower_uri = uri.lower()
+    if not (lower_uri.startswith('http://') or
+            lower_uri.startswith('https://') or
+            lower_uri.startswith('ftp://')):
+        return False
+    if lower_uri.find(" ") != -1 or lower_uri.find("\n") != -1:
+        return False
+    if not (lower_uri.endswith(".jpg") or lower_uri.endswith(".jpeg")  or
+            lower_uri.endswith(".png")):
+        return False
+    return True
+
+class ImageCache(object):
+    '''the images under root, at most max_bytes, the least recently used
+    are removed first.
+
+    files are <md5[:2]>/<md5[:8]><basename>. what's there is kept in an
+    append only index file, one line per change:
+
+        A <time> <file> <size>      added
+        T <time> <file>             used
+        D <time> <file>             removed
+
+    so a lookup is a dict lookup, the index is only read again for the
+    files not known yet. several processes (the pdf workers) share the
+    cache: files are written to a temp file and renamed, lines are
+    appended under a shared flock, eviction rewrites the index under the
+    exclusive one.
+    '''
+
+    INDEX = "index"
+    ## 被使用的记录攒够这么多再写到index
+    TOUCH_BATCH = 100
+    ## 淘汰到预算的90%, 免得每加一张就淘汰一次
+    LOW_WATERMARK = 0.9
+
+    def __init__(self, root=None, max_bytes=None):
+        self.root = root or config.CACHE_DIR
+        self.max_bytes = max_bytes or config.IMAGE_CACHE_MAX_BYTES
+        self.index_file = os.path.join(self.root, self.INDEX)
+        self.lock_file = self.index_file + ".lock"
+
+        self.entries = {}
+        self.total_bytes = 0
+        self._ino = None
+        self._offset = 0
+        self._touched = {}
+        self._lock = threading.RLock()
+        self.stats = {"hits": 0, "misses": 0, "puts": 0, "evictions": 0,
+                "evicted_bytes": 0}
+
+    def get_file(self, uri):
+        if isinstance(uri, unicode):
+            uri = uri.encode("utf8")
+        d = hashlib.md5(uri).hexdigest()
+        return os.path.join(d[:2], d[0:8] + os.path.basename(urlparse.urlsplit(uri).path))
+
+    def get(self, uri):
+        '''the local file of uri, None if not cached'''
+        f = self.get_file(uri)
+        with self._lock:
+            if f not in self.entries:
+                self._refresh()
+            if f not in self.entries:
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits"] += 1
+            self._touched[f] = time.time()
+            if len(self._touched) >= self.TOUCH_BATCH:
+                self._flush_touched()
+        return os.path.join(self.root, f)
+
+    def put(self, uri, content):
+        '''returns the local file, None if content is not a valid image'''
+        f = self.get_file(uri)
+        full = os.path.join(self.root, f)
+        sub_dir = os.path.dirname(full)
+        if not os.path.isdir(sub_dir):
+            try:
+                os.makedirs(sub_dir)
+            except OSError:
+                ## 别的线程或进程刚建好
+                pass
+
+        ## 先写临时文件再rename, 读的人看不到写了一半的图片
+        tmp_file = "%s.%s.tmp" % (full, randbytes(6))
+        try:
+            with open(tmp_file, 'wb') as fp:
+                fp.write(content)
+            if not is_valid_image(tmp_file):
+                return None
+            os.rename(tmp_file, full)
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+        with self._lock:
+            self._append([("A", time.time(), f, len(content))])
+            self.stats["puts"] += 1
+            self._refresh()
+            over = self.total_bytes > self.max_bytes
+        if over:
+            self.evict()
+        return full
+
+    def flush(self):
+        with self._lock:
+            self._flush_touched()
+
+    def evict(self):
+        '''remove the least recently used files till under the budget'''
+        with self._lock:
+            self._flush_touched()
+            with self._flock(fcntl.LOCK_EX):
+                self._reset()
+                self._refresh()
+                if self.total_bytes <= self.max_bytes:
+                    return 0
+                target = self.max_bytes * self.LOW_WATERMARK
+                n = 0
+                for f, (size, t) in sorted(self.entries.items(), key=lambda x: x[1][1]):
+                    if self.total_bytes <= target:
+                        break
+                    try:
+                        os.remove(os.path.join(self.root, f))
+                    except OSError:
+                        pass
+                    del self.entries[f]
+                    self.total_bytes -= size
+                    self.stats["evictions"] += 1
+                    self.stats["evicted_bytes"] += size
+                    n += 1
+                self._rewrite()
+        log.info("image cache evicted %s files, %s bytes left" % (n, self.total_bytes))
+        return n
+
+    def rebuild(self):
+        '''index the files under root, for a cache without the index'''
+        with self._lock:
+            with self._flock(fcntl.LOCK_EX):
+                self._reset()
+                for d in os.listdir(self.root):
+                    sub_dir = os.path.join(self.root, d)
+                    if len(d) != 2 or not os.path.isdir(sub_dir):
+                        continue
+                    for x in os.listdir(sub_dir):
+                        if x.endswith(".tmp"):
+                            continue
+                        st = os.stat(os.path.join(sub_dir, x))
+                        if st.st_size > 0:
+                            self.entries[os.path.join(d, x)] = [st.st_size, st.st_mtime]
+                            self.total_bytes += st.st_size
+                self._rewrite()
+
+    def get_stats(self):
+        with self._lock:
+            self._refresh()
+            r = dict(self.stats)
+            r["files"] = len(self.entries)
+            r["bytes"] = self.total_bytes
+            r["max_bytes"] = self.max_bytes
+            return r
+
+    ## -- index, called with self._lock held --
+    def _flock(self, op):
+        return _FileLock(self.lock_file, op)
+
+    def _reset(self):
+        self.entries = {}
+        self.total_bytes = 0
+        self._ino = None
+        self._offset = 0
+
+    def _refresh(self):
+        ## 读进index里新加的行
+        try:
+            st = os.stat(self.index_file)
+        except OSError:
+            ## 以前没有index的cache
+            if os.path.isdir(self.root):
+                self.rebuild()
+            return
+        if st.st_ino != self._ino or st.st_size < self._offset:
+            ## 被别的进程重写了
+            self._reset()
+            self._ino = st.st_ino
+        if st.st_size == self._offset:
+            return
+        with open(self.index_file) as fp:
+            fp.seek(self._offset)
+            data = fp.read(st.st_size - self._offset)
+        ## 别的进程可能还没写完最后一行
+        data = data[:data.rfind("\n") + 1]
+        self._offset += len(data)
+        for line in data.splitlines():
+            self._apply(line.split("\t"))
+
+    def _apply(self, parts):
+        try:
+            op, t, f = parts[0], float(parts[1]), parts[2]
+            if op == "A":
+                size = int(parts[3])
+                old = self.entries.get(f)
+                if old:
+                    self.total_bytes -= old[0]
+                self.entries[f] = [size, t]
+                self.total_bytes += size
+            elif op == "T":
+                if f in self.entries:
+                    self.entries[f][1] = max(self.entries[f][1], t)
+            elif op == "D":
+                old = self.entries.pop(f, None)
+                if old:
+                    self.total_bytes -= old[0]
+        except (IndexError, ValueError):
+            pass
+
+    def _append(self, lines):
+        if not lines:
+            return
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+        data = "".join("\t".join(str(x) for x in line) + "\n" for line in lines)
+        with self._flock(fcntl.LOCK_SH):
+            with open(self.index_file, "a") as fp:
+                fp.write(data)
+
+    def _flush_touched(self):
+        lines = [("T", t, f) for f, t in self._touched.iteritems()]
+        self._touched = {}
+        self._append(lines)
+
+    def _rewrite(self):
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+        tmp_file = "%s.%s.tmp" % (self.index_file, randbytes(6))
+        with open(tmp_file, "w") as fp:
+            for f, (size, t) in self.entries.iteritems():
+                fp.write("A\t%s\t%s\t%s\n" % (t, f, size))
+        os.rename(tmp_file, self.index_file)
+        st = os.stat(self.index_file)
+        self._ino = st.st_ino
+        self._offset = st.st_size
+
+class _FileLock(object):
+
+    def __init__(self, path, op):
+        self.path = path
+        self.op = op
+        self.fp = None
+
+    def __enter__(self):
+        self.fp = open(self.path, "a")
+        fcntl.flock(self.fp.fileno(), self.op)
+        return self
+
+    def __exit__(self, *a):
+        fcntl.flock(self.fp.fileno(), fcntl.LOCK_UN)
+        self.fp.close()
+
+_cache = None
+_cache_pid = None
+
+def get_cache():
+    ## 每个进程一个
+    global _cache, _cache_pid
+    if _cache is None or _cache_pid != os.getpid():
+        _cache = ImageCache()
+        _cache_pid = os.getpid()
+    return _cache
+
+def get_cached(uri):
+    return get_cache().get(uri)
+
+def fetch(uri, timeout=None, max_size=None):
+    '''download uri into the cache, returns the local file or None'''
+    timeout = timeout or config.PDF_IMAGE_FETCH_TIMEOUT
+    max_size = max_size or config.PDF_IMAGE_MAX_SIZE
+
+    try:
+        resp = urllib2.urlopen(uri, timeout=timeout)
+        length = resp.info().get("content-length")
+        if length and int(length) > max_size:
+            log.warning("%s is too large: %s" % (uri, length))
+            return None
+        content = resp.read(max_size + 1)
+    except Exception, e:
+        log.warning("get %s fail: %s" % (uri, e))
+        return None
+    if len(content) > max_size:
+        log.warning("%s is larger than %s" % (uri, max_size))
+        return None
+
+    f = get_cache().put(uri, content)
+    if not f:
+        log.warning("%s is not a valid image" % uri)
+    return f
+
+def prefetch(urls, threads=None, per_host=None, timeout=None, max_size=None):
+    '''download the urls not cached yet, at most per_host at a time from the
+    same host. returns the stats'''
+    threads = threads or config.PDF_IMAGE_FETCH_THREADS
+    per_host = per_host or config.PDF_IMAGE_FETCH_PER_HOST
+
+    stats = {"urls": len(urls), "cached": 0, "fetched": 0, "failed": 0, "bytes": 0}
+    todo = []
+    for x in urls:
+        if get_cached(x):
+            stats["cached"] += 1
+        else:
+            todo.append(x)
+    if not todo:
+        stats["seconds"] = 0
+        return stats
+
+    t = time.time()
+    q = Queue.Queue()
+    for x in todo:
+        q.put(x)
+    hosts = {}
+    lock = threading.Lock()
+
+    def host_semaphore(uri):
+        host = urlparse.urlsplit(uri).netloc
+        with lock:
+            if host not in hosts:
+                hosts[host] = threading.Semaphore(per_host)
+            return hosts[host]
+
+    def worker():
+        while True:
+            try:
+                uri = q.get_nowait()
+            except Queue.Empty:
+                return
+            with host_semaphore(uri):
+                f = fetch(uri, timeout, max_size)
+            with lock:
+                if f:
+                    stats["fetched"] += 1
+                    stats["bytes"] += os.path.getsize(f)
+                else:
+                    stats["failed"] += 1
+
+    workers = [threading.Thread(target=worker) for i in xrange(min(threads, len(todo)))]
+    for x in workers:
+        x.setDaemon(True)
+        x.start()
+    for x in workers:
+        x.join()
+    stats["seconds"] = round(time.time() - t, 3)
+    return stats
+
+def get_normalized_key(uri, max_width=None, max_height=None):
+    return "%s#%sx%s" % (uri, max_width or config.PDF_IMAGE_MAX_WIDTH,
+            max_height or config.PDF_IMAGE_MAX_HEIGHT)
+
+def get_normalized(uri):
+    return get_cache().get(get_normalized_key(uri))
+
+def _pixel_bytes(im):
+    return im.size[0] * im.size[1] * len(im.getbands())
+
+def normalize(urls, max_width=None, max_height=None, quality=None):
+    '''downscale the cached images of urls to what the pdf shows and
+    recompress them, kept in the cache by (url, size). returns the stats,
+    pixel_bytes is about the memory pisa takes to decode the images'''
+    max_width = max_width or config.PDF_IMAGE_MAX_WIDTH
+    max_height = max_height or config.PDF_IMAGE_MAX_HEIGHT
+    quality = quality or config.PDF_IMAGE_QUALITY
+
+    stats = {"images": 0, "resized": 0, "cached": 0, "failed": 0,
+            "bytes_before": 0, "bytes_after": 0,
+            "pixel_bytes_before": 0, "pixel_bytes_after": 0}
+    if Image is None:
+        return stats
+
+    t = time.time()
+    cache = get_cache()
+    for uri in urls:
+        orig = cache.get(uri)
+        if not orig:
+            continue
+        key = get_normalized_key(uri, max_width, max_height)
+        try:
+            im = Image.open(orig)
+            stats["images"] += 1
+            stats["bytes_before"] += os.path.getsize(orig)
+            stats["pixel_bytes_before"] += _pixel_bytes(im)
+
+            f = cache.get(key)
+            if f:
+                stats["cached"] += 1
+                stats["bytes_after"] += os.path.getsize(f)
+                stats["pixel_bytes_after"] += _pixel_bytes(Image.open(f))
+                continue
+
+            fmt = im.format
+            if im.size[0] > max_width or im.size[1] > max_height:
+                im.thumbnail((max_width, max_height), Image.ANTIALIAS)
+                stats["resized"] += 1
+            out = StringIO.StringIO()
+            if fmt == "PNG":
+                im.save(out, "PNG", optimize=True)
+            else:
+                if im.mode not in ("RGB", "L"):
+                    im = im.convert("RGB")
+                im.save(out, "JPEG", quality=quality, optimize=True)
+            content = out.getvalue()
+
+            ## 没变小就还用原图
+            if len(content) >= os.path.getsize(orig) and im.size == Image.open(orig).size:
+                content = open(orig, "rb").read()
+            if cache.put(key, content):
+                stats["bytes_after"] += len(content)
+                stats["pixel_bytes_after"] += _pixel_bytes(im)
+            else:
+                stats["failed"] += 1
+        except Exception, e:
+            log.warning("normalize %s fail: %s" % (uri, e))
+            stats["failed"] += 1
+    stats["seconds"] = round(time.time() - t, 3)
+    return stats
@@ -1,20 +1,21 @@
 #-*- coding:utf-8 -*-
 
 import os
+import time
 import datetime
 import hashlib
-import urlparse
-import httplib2
+import tarfile
 try:
     import cStringIO as StringIO
 except ImportError:
     import StringIO
 
 from past import app
-from past.model.user import User
+from past.model.user import User, PdfFile
 from past.model.status import Status
-from past.utils import wrap_long_line, filters, randbytes, is_valid_image
-from past.utils.escape import clear_html_element
+from past.utils import randbytes, sizeof_fmt
+from past.utils import image
+from past.utils.template import get_template_module
 from past import config
 
 def generate_pdf(filename, uid, status_ids, with_head=True, capacity=50*1024):
@@ -41,9 +42,28 @@ def generate_pdf(filename, uid, status_ids, with_head=True, capacity=50*1024):
 
     # get status
     status_list = Status.gets(status_ids)
-    _html = render(user, status_list, with_head)
-    _pdf = pisaDocument(_html, result, default_css=css, link_callback=link_callback, capacity=capacity)
+    _html = render_to_buffer(user, status_list, with_head)
+    if not _html:
+        return None
+    urls = image.collect_image_urls(_html.getvalue())
+    stats = image.prefetch(urls)
+    embedded = stats["cached"] + stats["fetched"]
+    print '%s prefetch images of %s: %s' % (datetime.datetime.now(), filename, stats)
+    if config.PDF_IMAGE_NORMALIZE:
+        stats = image.normalize(urls)
+        print '%s normalize images of %s: %s, saved %s of file, %s of memory' % (
+                datetime.datetime.now(), filename, stats,
+                sizeof_fmt(stats["bytes_before"] - stats["bytes_after"]),
+                sizeof_fmt(stats["pixel_bytes_before"] - stats["pixel_bytes_after"]))
+    t = time.time()
+    _pdf = pisaDocument(_html, result, default_css=css, link_callback=link_callback,
+            capacity=capacity, encoding="utf-8")
     result.close()
+    print '%s render %s with %s %s images in %.1fs, %s' % (datetime.datetime.now(),
+            filename, embedded, "normalized" if config.PDF_IMAGE_NORMALIZE else "original",
+            time.time() - t, sizeof_fmt(os.path.getsize(full_file_name)))
+    image.get_cache().flush()
+    print '%s image cache: %s' % (datetime.datetime.now(), image.get_cache().get_stats())
 
     if not _pdf.err:
         return full_file_name
@@ -53,10 +73,26 @@ def generate_pdf(filename, uid, status_ids, with_head=True, capacity=50*1024):
 def render(user, status_list, with_head=True):
     if not status_list:
         return
+    return u"".join(render_chunks(user, status_list, with_head))
+
+def render_to_buffer(user, status_list, with_head=True):
+    '''the html utf8 encoded in a StringIO, pisa reads it as is, the whole
+    document is never held as one unicode string'''
+    if not status_list:
+        return
+    buf = StringIO.StringIO()
+    for x in render_chunks(user, status_list, with_head):
+        buf.write(x.encode("utf8"))
+    buf.seek(0)
+    return buf
+
+def render_chunks(user, status_list, with_head=True):
+    ## 一段一段地yield, 不再 _html += ..., 900条的时候那样拷贝太多次了
+    ## meta charset让html5lib直接按utf8读, 不去猜编码
     date = status_list[0].create_time.strftime("%Y年%m月")
     date = date.decode("utf8")
     if with_head:
-        _html = u"""<html> <body>
+        yield u"""<html> <head><meta charset="utf-8"/></head> <body>
             <div id="Top">
                 <img src="%s"/> &nbsp; &nbsp;&nbsp; The Past of Me | 个人杂志计划&nbsp;&nbsp;&nbsp;%s&nbsp;&nbsp;&nbsp;CopyRight©%s
                 <br/>
@@ -67,17 +103,9 @@ def render(user, status_list, with_head=True):
         """ % (os.path.join(app.root_path, "static/img/logo.png"), 
             date, user.name)
     else:
-        _html = u"""<html> <body><div class="box">"""
-
-    from jinja2 import Environment, PackageLoader
-    env = Environment(loader=PackageLoader('past', 'templates'))
-    env.filters['wrap_long_line'] = wrap_long_line
-    env.filters['nl2br'] = filters.nl2br
-    env.filters['stream_time'] = filters.stream_time
-    env.filters['clear_html_element'] = clear_html_element
-    env.filters['isstr'] = lambda x: isinstance(x, basestring)
-    t = env.get_template('status.html')
-    m = t.module
+        yield u"""<html> <head><meta charset="utf-8"/></head> <body><div class="box">"""
+
+    m = get_template_module('status.html')
     for s in status_list:
         if not s:
             continue
@@ -105,60 +133,21 @@ def render(user, status_list, with_head=True):
             r = ''
         if not r:
             continue
-        _html += '''<div class="cell">''' + r + '''</div>'''
+        yield u'''<div class="cell">'''
+        yield r
+        yield u'''</div>'''
         Status._clear_cache(user_id = s.user_id, status_id = s.id)
-    _html += """</div></body></html>"""
-    return _html
+    yield u"""</div></body></html>"""
 
 def link_callback(uri, rel):
     #FIXME: 为了节省磁盘空间，PDF中不包含图片
     #return ''
 
-    lower_uri = uri.lower()
-    print '%s getting %s' % (datetime.datetime.now(), uri)
-    if not (lower_uri.startswith('http://') or 
-            lower_uri.startswith('https://') or 
-            lower_uri.startswith('ftp://')):
-        return ''
-    if lower_uri.find(" ") != -1:
-        return ''
-
-    if lower_uri.find("\n") != -1:
-        return ''
-
-    if not (lower_uri.endswith(".jpg") or lower_uri.endswith(".jpeg")  or 
-            lower_uri.endswith(".png")):
-        return ''
-
-    d = hashlib.md5()
-    d.update(uri)
-    d = d.hexdigest()
-    _sub_dir = '%s/%s' % (config.CACHE_DIR, d[:2])
-
-    if not os.path.isdir(_sub_dir):
-        os.makedirs(_sub_dir)
-    if not (os.path.exists(_sub_dir) and os.path.isdir(_sub_dir)):
-        return uri
-
-    _filename = d[0:8] + os.path.basename(urlparse.urlsplit(uri).path)
-    cache_file = os.path.join(_sub_dir, _filename)
-
-    if os.path.exists(cache_file) and os.path.getsize(cache_file) > 0:
-        return cache_file
-    
-    resp, content = httplib2.Http().request(uri)
-    if resp.status == 200:
-        with open(cache_file, 'w') as f:
-            f.write(content)
-        if is_valid_image(cache_file):
-            return cache_file
-        else:
-            return ''
-    else:
-        print 'get %s fail, status_code is %s, so return none' % (uri,resp.status)
+    ## 图片在generate_pdf里已经prefetch过了，这里只读本地
+    if not image.is_fetchable(uri):
         return ''
-
-    return ''
+    return (config.PDF_IMAGE_NORMALIZE and image.get_normalized(uri)) \
+            or image.get_cached(uri) or ''
 
 def is_user_pdf_file_exists(uid, suffix=None, compressed=".tar.gz"):
     f = get_pdf_filename(uid, suffix, compressed)
@@ -170,6 +159,80 @@ def get_pdf_filename(uid, suffix=None, compressed=".tar.gz"):
     else:
         return "thepast.me_%s.pdf%s" % (uid, compressed)
 
+def get_pdf_volume_filename(uid, month, volume=1, compressed=".tar.gz"):
+    ## 一个月的status太多时分成几卷，第一卷还是原来的文件名
+    suffix = month if volume <= 1 else "%s-%s" % (month, volume)
+    return get_pdf_filename(uid, suffix, compressed)
+
+def get_pdf_volume_filenames(uid, month, compressed=".tar.gz"):
+    '''the existing volumes of the month, in order'''
+    r = []
+    volume = 1
+    while True:
+        f = get_pdf_volume_filename(uid, month, volume, compressed)
+        if not is_pdf_file_exists(f):
+            break
+        r.append(f)
+        volume += 1
+    return r
+
+def compress_pdf(filename, level=None):
+    '''pack thepast.me_xxx.pdf into thepast.me_xxx.pdf.tar.gz and remove it,
+    returns the compressed filename'''
+    level = level if level is not None else config.PDF_COMPRESS_LEVEL
+    full_file_name = get_pdf_full_filename(filename)
+    compressed = filename + ".tar.gz"
+    full_compressed = get_pdf_full_filename(compressed)
+
+    ## 先写临时文件再rename, 下载的人不会拿到写了一半的文件
+    tmp = "%s.%s.tmp" % (full_compressed, os.getpid())
+    try:
+        tar = tarfile.open(tmp, "w:gz", compresslevel=level)
+        try:
+            tar.add(full_file_name, arcname=filename)
+        finally:
+            tar.close()
+        os.rename(tmp, full_compressed)
+    except:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    os.remove(full_file_name)
+    return compressed
+
+def remove_pdf_volumes(uid, month, start_volume=1):
+    volume = start_volume
+    while True:
+        f = get_pdf_volume_filename(uid, month, volume)
+        if not is_pdf_file_exists(f):
+            break
+        os.remove(get_pdf_full_filename(f))
+        volume += 1
+
+## pdf生成时那个月的status的digest, 和文件一起记在pdf_file里
+## 补同步, 改了note, 改了隐私设置都会让digest变化, 只重新生成这些月份
+def get_pdf_digest(uid, start_date, end_date):
+    '''None if there is no status in the date range'''
+    rows = Status.get_update_times_by_date(uid, start_date, end_date)
+    if not rows:
+        return None
+    h = hashlib.md5()
+    for row in rows:
+        h.update("\t".join([str(x) for x in row]) + "\n")
+    return h.hexdigest()
+
+def get_indexed_pdf_digest(uid, month):
+    return PdfFile.get_digest(uid, month)
+
+def update_pdf_index(uid, month, digest):
+    '''index the volumes of the month as they are on disk'''
+    volumes = [(f, os.path.getsize(get_pdf_full_filename(f)))
+            for f in get_pdf_volume_filenames(uid, month)]
+    PdfFile.set_month(uid, month, volumes, digest)
+
+def remove_pdf_index(uid, month):
+    PdfFile.remove_month(uid, month)
+
 def get_pdf_full_filename(filename):
     filename = filename.replace("..", "").replace("/", "")
     pdf_file_dir = config.PDF_FILE_DOWNLOAD_DIR
@@ -0,0 +1,107 @@
+#-*- coding:utf-8 -*-
+
+'''per request profile: sql and mc round trips, time spent in them, and the
+slowest statements. started and stopped around each request in past.view,
+DB.execute and the mc client of past.store record into it.'''
+
+import time
+import json
+import heapq
+import threading
+import logging
+
+from past import config
+
+_local = threading.local()
+
+SLOWEST_COUNT = 5
+
+class RequestProfile(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.start_time = time.time()
+        self.end_time = None
+        self.status = None
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.mc_count = 0
+        self.mc_time = 0.0
+        self._slowest = []
+
+    def add_sql(self, sql, elapsed):
+        self.sql_count += 1
+        self.sql_time += elapsed
+        item = (elapsed, " ".join(str(sql).split()))
+        if len(self._slowest) < SLOWEST_COUNT:
+            heapq.heappush(self._slowest, item)
+        else:
+            heapq.heappushpop(self._slowest, item)
+
+    def add_mc(self, method, elapsed):
+        self.mc_count += 1
+        self.mc_time += elapsed
+
+    @property
+    def elapsed(self):
+        return (self.end_time or time.time()) - self.start_time
+
+    def slowest(self):
+        return sorted(self._slowest, reverse=True)
+
+    def header(self):
+        return "ms=%d;sql=%d;sql_ms=%d;mc=%d;mc_ms=%d" % (self.elapsed * 1000,
+                self.sql_count, self.sql_time * 1000, self.mc_count, self.mc_time * 1000)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "status": self.status,
+            "start": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.start_time)),
+            "ms": int(self.elapsed * 1000),
+            "sql": self.sql_count,
+            "sql_ms": int(self.sql_time * 1000),
+            "mc": self.mc_count,
+            "mc_ms": int(self.mc_time * 1000),
+            "slowest_sql": [[int(t * 1000), sql] for t, sql in self.slowest()],
+        }
+
+def start(name):
+    _local.profile = RequestProfile(name)
+    return _local.profile
+
+def stop():
+    p = current()
+    _local.profile = None
+    if p:
+        p.end_time = time.time()
+    return p
+
+def current():
+    return getattr(_local, "profile", None)
+
+def record_sql(sql, elapsed):
+    p = current()
+    p and p.add_sql(sql, elapsed)
+
+def record_mc(method, elapsed):
+    p = current()
+    p and p.add_mc(method, elapsed)
+
+_slow_log = None
+def get_slow_log():
+    global _slow_log
+    if _slow_log is None:
+        _slow_log = logging.getLogger("slow_request")
+        _slow_log.propagate = False
+        try:
+            _slow_log.addHandler(logging.FileHandler(config.SLOW_REQUEST_LOG))
+        except IOError, e:
+            print '---- open slow request log fail:', e
+            _slow_log.addHandler(logging.StreamHandler())
+    return _slow_log
+
+def log_if_slow(p, threshold=None):
+    threshold = config.SLOW_REQUEST_THRESHOLD if threshold is None else threshold
+    if p and p.elapsed >= threshold:
+        get_slow_log().warning(json.dumps(p.to_dict()))
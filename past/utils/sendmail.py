@@ -1,5 +1,7 @@
 #-*- coding:utf-8 -*-
 
+import time
+import socket
 import smtplib
 from email.MIMEMultipart import MIMEMultipart
 from email.MIMEBase import MIMEBase
@@ -18,9 +20,7 @@ def to_unicode(value):
     return value.decode("utf-8")
 
     
-def send_mail(to, fro, subject, text, html, files=None, 
-            server=config.SMTP_SERVER, 
-            user=config.SMTP_USER, password=config.SMTP_PASSWORD):
+def build_message(to, fro, subject, text, html, files=None):
     if to and not isinstance(to, list):
         to = [to,]
     assert type(to)==list
@@ -48,6 +48,14 @@ def send_mail(to, fro, subject, text, html, files=None,
         part.add_header('Content-Disposition', 'attachment; filename="%s"'
                        % os.path.basename(file))
         msg.attach(part)
+    return msg
+
+def send_mail(to, fro, subject, text, html, files=None, 
+            server=config.SMTP_SERVER, 
+            user=config.SMTP_USER, password=config.SMTP_PASSWORD):
+    if to and not isinstance(to, list):
+        to = [to,]
+    msg = build_message(to, fro, subject, text, html, files)
  
     smtp = smtplib.SMTP(server)
     if user and password:
@@ -55,6 +63,113 @@ def send_mail(to, fro, subject, text, html, files=None,
     smtp.sendmail(fro, to, msg.as_string() )
     smtp.close()
 
+## 批量发信(比如每天的提醒邮件)用的, 一个smtp连接发很多封, 不再每封都连接+登录
+## 断了自动重连, 按rate限速, 每个收件人的结果记在outcomes里
+class MailSender(object):
+    SENT = "sent"
+    REFUSED = "refused"
+    ERROR = "error"
+
+    def __init__(self, server=config.SMTP_SERVER, user=config.SMTP_USER,
+            password=config.SMTP_PASSWORD, rate=config.SMTP_RATE,
+            messages_per_session=config.SMTP_MESSAGES_PER_SESSION,
+            timeout=config.SMTP_TIMEOUT, retries=2):
+        self.server = server
+        self.user = user
+        self.password = password
+        self.rate = rate
+        self.messages_per_session = messages_per_session
+        self.timeout = timeout
+        self.retries = retries
+
+        self.outcomes = {}
+        self._smtp = None
+        self._session_messages = 0
+        self._last_send_time = 0
+        self._stats = {"sessions": 0, "reconnects": 0}
+
+    def _connect(self):
+        self.close()
+        smtp = smtplib.SMTP(self.server, timeout=self.timeout)
+        if self.user and self.password:
+            smtp.login(self.user, self.password)
+        self._smtp = smtp
+        self._session_messages = 0
+        self._stats["sessions"] += 1
+
+    def close(self):
+        if self._smtp:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, socket.error):
+                self._smtp.close()
+        self._smtp = None
+
+    def _wait(self):
+        if not self.rate:
+            return
+        delay = self._last_send_time + 1.0 / self.rate - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        self._last_send_time = time.time()
+
+    def send(self, to, fro, subject, text, html, files=None):
+        '''returns {recipient: outcome}, outcome is "sent", "refused" or "error: ..."'''
+        if to and not isinstance(to, list):
+            to = [to,]
+        msg = build_message(to, fro, subject, text, html, files).as_string()
+
+        self._wait()
+        refused = {}
+        error = None
+        for i in xrange(self.retries + 1):
+            try:
+                if not self._smtp or self._session_messages >= self.messages_per_session:
+                    self._connect()
+                self._session_messages += 1
+                refused = self._smtp.sendmail(fro, to, msg)
+                error = None
+                break
+            except smtplib.SMTPRecipientsRefused, e:
+                refused = e.recipients
+                error = None
+                break
+            except (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, 
+                    smtplib.SMTPHeloError, socket.error), e:
+                ## 连接断了或者服务器不理我们了, 重连再试
+                error = e
+                self._smtp and self._smtp.close()
+                self._smtp = None
+                self._stats["reconnects"] += 1
+            except smtplib.SMTPException, e:
+                ## 这封信被拒了(SMTPDataError, SMTPSenderRefused...), 连接还能接着用
+                error = e
+                break
+
+        r = {}
+        for x in to:
+            if error is not None:
+                r[x] = "%s: %s" % (self.ERROR, error)
+            elif x in refused:
+                r[x] = self.REFUSED
+            else:
+                r[x] = self.SENT
+        self.outcomes.update(r)
+        return r
+
+    def get_stats(self):
+        stats = dict(self._stats)
+        for outcome in self.outcomes.itervalues():
+            k = outcome.split(":")[0]
+            stats[k] = stats.get(k, 0) + 1
+        return stats
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
 if __name__ == "__main__":
     send_mail(['laiwei_ustc <laiwei.ustc@gmail.com>'],
         'today of the past<help@thepast.me>',
@@ -0,0 +1,48 @@
+#-*- coding:utf-8 -*-
+
+## 离线任务(pdf, 提醒邮件)共用的jinja环境，每个进程只建一次，
+## 编译好的模板还存在 config.TEMPLATE_CACHE_DIR，新进程也不用再编译
+
+import os
+import threading
+
+from past.utils import wrap_long_line, filters
+from past.utils.escape import clear_html_element
+from past import config
+
+_env = None
+_modules = {}
+_lock = threading.Lock()
+
+def get_env():
+    global _env
+    if _env is not None:
+        return _env
+    with _lock:
+        if _env is None:
+            from jinja2 import Environment, PackageLoader, FileSystemBytecodeCache
+            bcc = None
+            if config.TEMPLATE_CACHE_DIR:
+                if not os.path.isdir(config.TEMPLATE_CACHE_DIR):
+                    try:
+                        os.makedirs(config.TEMPLATE_CACHE_DIR)
+                    except OSError:
+                        pass
+                if os.path.isdir(config.TEMPLATE_CACHE_DIR):
+                    bcc = FileSystemBytecodeCache(config.TEMPLATE_CACHE_DIR)
+            env = Environment(loader=PackageLoader('past', 'templates'),
+                    bytecode_cache=bcc, auto_reload=False)
+            env.filters['wrap_long_line'] = wrap_long_line
+            env.filters['nl2br'] = filters.nl2br
+            env.filters['stream_time'] = filters.stream_time
+            env.filters['clear_html_element'] = clear_html_element
+            env.filters['isstr'] = lambda x: isinstance(x, basestring)
+            _env = env
+    return _env
+
+def get_template_module(name):
+    '''the macros of template name, e.g. get_template_module('mail.html').status_in_past'''
+    m = _modules.get(name)
+    if m is None:
+        m = _modules[name] = get_env().get_template(name).module
+    return m
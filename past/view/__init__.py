@@ -6,12 +6,16 @@ from past import app
 from past import config
 from past.store import db_conn
 from past.model.user import User, UserAlias
+from past.model.token_health import TokenHealth
+from past.api.error import OAuthTokenExpiredError
 from past.corelib import auth_user_from_session
+from past.utils import profile
 
 import settings, pdf_view, note, user_past, views
 
 @app.before_request
 def before_request():
+    profile.start("%s %s" % (request.method, request.path))
     g.config = config
     g.user = auth_user_from_session(session)
     #g.user = User.get(2)
@@ -49,9 +53,10 @@ def before_request():
         g.unbinded = [[x, tmp[x], config.OPENID_TYPE_NAME_DICT[x]] for x in unbinded]
 
         expired_providers = []
+        expired = [h.provider for h in TokenHealth.gets_by_user(g.user.id)
+                if h.status == OAuthTokenExpiredError.TYPE]
         for t in [ua.type for ua in g.user.get_alias()]:
-            p = g.user.get_thirdparty_profile(t)
-            if p and p.get("expired"):
+            if t in expired:
                 _ = [t, config.OPENID_TYPE_DICT_REVERSE.get(t), config.OPENID_TYPE_NAME_DICT.get(t, "")]
                 expired_providers.append(_)
         g.expired = expired_providers
@@ -61,7 +66,17 @@ def before_request():
     else:
         g.unbinded = None
 
+@app.after_request
+def after_request(response):
+    p = profile.current()
+    if p:
+        p.status = response.status_code
+        if config.PROFILE_HEADER:
+            response.headers["X-Past-Profile"] = p.header()
+    return response
+
 @app.teardown_request
 def teardown_request(exception):
     #http://stackoverflow.com/questions/9318347/why-are-some-mysql-connections-selecting-old-data-the-mysql-database-after-a-del
     db_conn.commit()
+    profile.log_if_slow(profile.stop())
@@ -1,7 +1,6 @@
 #-*- coding:utf-8 -*-
 import os
-from datetime import datetime, timedelta
-import calendar
+from datetime import datetime
 import time
 from collections import defaultdict
 
@@ -10,11 +9,10 @@ from flask import g, request, redirect, url_for, abort, render_template,\
 
 from past import app
 from past import config
-from past.model.user import User, PdfSettings
-from past.model.status import Status
+from past.model.user import User, PdfSettings, PdfFile
 
 from past.utils import sizeof_fmt
-from past.utils.pdf import is_pdf_file_exists, get_pdf_filename, get_pdf_full_filename
+from past.utils.pdf import is_pdf_file_exists, get_pdf_full_filename
 from past.utils.escape import json_encode
 from past import consts
 from .utils import require_login, check_access_user, statuses_timelize, get_sync_list
@@ -68,22 +66,17 @@ def pdf(uid):
     intros = [g.user.get_thirdparty_profile(x).get("intro") for x in config.OPENID_TYPE_DICT.values()]
     intros = filter(None, intros)
 
+    ## generate_pdf维护的索引, 一次查出来, 不用每个月都去stat
     pdf_files = []
-    start_date = Status.get_oldest_create_time(None, user.id)
-    now = datetime.now()
-    d = start_date
-    while d and d <= now:
-        pdf_filename = get_pdf_filename(user.id, d.strftime("%Y%m"))
-        if is_pdf_file_exists(pdf_filename):
-            full_file_name = get_pdf_full_filename(pdf_filename)
-            pdf_files.append([d, pdf_filename, sizeof_fmt(os.path.getsize(full_file_name))])
-
-        days = calendar.monthrange(d.year, d.month)[1]
-        d += timedelta(days=days)
-        d = datetime(d.year, d.month, 1)
+    for f in PdfFile.gets_by_user(user.id):
+        if f.volume == 1:
+            d = datetime.strptime(f.month, "%Y%m")
+            pdf_files.append([d, f.filename, sizeof_fmt(f.size), []])
+        elif pdf_files and pdf_files[-1][0].strftime("%Y%m") == f.month:
+            pdf_files[-1][3].append([f.filename, sizeof_fmt(f.size)])
     files_dict = defaultdict(list)
-    for date, filename, filesize in pdf_files:
-        files_dict[date.year].append([date, filename, filesize])
+    for date, filename, filesize, more_volumes in pdf_files:
+        files_dict[date.year].append([date, filename, filesize, more_volumes])
 
     pdf_applyed = PdfSettings.is_user_id_exists(g.user.id)
     return render_template("v2/pdf.html", **locals())
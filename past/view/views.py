@@ -1,5 +1,7 @@
 #-*- coding:utf-8 -*-
+import time
 import datetime
+import threading
 
 from collections import defaultdict
 from flask import g, session, request, \
@@ -87,23 +89,36 @@ def reshare():
         providers = g.binds
     
     providers_ = []
+    shares = {}
     for p in config.CAN_SHARED_OPENID_TYPE:
         if p in providers:
-            g.user.set_thirdparty_profile_item(p, "share", "Y")
+            shares[p] = {"share": "Y"}
             providers_.append(p)
         else:
-            g.user.set_thirdparty_profile_item(p, "share", "N")
+            shares[p] = {"share": "N"}
+    ## 勾选的结果一次写进profile, 不再每家读写一遍
+    g.user.set_thirdparty_profile_items(shares)
     
     failed_providers = []
-    for p in providers_:
-        try:
-            post_status(g.user, p, text + ",".join(images))
-        except OAuthError, e:
-            log.warning("%s" % e)
+    error_providers = []
+    timeout_providers = []
+    for p, e in post_status_concurrently(g.user, providers_, text + ",".join(images)).iteritems():
+        if e == POST_TIMEOUT:
+            timeout_providers.append(config.OPENID_TYPE_NAME_DICT.get(p, ""))
+        elif isinstance(e, OAuthError):
             failed_providers.append(config.OPENID_TYPE_NAME_DICT.get(p, ""))
+        elif e:
+            error_providers.append(config.OPENID_TYPE_NAME_DICT.get(p, ""))
+    msgs = []
     if failed_providers:
+        msgs.append(u"分享到" + u",".join(failed_providers) + u"失败了，可能是授权过期了，重新授权就ok：）")
+    if error_providers:
+        msgs.append(u"分享到" + u",".join(error_providers) + u"出错了，请稍后再试一下")
+    if timeout_providers:
+        msgs.append(u",".join(timeout_providers) + u"响应太慢了，可能还没有分享成功，稍后去看一下吧")
+    if msgs:
         ret['ok'] = 0
-        ret['msg'] = "分享到" + ",".join(failed_providers) + "失败了，可能是授权过期了，重新授权就ok：）"
+        ret['msg'] = " ".join(msgs)
     return json_encode(ret)
 
 @app.route("/sync/<cates>", methods=["GET", "POST"])
@@ -150,7 +165,39 @@ def sync(cates):
     
     return json_encode({'ok':'true'})
 
-def post_status(user, provider=None, msg=""):
+POST_TIMEOUT = "timeout"
+
+def post_status_concurrently(user, providers, msg="", timeout=None):
+    '''post to the providers at the same time, waits at most timeout seconds.
+    returns {provider: None if succ, the exception, or POST_TIMEOUT}'''
+    timeout = timeout or config.RESHARE_TIMEOUT
+    ## 线程里没有request context, 腾讯微博要的clientip先取出来
+    clientip = request.remote_addr
+    results = {}
+
+    def post(p):
+        ## 每个线程自己的db连接, 超时的线程写token_health时请求可能已经结束了
+        with db_conn.own_connection():
+            try:
+                post_status(user, p, msg, clientip)
+                results[p] = None
+            except Exception, e:
+                log.warning("post status to %s fail: %s" % (p, e))
+                results[p] = e
+
+    threads = []
+    for p in providers:
+        t = threading.Thread(target=post, args=(p,))
+        t.setDaemon(True)
+        t.start()
+        threads.append(t)
+    deadline = time.time() + timeout
+    for t in threads:
+        t.join(max(0, deadline - time.time()))
+    ## 超时的线程不管它, 发完自己结束
+    return dict((p, results.get(p, POST_TIMEOUT)) for p in providers)
+
+def post_status(user, provider=None, msg="", clientip=None):
     if msg and isinstance(msg, unicode):                                           
         msg = msg.encode("utf8") 
     if not provider or provider == config.OPENID_TYPE_DICT[config.OPENID_DOUBAN]:
@@ -183,4 +230,4 @@ def post_status(user, provider=None, msg=""):
         if client:
             if not msg:
                 msg = "#thepast.me# 你好，旧时光| 我在用thepast, 微博备份，往事提醒，你也来试试吧 >> http://thepast.me "
-            client.post_status(msg)
+            client.post_status(msg, clientip)
@@ -1,7 +1,9 @@
 import sys
 sys.path.append('../')
 import os
-import commands
+
+from past import config
+from past.utils.pdf import compress_pdf
 
 def file_visitor(args, dir_, files):
     if not isinstance(files, list):
@@ -9,8 +11,6 @@ def file_visitor(args, dir_, files):
     for f in files:
         if not (f.startswith("thepast.me_") and f.endswith(".pdf")):
             continue
-        cmd = "cd ../var/down/pdf/ && tar -zcvf %s.tar.gz %s && rm %s" %(f, f, f)
-        print "-----", cmd
-        print commands.getoutput(cmd)
+        print "-----", f, "->", compress_pdf(f)
 
-os.path.walk("../var/down/pdf/", file_visitor, None)
+os.path.walk(config.PDF_FILE_DOWNLOAD_DIR, file_visitor, None)
@@ -0,0 +1,43 @@
+#-*- coding:utf-8 -*-
+# 把pdf_file表之前生成的pdf扫一遍记到pdf_file里, 不然/pdf页面上看不到
+# 当作是最新的, digest按现在的status算
+
+import sys
+sys.path.append('../')
+import os
+import re
+import datetime
+import calendar
+
+from past import config
+from past.utils.pdf import get_pdf_digest, get_indexed_pdf_digest, update_pdf_index
+
+## thepast.me_{uid}_{month}.pdf.tar.gz, 第一卷, 有它这个月才是生成完了的
+PDF_FILE_RE = re.compile(r'^thepast\.me_(\d+)_(\d{6})\.pdf\.tar\.gz$')
+
+def index_month(user_id, month):
+    if get_indexed_pdf_digest(user_id, month) is not None:
+        return False
+    d = datetime.datetime.strptime(month, "%Y%m")
+    start_date = datetime.datetime(d.year, d.month, 1)
+    end_date = datetime.datetime(d.year, d.month,
+            calendar.monthrange(d.year, d.month)[1], 23, 59, 59)
+    ## 这个月已经没有status了的话记个空的digest, generate_pdf下次会把文件删掉
+    digest = get_pdf_digest(user_id, start_date, end_date) or ""
+    update_pdf_index(user_id, month, digest)
+    return True
+
+def index_all():
+    n = 0
+    for f in sorted(os.listdir(config.PDF_FILE_DOWNLOAD_DIR)):
+        m = PDF_FILE_RE.match(f)
+        if not m:
+            continue
+        user_id, month = m.groups()
+        if index_month(user_id, month):
+            n += 1
+            print '---- indexed', f
+    print '---- %s months indexed' % n
+
+if __name__ == "__main__":
+    index_all()
@@ -0,0 +1,92 @@
+#-*- coding:utf-8 -*-
+# 把profile里记的授权过期搬到token_health表
+# 整个json的user_profile和拆成一项一行的user_profile_item("D:expired"这样的key)都看,
+# 和tools/split_user_profile.py谁先跑都可以
+
+import sys
+sys.path.append('../')
+import datetime
+
+from past.store import db_conn
+from past.model.token_health import TokenHealth
+from past.api.error import OAuthTokenExpiredError
+from past.utils.escape import json_decode
+from past import config
+
+def parse_time(t):
+    for fmt in ("%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%d %H:%M:%S"):
+        try:
+            return datetime.datetime.strptime(str(t), fmt)
+        except ValueError:
+            pass
+    return datetime.datetime.now()
+
+def mark_expired(user_id, t, since):
+    TokenHealth.set_status(user_id, t, OAuthTokenExpiredError.TYPE)
+    cursor = db_conn.execute('''update token_health set since=%s 
+            where user_id=%s and provider=%s''', 
+            (parse_time(since), user_id, t))
+    db_conn.commit()
+    cursor and cursor.close()
+    TokenHealth._clear_cache(user_id)
+    print '---- user %s %s expired' % (user_id, t)
+
+def move_expired():
+    last_id = 0
+    n = 0
+    while True:
+        cursor = db_conn.execute('''select user_id, profile from user_profile 
+                where user_id>%s order by user_id limit 500''', last_id)
+        rows = cursor.fetchall()
+        cursor and cursor.close()
+        if not rows:
+            break
+        for user_id, profile in rows:
+            last_id = user_id
+            try:
+                p = json_decode(profile) if profile else {}
+            except ValueError:
+                continue
+            for t in config.OPENID_TYPE_DICT.values():
+                x = p.get(t)
+                if isinstance(x, basestring):
+                    try:
+                        x = json_decode(x) if x else {}
+                    except ValueError:
+                        x = {}
+                if not (x and x.get(OAuthTokenExpiredError.TYPE)):
+                    continue
+                mark_expired(user_id, t, x.get(OAuthTokenExpiredError.TYPE))
+                n += 1
+    print '---- %s expired tokens moved from user_profile' % n
+    return n
+
+def move_expired_items():
+    keys = ["%s:%s" % (t, OAuthTokenExpiredError.TYPE) for t in config.OPENID_TYPE_DICT.values()]
+    last_id, last_key = 0, ""
+    n = 0
+    while True:
+        cursor = db_conn.execute('''select user_id, `key`, value from user_profile_item 
+                where `key` in (%s) and (user_id>%%s or (user_id=%%s and `key`>%%s))
+                order by user_id, `key` limit 500''' % ",".join(["%s"] * len(keys)), 
+                tuple(keys + [last_id, last_id, last_key]))
+        rows = cursor.fetchall()
+        cursor and cursor.close()
+        if not rows:
+            break
+        for user_id, key, value in rows:
+            last_id, last_key = user_id, key
+            try:
+                since = json_decode(value) if value else None
+            except ValueError:
+                continue
+            if not since:
+                continue
+            mark_expired(user_id, key.split(":", 1)[0], since)
+            n += 1
+    print '---- %s expired tokens moved from user_profile_item' % n
+    return n
+
+if __name__ == "__main__":
+    move_expired()
+    move_expired_items()
@@ -3,6 +3,7 @@ sys.path.append('../')
 import os
 
 from past.store import db_conn
+from past.model.user import PdfFile
 
 user_ids = []
 cursor = db_conn.execute('''select user_id from pdf_settings''')
@@ -28,5 +29,6 @@ def file_visitor(args, dir_, files):
     for user_id in pendding:
         print '---deleting pdf of', user_id
         os.popen("rm ../var/down/pdf/thepast.me_%s_2*.pdf.tar.gz" %user_id)
+        PdfFile.remove_by_user(user_id)
 
 os.path.walk("../var/down/pdf/", file_visitor, None)
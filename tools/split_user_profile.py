@@ -0,0 +1,46 @@
+#-*- coding:utf-8 -*-
+# 把user_profile里整个json的profile拆到user_profile_item, 一项一行
+
+import sys
+sys.path.append('../')
+
+from past.store import db_conn
+from past.model.kv import UserProfile, UserProfileItem
+from past.utils.escape import json_decode
+
+def split_profile(user_id, profile):
+    try:
+        p = json_decode(profile) if profile else {}
+    except ValueError:
+        print '---- decode profile of user %s fail' % user_id
+        return False
+
+    items = UserProfileItem.flatten(p)
+
+    ## 已经有的是后来写的, 比json里的新
+    old = UserProfileItem.gets(user_id)
+    ## 确实写进去了才能删json, 不然profile就丢了
+    if not UserProfileItem.set(user_id, dict((k, v) for k, v in items.iteritems() if k not in old)):
+        print '---- write profile items of user %s fail' % user_id
+        return False
+    UserProfile.remove(user_id)
+    return True
+
+def split_all():
+    last_id = 0
+    n = 0
+    while True:
+        cursor = db_conn.execute('''select user_id, profile from user_profile 
+                where user_id>%s order by user_id limit 500''', last_id)
+        rows = cursor.fetchall()
+        cursor and cursor.close()
+        if not rows:
+            break
+        for user_id, profile in rows:
+            last_id = user_id
+            if split_profile(user_id, profile):
+                n += 1
+    print '---- profile of %s users split' % n
+
+if __name__ == "__main__":
+    split_all()